@@ -0,0 +1,233 @@
+#!/usr/bin/python3
+
+""" Headless scaling benchmark of negi3wm modules.
+
+Starts FakeI3Server with the synthetic tree of N windows spread over the
+workspaces, where window classes are taken from circle and scratchpad
+configs, so the tags have windows. Then creates modules over the real
+i3ipc connection to it and runs typical bindings, handling the i3 events
+they cause, as the daemon does. Reports milliseconds and i3 messages per
+operation for every number of windows, so the scaling curve is visible.
+Neither i3 nor X is needed. With scratchpad loaded it also checks that the
+mirror follows the compound commands of scratchpad retag, the exit status is
+non-zero if it goes stale.
+
+Usage:
+    ./fake_bench.py [-n <windows>] [-w <workspaces>] [-r <rounds>]
+                    [-m <modules>]
+
+Options:
+    -n <windows>        comma-separated numbers of windows
+                        [default: 10,100,1000,3000].
+    -w <workspaces>     number of workspaces [default: 10].
+    -r <rounds>         runs of every operation [default: 20].
+    -m <modules>        comma-separated modules to load
+                        [default: scratchpad,circle,actions,remember_focused].
+
+Run it from the i3 config directory:
+
+    PYTHONPATH=${XDG_CONFIG_HOME}/i3 python -m bin.fake_bench
+
+Created by :: Neg
+email :: <serg.zorg@gmail.com>
+github :: https://github.com/neg-serg?tab=repositories
+year :: 2020
+
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import timeit
+import importlib
+from typing import List, Tuple
+from docopt import docopt
+
+import qtoml
+import i3ipc
+
+from lib.cmdbatch import CmdBatch
+from lib.fake_i3 import FakeI3, FakeI3Server, FakeX
+from lib.i3events import I3Events
+from lib.misc import Misc
+from lib.treemirror import TreeMirror
+
+
+class fake_bench():
+    def __init__(self, windows: List[int], workspaces: int, rounds: int,
+                 mods: List[str]) -> None:
+        self.windows = windows
+        self.workspaces = workspaces
+        self.rounds = rounds
+        self.mod_names = mods
+        self.failed = 0
+        self.cfgs = {
+            name: fake_bench.load_cfg(name) for name in ('circle', 'scratchpad')
+        }
+        self.i3 = None
+
+    @staticmethod
+    def load_cfg(name: str) -> dict:
+        with open(f'{Misc.i3path()}/cfg/{name}.toml', 'r') as fp:
+            return qtoml.load(fp)
+
+    def classes(self) -> List[Tuple[str, str]]:
+        """ (class, instance) of windows: one per configured tag, and the
+        same number of windows without tags. """
+        ret = []
+        for cfg in self.cfgs.values():
+            for tag, rules in cfg.items():
+                wm_classes = rules.get('class') or [tag]
+                instances = rules.get('instance') or [wm_classes[0].lower()]
+                ret.append((wm_classes[0], instances[0]))
+        ret += [(f'Untagged{num}', f'untagged{num}') for num in range(len(ret))]
+        return ret
+
+    def scratch_tag(self) -> str:
+        """ First scratchpad tag with windows. """
+        return next(
+            tag for tag in self.cfgs['scratchpad'] if tag != 'transients'
+        )
+
+    def operations(self) -> List[Tuple[str, str, List[str]]]:
+        """ (name, module, binding args) to measure. """
+        scratch_tag = self.scratch_tag()
+        circle_tag = next(iter(self.cfgs['circle']))
+        ops = [
+            (f'scratchpad toggle {scratch_tag}', 'scratchpad',
+             ['toggle', scratch_tag]),
+            ('scratchpad next', 'scratchpad', ['next']),
+            (f'circle next {circle_tag}', 'circle', ['next', circle_tag]),
+            ('actions maximize', 'actions', ['maximize']),
+            ('actions grow', 'actions', ['grow']),
+            ('remember_focused switch', 'remember_focused', ['switch']),
+            ('remember_focused focus_next', 'remember_focused',
+             ['focus_next']),
+        ]
+        return [op for op in ops if op[1] in self.mod_names]
+
+    def drain(self) -> None:
+        """ Handle all i3 events which are sent already. """
+        while I3Events.pending(self.i3):
+            I3Events.poll(self.i3)
+
+    def check_retag(self, mod, fake: FakeI3) -> List[str]:
+        """ Show windows of the scratchpad tag and forget the tag, then match
+        them again by retag. Its `mark, move scratchpad, <geom>` commands
+        should place the windows in the mirror by expected moves, without
+        any snapshot. Returns the mirror errors.
+            mod: scratchpad module.
+            fake: fake i3 to compare the mirror with. """
+        wins = list(mod.marked[self.scratch_tag()].values())
+        with CmdBatch() as batch:
+            for win in wins:
+                batch.add('move window to workspace current', win)
+        self.drain()
+        for win in wins:
+            mod.del_marked(win.id)
+        snapshots = TreeMirror.snapshots
+        mod.retag({self.scratch_tag()}, wins)
+        self.drain()
+        ret = []
+        if TreeMirror.snapshots != snapshots:
+            ret.append('retag took the snapshot')
+        for win in wins:
+            real = fake.workspace_of(win.id)['name']
+            mirrored = TreeMirror.ws_of.get(win.id) \
+                if TreeMirror.placed(win.id) else None
+            if mirrored != real:
+                ret.append(f'{win.id}: {mirrored} instead of {real}')
+        return ret
+
+    def run_one(self, windows: int) -> dict:
+        """ Returns operation -> (ms, i3 messages) per run. """
+        fake = FakeI3(
+            FakeI3.synthetic_tree(windows, self.workspaces, self.classes()),
+            execute=True
+        )
+        sock_dir = tempfile.mkdtemp(prefix='fake-i3-')
+        path = os.path.join(sock_dir, 'ipc.sock')
+        server = FakeI3Server(fake, path)
+        server.start()
+        ret = {}
+        try:
+            self.i3 = i3ipc.Connection(path)
+            FakeX.install()
+            TreeMirror.init(self.i3)
+            CmdBatch.init(self.i3)
+            mods = {}
+            for name in self.mod_names:
+                mod_class = getattr(importlib.import_module('lib.' + name), name)
+                calls = sum(fake.calls.values())
+                start = timeit.default_timer()
+                mods[name] = mod_class(self.i3)
+                ret[f'{name} init'] = (
+                    (timeit.default_timer() - start) * 1000,
+                    sum(fake.calls.values()) - calls
+                )
+            I3Events.attach(self.i3)
+            self.drain()
+            win_ids = [win.id for win in TreeMirror.leaves()]
+            ops = self.operations() + [('i3 focus event', None, [])]
+            for name, mod, args in ops:
+                calls = sum(fake.calls.values())
+                start = timeit.default_timer()
+                for num in range(self.rounds):
+                    if mod is None:
+                        # focus storm: handlers of every module run
+                        self.i3.command(
+                            f'[con_id={win_ids[num * 7 % len(win_ids)]}] focus'
+                        )
+                    else:
+                        mods[mod].send_msg(args)
+                    self.drain()
+                ret[name] = (
+                    (timeit.default_timer() - start) * 1000 / self.rounds,
+                    (sum(fake.calls.values()) - calls) / self.rounds
+                )
+            if 'scratchpad' in mods:
+                errors = self.check_retag(mods['scratchpad'], fake)
+                if errors:
+                    self.failed += 1
+                    print(f'{windows} windows, stale mirror after retag: '
+                          f'{", ".join(errors)}')
+            self.i3.main_quit()
+        finally:
+            server.stop()
+            shutil.rmtree(sock_dir, ignore_errors=True)
+        if fake.unsupported:
+            print(f'{windows} windows, unsupported commands: '
+                  f'{dict(fake.unsupported)}')
+        return ret
+
+    def run(self) -> int:
+        """ Print results, returns non-zero status if some check failed. """
+        results = {windows: self.run_one(windows) for windows in self.windows}
+        names = list(results[self.windows[0]])
+        for title, pos, fmt in (('ms per op', 0, '.3f'),
+                                ('i3 messages per op', 1, '.1f')):
+            print(f'{title:<36s}' + ''.join(
+                f'{windows:>10d}' for windows in self.windows
+            ))
+            for name in names:
+                print(f'{name:<36s}' + ''.join(
+                    f'{results[windows][name][pos]:>10{fmt}}'
+                    for windows in self.windows
+                ))
+        return 1 if self.failed else 0
+
+
+def main():
+    """ Run benchmark from here """
+    cmd_args = docopt(__doc__)
+    sys.exit(fake_bench(
+        [int(num) for num in cmd_args['-n'].split(',')],
+        int(cmd_args['-w']), int(cmd_args['-r']),
+        [mod.strip() for mod in cmd_args['-m'].split(',') if mod.strip()]
+    ).run())
+
+
+if __name__ == '__main__':
+    os.environ.pop('I3SOCK', None)
+    main()
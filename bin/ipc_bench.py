@@ -0,0 +1,166 @@
+#!/usr/bin/python3
+
+""" negi3wm IPC transport micro-benchmark.
+
+Starts MsgBroker in-process with the no-op module and measures round trip
+latency of the unix socket and TCP transports: connect, send one command,
+half-close and wait for the daemon to close the connection. Then it compares
+the batch of commands sent in one connection with the same commands sent one
+by one, and the keypress paths: `exec send` spawned via shell like i3 does it
+versus `nop negi3wm` command taken from the i3 binding event in-process. The
+keypress latency is measured until the binding is actually run.
+
+Usage:
+    ./ipc_bench.py [-n <count>]
+
+Options:
+    -n <count>      number of round trips per transport [default: 2000].
+
+Run it from the i3 config directory:
+
+    PYTHONPATH=${XDG_CONFIG_HOME}/i3 python -m bin.ipc_bench
+
+Created by :: Neg
+email :: <serg.zorg@gmail.com>
+github :: https://github.com/neg-serg?tab=repositories
+year :: 2020
+
+"""
+
+import os
+import socket
+import subprocess
+import asyncio
+import tempfile
+import threading
+import time
+import timeit
+from docopt import docopt
+
+from lib.msgbroker import MsgBroker
+
+
+class noop():
+    """ Module which does nothing, so only the transport is measured. """
+    def __init__(self):
+        self.done = threading.Event()
+        self.bindings = {"ping": lambda *_: self.done.set()}
+
+    def send_msg(self, args):
+        return self.bindings[args[0]](*args[1:])
+
+
+class ipc_bench():
+    def __init__(self, count: int):
+        self.count = count
+        self.batch_size = 4
+        self.port = ipc_bench.free_port()
+        self.runtime_dir = tempfile.mkdtemp()
+        self.path = self.runtime_dir + '/negi3wm.sock'
+        self.loop = asyncio.new_event_loop()
+        self.noop = noop()
+
+    @staticmethod
+    def free_port() -> int:
+        """ Find free localhost TCP port. """
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.bind(('localhost', 0))
+            return sock.getsockname()[1]
+
+    def start(self) -> None:
+        """ Run MsgBroker in the background thread. """
+        threading.Thread(
+            target=MsgBroker.mainloop,
+            args=(self.loop, {'noop': self.noop}, self.port, True, self.path),
+            daemon=True
+        ).start()
+        while not os.path.exists(self.path):
+            time.sleep(0.01)
+
+    @staticmethod
+    def round_trip(family, addr, cmd=b'noop ping\n') -> float:
+        """ Measure one request in seconds. """
+        start = timeit.default_timer()
+        with socket.socket(family, socket.SOCK_STREAM) as sock:
+            sock.connect(addr)
+            sock.sendall(cmd)
+            sock.shutdown(socket.SHUT_WR)
+            while sock.recv(1024):
+                pass
+        return timeit.default_timer() - start
+
+    def measure(self, family, addr, cmds=(b'noop ping\n',)) -> list:
+        """ Returns sorted times in microseconds, every sample is the round
+        trip per each of [cmds]. """
+        def sample():
+            return sum(ipc_bench.round_trip(family, addr, c) for c in cmds)
+        for _ in range(min(100, self.count)): # warm up
+            sample()
+        return sorted(sample() * 1e6 for _ in range(self.count))
+
+    def keypress(self, dispatch) -> list:
+        """ Returns sorted times in microseconds from the keypress dispatch
+        to the binding run. """
+        def sample():
+            self.noop.done.clear()
+            start = timeit.default_timer()
+            dispatch()
+            self.noop.done.wait()
+            return timeit.default_timer() - start
+        for _ in range(min(100, self.count)): # warm up
+            sample()
+        return sorted(sample() * 1e6 for _ in range(self.count))
+
+    def spawn_send(self) -> None:
+        """ What i3 does for `exec --no-startup-id send noop ping`. """
+        send_path = os.path.dirname(os.path.abspath(__file__)) + '/send'
+        subprocess.run(
+            ['/bin/sh', '-c', f'{send_path} noop ping'], check=True,
+            env={**os.environ, 'XDG_RUNTIME_DIR': self.runtime_dir}
+        )
+
+    @staticmethod
+    def nop_binding() -> None:
+        """ What negi3wm does for the `nop negi3wm noop ping` binding. """
+        MsgBroker.dispatch_i3_cmd('nop negi3wm noop ping, mode "default"')
+
+    @staticmethod
+    def report(name: str, times: list) -> None:
+        """ Print latency percentiles. """
+        def pct(val):
+            return times[min(len(times) - 1, int(len(times) * val))]
+        print(f'{name:<6s} n={len(times)} min={times[0]:.1f}us '
+              f'p50={pct(0.5):.1f}us p90={pct(0.9):.1f}us '
+              f'p99={pct(0.99):.1f}us')
+
+    def run(self) -> None:
+        self.start()
+        ipc_bench.report('unix', self.measure(socket.AF_UNIX, self.path))
+        ipc_bench.report(
+            'tcp', self.measure(socket.AF_INET, ('localhost', self.port))
+        )
+        batch = ' ; '.join(['noop ping'] * self.batch_size)
+        ipc_bench.report(
+            f'{self.batch_size}x1', self.measure(
+                socket.AF_UNIX, self.path,
+                [b'@0 noop ping\n'] * self.batch_size
+            )
+        )
+        ipc_bench.report(
+            f'1x{self.batch_size}', self.measure(
+                socket.AF_UNIX, self.path, [f'@0 {batch}\n'.encode()]
+            )
+        )
+        ipc_bench.report('exec', self.keypress(self.spawn_send))
+        ipc_bench.report('nop', self.keypress(ipc_bench.nop_binding))
+        os.remove(self.path)
+
+
+def main():
+    """ Run benchmark from here """
+    cmd_args = docopt(__doc__)
+    ipc_bench(int(cmd_args['-n'])).run()
+
+
+if __name__ == '__main__':
+    main()
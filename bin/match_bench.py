@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+
+""" Window matching micro-benchmark.
+
+Generates synthetic configs with the given numbers of tags, where most of
+the tags have exact class/instance rules and every tenth tag has regexes too,
+and measures the time to find all tags of the window: the match() call for
+every tag versus the match_tags() lookup in the inverted index. Windows are
+a mix of matching and unknown ones.
+
+Usage:
+    ./match_bench.py [-n <count>] [-t <tags>...]
+
+Options:
+    -n <count>      number of windows to match [default: 2000].
+    -t <tags>       numbers of tags in config [default: 10 100 1000].
+
+Run it from the i3 config directory:
+
+    PYTHONPATH=${XDG_CONFIG_HOME}/i3 python -m bin.match_bench
+
+Created by :: Neg
+email :: <serg.zorg@gmail.com>
+github :: https://github.com/neg-serg?tab=repositories
+year :: 2020
+
+"""
+
+import random
+import timeit
+from types import SimpleNamespace
+from docopt import docopt
+
+from lib.matcher import Matcher
+
+
+class synthetic(Matcher):
+    """ Matcher over the generated config. """
+    def __init__(self, tags: int):
+        self.cfg = {}
+        for num in range(tags):
+            rules = {
+                'class': [f'Class{num}', f'Alt{num}'],
+                'instance': f'inst{num}',
+            }
+            if num % 10 == 0:
+                rules['class_r'] = [f'^Re{num}-.*', f'.*-re{num}$']
+                rules['name_r'] = [f'title {num}']
+            self.cfg[f'tag{num}'] = rules
+        super().__init__()
+
+
+class match_bench():
+    def __init__(self, count: int, tags):
+        self.count = count
+        self.tags = [int(tag) for tag in tags]
+
+    @staticmethod
+    def windows(count: int, tags: int):
+        """ Windows with exact, regex and no matches. """
+        rnd = random.Random(tags)
+        ret = []
+        for _ in range(count):
+            num = rnd.randrange(tags)
+            ret.append(SimpleNamespace(**rnd.choice([
+                {'window_class': f'Class{num}', 'window_instance': 'x'},
+                {'window_class': 'x', 'window_instance': f'inst{num}'},
+                {'window_class': f'Re{num // 10 * 10}-x',
+                 'window_instance': 'x'},
+                {'window_class': 'Unknown', 'window_instance': 'unknown'},
+            ]), window_role='', name=f'window {num}'))
+        return ret
+
+    @staticmethod
+    def per_tag(matcher, win):
+        return [tag for tag in matcher.cfg if matcher.match(win, tag)]
+
+    def run(self) -> None:
+        print(f'{"tags":>6s}{"per tag, us":>14s}{"index, us":>14s}')
+        for tags in self.tags:
+            matcher = synthetic(tags)
+            wins = match_bench.windows(self.count, tags)
+            for win in wins:
+                # warm up regex memo and check the results
+                assert matcher.match_tags(win) == \
+                    match_bench.per_tag(matcher, win)
+            timings = []
+            for func in (lambda win: match_bench.per_tag(matcher, win),
+                         matcher.match_tags):
+                start = timeit.default_timer()
+                for win in wins:
+                    func(win)
+                timings.append(
+                    (timeit.default_timer() - start) * 1e6 / len(wins)
+                )
+            print(f'{tags:>6d}{timings[0]:>14.2f}{timings[1]:>14.2f}')
+
+
+def main():
+    """ Run benchmark from here """
+    cmd_args = docopt(__doc__)
+    match_bench(int(cmd_args['-n']), cmd_args['-t']).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+#!/usr/bin/python3
+
+""" Replay the session recorded by `negi3wm.py --record <file>`.
+
+Modules are created against FakeI3 built from the recorded tree snapshot,
+then recorded i3 events and IPC commands are fed to them in the original
+order, as fast as possible. The report shows CPU time and i3 calls per event
+handler and per binding, so slowdowns seen on the desktop, like the storm of
+workspace switches with hundreds of windows, can be reproduced and profiled
+on any box.
+
+Keypresses are recorded as i3 binding and tick events only, their
+`nop negi3wm` commands are dispatched by the same MsgBroker handlers as in
+the daemon. Replay checks that every such command of the loaded modules has
+run successfully and exits with 1 otherwise.
+
+Usage:
+    ./replay.py <file> [-m <module>...]
+
+Options:
+    -m <module>     module to load, can be repeated, all non-lazy modules
+                    from the negi3wm config by default.
+
+Run it from the i3 config directory:
+
+    PYTHONPATH=${XDG_CONFIG_HOME}/i3 python -m bin.replay session.jsonl.gz
+
+Created by :: Neg
+email :: <serg.zorg@gmail.com>
+github :: https://github.com/neg-serg?tab=repositories
+year :: 2020
+
+"""
+
+import sys
+import time
+import asyncio
+import traceback
+import collections
+import qtoml
+import importlib
+from typing import List
+from docopt import docopt
+
+from lib.cmdbatch import CmdBatch
+from lib.fake_i3 import FakeI3, FakeConnection, FakeX
+from lib.i3events import I3Events
+from lib.latency import Latency
+from lib.msgbroker import MsgBroker
+from lib.recorder import Recorder
+from lib.misc import Misc
+from lib.treemirror import TreeMirror
+
+
+class CpuTimes():
+    """ CPU time and i3 calls per handler or binding. """
+    def __init__(self, fake: FakeI3) -> None:
+        self.fake = fake
+        self.stats = {} # key -> [count, cpu seconds, max cpu, i3 calls]
+
+    def measure(self, key: str, func, *args):
+        """ Call func(*args) and account it to the key. """
+        calls = sum(self.fake.calls.values())
+        start = time.process_time()
+        try:
+            return func(*args)
+        finally:
+            self.account(key, time.process_time() - start, calls)
+
+    def account(self, key: str, cpu: float, calls: int) -> None:
+        """ Add the call which started when the fake had [calls] calls. """
+        stats = self.stats.setdefault(key, [0, 0.0, 0.0, 0])
+        stats[0] += 1
+        stats[1] += cpu
+        stats[2] = max(stats[2], cpu)
+        stats[3] += sum(self.fake.calls.values()) - calls
+
+    def report(self) -> List[str]:
+        """ Table sorted by the total CPU time. """
+        ret = [
+            f'{"handler":<40s}{"count":>8s}{"cpu ms":>10s}{"avg ms":>10s}'
+            f'{"max ms":>10s}{"i3 calls":>10s}'
+        ]
+        for key, (count, cpu, max_cpu, calls) in sorted(
+                self.stats.items(), key=lambda item: -item[1][1]):
+            ret.append(
+                f'{key:<40s}{count:>8d}{cpu * 1000:>10.2f}'
+                f'{cpu * 1000 / count:>10.3f}{max_cpu * 1000:>10.3f}'
+                f'{calls:>10d}'
+            )
+        return ret
+
+
+class replay():
+    def __init__(self, path: str, mods: List[str]) -> None:
+        self.records = Recorder.load(path)
+        start = self.records[0]
+        self.fake = FakeI3(
+            start['tree'], start.get('outputs'), start.get('version')
+        )
+        self.i3 = FakeConnection(self.fake)
+        self.times = CpuTimes(self.fake)
+        # measure every event handler
+        I3Events.add_hook(self.i3, lambda handler, call: self.times.measure(
+            I3Events.name(handler), call
+        ))
+        # lazy modules are loaded only if they are asked explicitly
+        self.load_lazy = bool(mods)
+        if not mods:
+            with open(Misc.i3path() + '/cfg/negi3wm.toml', 'r') as fp:
+                mods = qtoml.load(fp)['module_list']
+        self.mod_names = mods
+        self.mods = {}
+        self.nops = collections.Counter() # mod.binding -> recorded count
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def load_modules(self) -> None:
+        """ Create modules like negi3wm does, lazy ones only if asked. """
+        FakeX.install()
+        TreeMirror.init(self.i3)
+        CmdBatch.init(self.i3)
+        self.i3.on('binding', MsgBroker.on_binding)
+        self.i3.on('tick', MsgBroker.on_tick)
+        for mod in self.mod_names:
+            mod_class = getattr(importlib.import_module('lib.' + mod), mod)
+            if mod_class.lazy and not self.load_lazy:
+                continue
+            self.mods[mod] = self.times.measure(
+                f'{mod}.__init__', mod_class, self.i3
+            )
+            asyncio_init = getattr(self.mods[mod], 'asyncio_init', None)
+            if asyncio_init is not None:
+                try:
+                    asyncio_init(self.loop)
+                except Exception:
+                    traceback.print_exc(file=sys.stdout)
+
+    @staticmethod
+    def nop_cmds(record: dict) -> List[List[str]]:
+        """ negi3wm commands of the recorded binding or tick event, like
+        MsgBroker.on_binding and MsgBroker.on_tick dispatch them. """
+        data = record['data']
+        if record['name'] == 'binding':
+            return MsgBroker.i3_cmds(data['binding']['command'])
+        if record['name'] == 'tick' and not data.get('first'):
+            return MsgBroker.i3_cmds(data.get('payload', ''), 'negi3wm ')
+        return []
+
+    @staticmethod
+    async def drain() -> None:
+        """ Wait for commands posted by i3 bindings and modules. """
+        while True:
+            # posted commands are put to queues by the loop callbacks
+            await asyncio.sleep(0)
+            queues = list(MsgBroker.queues.values())
+            for queue in queues:
+                await queue.join()
+            await asyncio.sleep(0)
+            if len(queues) == len(MsgBroker.queues) and \
+                    all(queue.empty() for queue in queues):
+                return
+
+    async def feed(self) -> None:
+        """ Feed records one by one, commands posted by modules and i3
+        bindings run between them. """
+        for record in self.records[1:]:
+            calls = sum(self.fake.calls.values())
+            start = time.process_time()
+            if record['kind'] == 'event':
+                self.i3.emit(record['name'], record['data'])
+                cmds = [
+                    cmd for cmd in self.nop_cmds(record)
+                    if cmd[0] in self.mods and len(cmd) > 1
+                ]
+                self.nops.update(f'{cmd[0]}.{cmd[1]}' for cmd in cmds)
+                await self.drain()
+                if cmds:
+                    self.times.account(
+                        'nop ' + ', '.join(' '.join(cmd[:2]) for cmd in cmds),
+                        time.process_time() - start, calls
+                    )
+            elif record['kind'] == 'cmd' and record['args'][0] in self.mods:
+                await MsgBroker.dispatch(record['args'], True)
+                self.times.account(
+                    ' '.join(record['args'][:2]),
+                    time.process_time() - start, calls
+                )
+                await self.drain()
+
+    def missing_nops(self) -> List[str]:
+        """ Recorded nop commands which did not run successfully. """
+        done = {
+            key: summary['count'] for key, summary in
+            Latency.stats()['binding'].items()
+        }
+        return [
+            f'{key}: {count - done.get(key, 0)} of {count}'
+            for key, count in sorted(self.nops.items())
+            if done.get(key, 0) < count
+        ]
+
+    def run(self) -> int:
+        """ Replay the session and print the report.
+        Returns the exit status, 1 if some nop commands did not run. """
+        self.load_modules()
+        MsgBroker.loop = self.loop
+        MsgBroker.mods = self.mods
+        start = time.process_time()
+        self.loop.run_until_complete(self.feed())
+        total = time.process_time() - start
+        for worker in MsgBroker.workers.values():
+            worker.cancel()
+        self.loop.run_until_complete(asyncio.gather(
+            *MsgBroker.workers.values(), return_exceptions=True
+        ))
+        for line in self.times.report():
+            print(line)
+        events = sum(1 for rec in self.records if rec['kind'] == 'event')
+        cmds = sum(1 for rec in self.records if rec['kind'] == 'cmd')
+        print(
+            f'{events} events, {cmds} commands, replayed in '
+            f'{total * 1000:.2f}ms cpu'
+        )
+        print(
+            'i3 calls: ' + ', '.join(
+                f'{name}={count}' for name, count in
+                self.fake.calls.most_common()
+            ) + f', commands={self.fake.commands}'
+        )
+        missing = self.missing_nops()
+        print(f'{sum(self.nops.values())} nop commands of i3 bindings')
+        for line in missing:
+            print(f'not run: {line}')
+        return 1 if missing else 0
+
+
+def main():
+    """ Run replay from here """
+    cmd_args = docopt(__doc__)
+    sys.exit(replay(cmd_args['<file>'], cmd_args['-m']).run())
+
+
+if __name__ == '__main__':
+    main()
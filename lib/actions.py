@@ -12,6 +12,8 @@ from typing import Mapping
 from display import Display
 from cfg import cfg
 from extension import extension
+from lib.cmdbatch import CmdBatch
+from lib.treemirror import TreeMirror
 
 
 class actions(extension, cfg):
@@ -25,7 +27,7 @@ class actions(extension, cfg):
         cfg.__init__(self, i3)
         # i3ipc connection, bypassed by negi3wm runner.
         self.i3ipc = i3
-        self.i3ipc.on("window::focus", self.auto_tiling)
+        self.subscribe(self.i3ipc, "window::focus", self.auto_tiling)
         maxlength = self.conf("cache_list_size") # cache list length
         # create list with the finite number of elements by the [None] * N hack
         self.geom_list = collections.deque([None] * maxlength, maxlen=maxlength)
@@ -102,7 +104,7 @@ class actions(extension, cfg):
     def move_center(self, resize: str) -> None:
         """ Move window to center
         resize (str): predicate which shows resize target window or not. """
-        focused = self.i3ipc.get_tree().find_focused()
+        focused = TreeMirror.find_focused(fresh=True)
         if resize in {"default", "none"}:
             geom = self.center_geom(focused)
             actions.set_geom(focused, geom)
@@ -138,13 +140,13 @@ class actions(extension, cfg):
 
     def grow(self) -> None:
         """ Grow floating window geometry by [self.grow_coeff]. """
-        focused = self.i3ipc.get_tree().find_focused()
+        focused = TreeMirror.find_focused(fresh=True)
         geom = actions.multiple_geom(focused, self.grow_coeff)
         actions.set_geom(focused, geom)
 
     def shrink(self) -> None:
         """ Shrink floating window geometry by [self.shrink_coeff]. """
-        focused = self.i3ipc.get_tree().find_focused()
+        focused = TreeMirror.find_focused(fresh=True)
         geom = actions.multiple_geom(focused, self.shrink_coeff)
         actions.set_geom(focused, geom)
 
@@ -157,7 +159,7 @@ class actions(extension, cfg):
         curr_scr = self.current_resolution
         half_width = int(curr_scr['width'] / 2)
         half_height = int(curr_scr['height'] / 2)
-        self.current_win = self.i3ipc.get_tree().find_focused()
+        self.current_win = TreeMirror.find_focused(fresh=True)
         if self.x2_use_gaps:
             gaps = self.useless_gaps
         else:
@@ -214,7 +216,7 @@ class actions(extension, cfg):
             print("cannot convert mode={mode} to int")
             return
         curr_scr = self.current_resolution
-        self.current_win = self.i3ipc.get_tree().find_focused()
+        self.current_win = TreeMirror.find_focused(fresh=True)
         if self.quad_use_gaps:
             gaps = self.useless_gaps
         else:
@@ -268,7 +270,7 @@ class actions(extension, cfg):
         by (str): maximize by X, Y or XY. """
         geom = {}
 
-        self.current_win = self.i3ipc.get_tree().find_focused()
+        self.current_win = TreeMirror.find_focused(fresh=True)
         if self.current_win is not None:
             if not self.geom_list[-1]:
                 geom = self.get_prev_geom()
@@ -296,7 +298,7 @@ class actions(extension, cfg):
     def revert_maximize(self) -> None:
         """ Revert changed window state. """
         try:
-            focused = self.i3ipc.get_tree().find_focused()
+            focused = TreeMirror.find_focused(fresh=True)
             if self.geom_list[-1].get("geom", {}):
                 actions.set_geom(focused, self.geom_list[-1]["geom"])
             del self.geom_list[-1]
@@ -325,8 +327,15 @@ class actions(extension, cfg):
         """ Generic function to set geometry
         win: target window to change windows
         geom (dict): geometry. """
-        win.command(f"move absolute position {geom['x']} {geom['y']}")
-        win.command(f"resize set {geom['width']} {geom['height']} px")
+        with CmdBatch() as batch:
+            batch.add(
+                f"move absolute position {geom['x']} {geom['y']}, "
+                f"resize set {geom['width']} {geom['height']} px", win
+            )
+        # i3 sends no events about geometry changes, so keep mirrored
+        # window rect in sync by hand.
+        win.rect.x, win.rect.y = geom['x'], geom['y']
+        win.rect.width, win.rect.height = geom['width'], geom['height']
 
     @staticmethod
     def set_resize_params_single(direction, amount):
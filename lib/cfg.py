@@ -10,8 +10,11 @@ import os
 import sys
 import qtoml
 import traceback
-from typing import Set, Callable
+from typing import List, Set, Callable
+from lib.cfg_cache import CfgCache
+from lib.cfg_watcher import CfgWatcher
 from lib.misc import Misc
+from lib.treemirror import TreeMirror
 
 
 class cfg():
@@ -19,6 +22,7 @@ class cfg():
         self.mod = self.__class__.__name__ # detect current extension
         # extension config path
         self.i3_cfg_mod_path = Misc.i3path() + '/cfg/' + self.mod + '.toml'
+        self.cfg_derived = {} # structures derived from config, see CfgCache
         self.load_config() # load current config
         self.win_attrs = {} # used for props add / del hacks
         self.conv_props = {
@@ -87,11 +91,11 @@ class cfg():
 
     def reload_config(self, *_) -> None:
         """ Reload config for current selected module. Call load_config, print
-        debug messages and reinit all stuff. """
+        debug messages and apply the new config. """
         prev_conf = self.cfg
         try:
             self.load_config()
-            self.__init__(self.i3ipc)
+            self.apply_config(prev_conf)
             print(f"[{self.mod}] config reloaded")
         except Exception:
             print(f"[{self.mod}] config reload failed")
@@ -99,6 +103,12 @@ class cfg():
             self.cfg = prev_conf
             self.__init__(*_)
 
+    def apply_config(self, prev_conf: dict) -> None:
+        """ Apply reloaded self.cfg. Module is reinitialized by default,
+        modules with tags override it to rebuild only changed tags.
+            prev_conf (dict): config before the reload. """
+        self.__init__(self.i3ipc)
+
     def dict_apply(self, field_conv: Callable, subtag_conv: Callable) -> None:
         """ Convert list attributes to set for the better performance.
             field_conv (Callable): function to convert dict field.
@@ -122,21 +132,40 @@ class cfg():
                 if key in cfg.subtag_attr_list():
                     val[sys.intern(key)] = field_conv(val[sys.intern(key)])
 
+    @staticmethod
+    def derive_config(_conf: dict) -> dict:
+        """ Structures derived from the parsed config, they are cached with
+        it in CfgCache. Modules override it. """
+        return {}
+
     def load_config(self) -> None:
-        """ Reload config itself and convert lists in it to sets for the better
-        performance. """
+        """ Reload config itself with structures derived from it. Parsed
+        config is taken from the cache if the file is not changed. """
         try:
-            with open(self.i3_cfg_mod_path, "r") as mod_cfg:
-                self.cfg = qtoml.load(mod_cfg)
+            self.cfg, self.cfg_derived = CfgCache.load(
+                self.i3_cfg_mod_path, self.derive_config
+            )
         except FileNotFoundError:
             print(f'file {self.i3_cfg_mod_path} not exists')
 
+    @staticmethod
+    def toml_data(conf):
+        """ Config with sets converted to sorted lists, qtoml can not dump
+        sets. """
+        if isinstance(conf, dict):
+            return {key: cfg.toml_data(val) for key, val in conf.items()}
+        if isinstance(conf, (set, frozenset)):
+            return sorted(conf)
+        return conf
+
     def dump_config(self) -> None:
-        """ Dump current config, can be used for debugging. """
-        with open(self.i3_cfg_mod_path, "r+") as mod_cfg:
-            print(self.cfg)
-            qtoml.dump(self.cfg, mod_cfg)
-            self.cfg = qtoml.load(mod_cfg)
+        """ Save current config. It is written atomically a bit later, so
+        repeated dumps are written once, and the module is not reloaded by
+        its own write. TOML is rendered now, in the module thread, the write
+        itself is done by the loop. """
+        CfgWatcher.write_behind(
+            self.i3_cfg_mod_path, qtoml.dumps(cfg.toml_data(self.cfg))
+        )
 
     def property_to_winattrib(self, prop_str: str) -> None:
         """ Parse property string to create win_attrs dict.
@@ -174,6 +203,24 @@ class cfg():
                     if isinstance(self.conf(tag, tok), str):
                         self.cfg[tag][tok] = {self.win_attrs[tok]}
 
+    def prop_windows(self) -> List:
+        """ Windows having any exact property of the parsed property string,
+        only they can change tags after props add / del. """
+        attrs = {
+            'class': 'window_class', 'instance': 'window_instance',
+            'name': 'name', 'window_role': 'window_role',
+        }
+        props = [
+            (attrs[prop], value) for prop, value in self.win_attrs.items()
+            if prop in attrs
+        ]
+        if not props:
+            return []
+        return [
+            win for win in TreeMirror.leaves()
+            if any(getattr(win, attr) == value for attr, value in props)
+        ]
+
     def del_direct_props(self, target_tag: str) -> None:
         """ Remove basic(non-regex) properties of window from target tag.
             tag (str): target tag """
@@ -207,11 +254,11 @@ class cfg():
             if prop in self.cfg_regex_props():
                 for reg in self.cfg[target_tag][prop].copy():
                     if prop == "class_r":
-                        lst_by_reg = self.i3ipc.get_tree().find_classed(reg)
+                        lst_by_reg = TreeMirror.find_classed(reg)
                     if prop == "instance_r":
-                        lst_by_reg = self.i3ipc.get_tree().find_instanced(reg)
+                        lst_by_reg = TreeMirror.find_instanced(reg)
                     if prop == "role_r":
-                        lst_by_reg = self.i3ipc.get_tree().find_by_role(reg)
+                        lst_by_reg = TreeMirror.find_by_role(reg)
                     winattr = self.win_attrs[prop[:-2]]
                     for win in lst_by_reg:
                         check_for_win_attrs(win, prop)
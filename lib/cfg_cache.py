@@ -0,0 +1,82 @@
+""" Cache of parsed TOML configs.
+
+qtoml is the pure Python parser: parsing of all configs takes milliseconds on
+every start and reload, while configs are changed rarely. CfgCache keeps the
+parsed config together with structures derived from it by the module, like
+frozensets of match rules and parsed geometries, pickled in
+cache/cfg/<name>.pickle, and loading it is about a hundred times faster than
+parsing.
+
+The entry is used only for the same SHA-256 of the TOML bytes, the same
+derive function and the same cache version. Any edit of the file, the stale,
+half-written or corrupted pickle lead to parsing the TOML again and
+rewriting the entry. It is written to the temporary file which is renamed
+over the old one, so readers never see a partial pickle.
+"""
+
+import os
+import pickle
+import hashlib
+from typing import Callable, Optional, Tuple
+
+import qtoml
+
+from lib.misc import Misc
+
+
+class CfgCache():
+    """ Parsed config cache. All state is class-level. """
+    version = 1 # bump when derived structures are changed
+    hits = 0
+    misses = 0
+
+    @staticmethod
+    def path(cfg_path: str) -> str:
+        """ Cache entry path for the config file. """
+        name = os.path.splitext(os.path.basename(cfg_path))[0]
+        return f'{Misc.i3path()}/cache/cfg/{name}.pickle'
+
+    @classmethod
+    def load(cls, cfg_path: str, derive: Optional[Callable] = None) \
+            -> Tuple[dict, dict]:
+        """ Returns parsed config and derived structures for it.
+            cfg_path (str): TOML config path.
+            derive (Callable): function of the parsed config which returns
+            dict of derived structures, they should be picklable. """
+        with open(cfg_path, 'rb') as fp:
+            data = fp.read()
+        key = (
+            cls.version, hashlib.sha256(data).hexdigest(),
+            getattr(derive, '__qualname__', '')
+        )
+        cache_path = CfgCache.path(cfg_path)
+        try:
+            with open(cache_path, 'rb') as fp:
+                entry = pickle.load(fp)
+            if entry['key'] == key:
+                cls.hits += 1
+                return entry['cfg'], entry['derived']
+        except Exception:
+            # no entry yet, or it is stale, corrupted, from other version
+            pass
+        cls.misses += 1
+        conf = qtoml.loads(data.decode('utf8'))
+        derived = derive(conf) if derive is not None else {}
+        cls.save(cache_path, {'key': key, 'cfg': conf, 'derived': derived})
+        return conf, derived
+
+    @staticmethod
+    def save(cache_path: str, entry: dict) -> None:
+        """ Write the entry atomically, the cache is optional, so errors are
+        ignored. """
+        tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+        try:
+            Misc.create_dir(os.path.dirname(cache_path))
+            with open(tmp_path, 'wb') as fp:
+                pickle.dump(entry, fp, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+        except (OSError, pickle.PicklingError):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
@@ -0,0 +1,188 @@
+""" Debounced inotify watcher of TOML configs.
+
+Editors save the file with several writes or write the temporary file and
+rename it over the config, so reloading the module on every IN.MODIFY reloads
+it several times per save, often from the half-written file. CfgWatcher reacts
+on IN.CLOSE_WRITE and IN.MOVED_TO only, so the file is complete, and the burst
+of events for the same file runs callbacks once, [debounce] seconds after the
+last event of the burst. There is one inotify instance per process for all
+modules, events which are coalesced into the pending reload or skipped because
+nobody watches the file are counted in CfgWatcher.stats.
+
+Configs written by the daemon itself, like the dumped scratchpad geometry,
+go through write_behind: the write is delayed for [write_delay] seconds, so
+repeated saves of the same file are written once with the latest content.
+The file is written to the temporary file and renamed over the config, and
+the SHA-256 of the written content is remembered, so the watcher does not
+reload the module from its own write, unless the file was changed after it.
+"""
+
+import os
+import sys
+import asyncio
+import hashlib
+import traceback
+import collections
+from typing import Callable, List, Optional, Tuple
+import inotipy
+
+
+class CfgWatcher():
+    """ Shared config watcher. All state is class-level. """
+    debounce = 0.25 # seconds without events before the reload
+    loop = None # asyncio loop of the watcher
+    watcher = None # inotipy watcher
+    watches = {} # directory -> inotipy watch
+    callbacks = {} # (directory, file name or None) -> [callable(file name)]
+    pending = {} # (directory, file name) -> asyncio timer handle
+    write_delay = 1.0 # seconds to coalesce config writes of the daemon
+    writes = {} # config path -> content to write
+    write_handles = {} # config path -> asyncio timer handle
+    own = {} # (directory, file name) -> SHA-256 of the own write
+    # events, reloads, coalesced, skipped, own, writes, writes_coalesced
+    stats = collections.Counter()
+
+    @classmethod
+    def watch(cls, path: str, name: Optional[str], callback: Callable) \
+            -> None:
+        """ Call callback(file name) once per burst of writes of the file.
+            The same callback is added once, so it is safe to call it again on
+            the module reinit.
+            path (str): config directory.
+            name (str): file name, None for every TOML file of the directory.
+            callback (Callable): function of the file name. """
+        path = os.path.normpath(path)
+        if cls.watcher is None:
+            cls.loop = asyncio.get_event_loop()
+            cls.watcher = inotipy.Watcher.create()
+            asyncio.ensure_future(cls.worker())
+        if path not in cls.watches:
+            cls.watches[path] = cls.watcher.watch(
+                path, inotipy.IN.CLOSE_WRITE | inotipy.IN.MOVED_TO
+            )
+        callbacks = cls.callbacks.setdefault((path, name), [])
+        if callback not in callbacks:
+            callbacks.append(callback)
+
+    @classmethod
+    def subscribers(cls, path: str, name: str) -> List[Callable]:
+        """ Callbacks for the file: the file ones, then directory ones. """
+        ret = list(cls.callbacks.get((path, name), []))
+        if name.endswith('.toml'):
+            ret += cls.callbacks.get((path, None), [])
+        return ret
+
+    @classmethod
+    async def worker(cls) -> None:
+        """ Read inotify events and (re)schedule reloads. """
+        loop = asyncio.get_event_loop()
+        while True:
+            event = await cls.watcher.get()
+            cls.stats['events'] += 1
+            if event.watch is None or not event.pathname:
+                cls.stats['skipped'] += 1
+                continue
+            key = (event.watch.pathname, event.pathname)
+            if not cls.subscribers(*key):
+                cls.stats['skipped'] += 1
+                continue
+            handle = cls.pending.pop(key, None)
+            if handle is not None:
+                handle.cancel()
+                cls.stats['coalesced'] += 1
+            cls.pending[key] = loop.call_later(cls.debounce, cls.fire, key)
+
+    @classmethod
+    def fire(cls, key: Tuple[str, str]) -> None:
+        """ The burst is over: run callbacks of the file.
+            key: (directory, file name). """
+        cls.pending.pop(key, None)
+        own = cls.own.pop(key, None)
+        if own is not None and own == cls.file_hash(os.path.join(*key)):
+            cls.stats['own'] += 1
+            return
+        cls.stats['reloads'] += 1
+        for callback in cls.subscribers(*key):
+            try:
+                callback(key[1])
+            except Exception:
+                traceback.print_exc(file=sys.stdout)
+
+    @staticmethod
+    def file_hash(path: str) -> str:
+        """ SHA-256 of the file content, empty string if it is gone. """
+        try:
+            with open(path, 'rb') as fp:
+                return hashlib.sha256(fp.read()).hexdigest()
+        except OSError:
+            return ''
+
+    @classmethod
+    def write_behind(cls, path: str, text: str) -> None:
+        """ Write the config [write_delay] seconds later, repeated writes of
+        the same file before that are coalesced into one. Written at once if
+        the loop is not running. Thread-safe, module threads save configs
+        too, the content is rendered by the caller, so the later change of
+        the config can not be written half-done.
+            path (str): config path.
+            text (str): content to write. """
+        loop = cls.loop
+        if loop is None or not loop.is_running():
+            cls.writes[os.path.normpath(path)] = text
+            cls.flush(os.path.normpath(path))
+        elif cls.in_loop():
+            cls.schedule_write(os.path.normpath(path), text)
+        else:
+            loop.call_soon_threadsafe(
+                cls.schedule_write, os.path.normpath(path), text
+            )
+
+    @classmethod
+    def in_loop(cls) -> bool:
+        """ Is it called from the thread of the watcher loop. """
+        try:
+            return asyncio.get_running_loop() is cls.loop
+        except RuntimeError:
+            return False
+
+    @classmethod
+    def schedule_write(cls, path: str, text: str) -> None:
+        """ (Re)start the write timer of the config, called in the loop. """
+        handle = cls.write_handles.pop(path, None)
+        if handle is not None:
+            handle.cancel()
+            cls.stats['writes_coalesced'] += 1
+        cls.writes[path] = text
+        cls.write_handles[path] = cls.loop.call_later(
+            cls.write_delay, cls.flush, path
+        )
+
+    @classmethod
+    def flush(cls, path: Optional[str] = None) -> None:
+        """ Write pending configs now, should be called before exit.
+            path (str): config to write, all of them by default. """
+        for cfg_path in [path] if path is not None else list(cls.writes):
+            handle = cls.write_handles.pop(cfg_path, None)
+            if handle is not None:
+                handle.cancel()
+            text = cls.writes.pop(cfg_path, None)
+            if text is not None:
+                try:
+                    cls.write(cfg_path, text)
+                except Exception:
+                    traceback.print_exc(file=sys.stdout)
+
+    @classmethod
+    def write(cls, path: str, text: str) -> None:
+        """ Write the config atomically and remember its hash, so the watcher
+        skips the own write.
+            path (str): config path.
+            text (str): content. """
+        data = text.encode('utf8')
+        dirname, name = os.path.split(os.path.normpath(path))
+        tmp_path = os.path.join(dirname, f'.{name}.{os.getpid()}.tmp')
+        with open(tmp_path, 'wb') as fp:
+            fp.write(data)
+        cls.own[(dirname, name)] = hashlib.sha256(data).hexdigest()
+        os.replace(tmp_path, path)
+        cls.stats['writes'] += 1
@@ -1,6 +1,7 @@
 import os
 import shutil
 import subprocess
+from lib.i3events import I3Events
 from lib.misc import Misc
 
 class checker():
@@ -42,6 +43,21 @@ class checker():
             for exe, description in value.items():
                 checker.which(exe, description, kind, verbose)
 
+    @staticmethod
+    def check_i3ipc(verbose):
+        if verbose:
+            print('Check for i3ipc internals used by negi3wm')
+        errors, warnings = I3Events.supported()
+        for warning in warnings:
+            print(f'{warning}, see requirements.txt [WARN]')
+        for error in errors:
+            print(f'{error} [FAIL]')
+        if errors:
+            print('Please install i3ipc from requirements.txt')
+            os._exit(1)
+        if verbose and not warnings:
+            print(f'i3ipc {I3Events.version} [OK]')
+
     @staticmethod
     def check_for_send(verbose):
         if verbose:
@@ -105,5 +121,6 @@ class checker():
         """ Check for various dependencies """
         checker.check_env(verbose)
         checker.check_for_executable_deps(verbose)
+        checker.check_i3ipc(verbose)
         checker.check_i3_config(verbose)
         checker.check_for_send(verbose)
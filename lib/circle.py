@@ -14,9 +14,13 @@ window with the correct fullscreen state, where normal i3 behaviour has a lot
 of issues here in detection of existing/visible windows, etc.
 """
 
+import copy
 from . extension import extension
 from . matcher import Matcher
 from . cfg import cfg
+from lib.cmdbatch import CmdBatch
+from lib.msgbroker import MsgBroker
+from lib.treemirror import TreeMirror
 
 
 class circle(extension, cfg, Matcher):
@@ -39,14 +43,15 @@ class circle(extension, cfg, Matcher):
         self.repeats = 0 # How many attempts taken to find window with priority
         self.win = None # Win cache for the fast matching
         self.subtag_info = {} # Used for subtag info caching
-        # Should the special fullscreen-related actions to be performed or not.
-        self.need_handle_fullscreen = True
-        i3tree = self.i3ipc.get_tree()
-        self.fullscreened = i3tree.find_fullscreen() # Prepare for prefullscreen
-        # Store the current window here to cache get_tree().find_focused value.
-        self.current_win = i3tree.find_focused()
-        # Winlist is used to reduce calling i3.get_tree() too many times.
-        self.winlist = i3tree.leaves()
+        # (con_id, fullscreen) states set by circle itself, their events are
+        # not remembered in restore_fullscreen.
+        self.own_fullscreen = set()
+        # Prepare for prefullscreen
+        self.fullscreened = TreeMirror.find_fullscreen()
+        # Store the current window here to cache find_focused value.
+        self.current_win = TreeMirror.find_focused()
+        # Winlist is used to match windows without tree walking.
+        self.winlist = TreeMirror.leaves()
         for tag in self.cfg:
             self.tagged[tag] = []
             self.current_position[tag] = 0
@@ -59,10 +64,17 @@ class circle(extension, cfg, Matcher):
             "del_prop": self.del_prop,
             "reload": self.reload_config,
         }
-        self.i3ipc.on('window::new', self.add_wins)
-        self.i3ipc.on('window::close', self.del_wins)
-        self.i3ipc.on("window::focus", self.set_curr_win)
-        self.i3ipc.on("window::fullscreen_mode", self.handle_fullscreen)
+        self.subscribe(self.i3ipc, 'window::new', self.add_wins)
+        self.subscribe(self.i3ipc, 'window::close', self.del_wins)
+        self.subscribe(self.i3ipc, "window::focus", self.set_curr_win)
+        self.subscribe(
+            self.i3ipc, "window::fullscreen_mode", self.handle_fullscreen
+        )
+
+    @staticmethod
+    def derive_config(conf: dict) -> dict:
+        """ Match rules, cached with the parsed config. """
+        return {'rules': Matcher.rule_sources(conf)}
 
     def run_prog(self, tag: str, subtag: str = '') -> None:
         """ Run the appropriate application for the current tag/subtag.
@@ -81,10 +93,8 @@ class circle(extension, cfg, Matcher):
                 spawn_str = self.extract_prog_str(
                     self.conf(tag), "spawn", exe_file=False
                 )
-                if spawn_str:
-                    executor = extension.get_mods().get('executor')
-                    if executor is not None:
-                        executor.bindings['run'](spawn_str)
+                if spawn_str and 'executor' in extension.get_mods():
+                    MsgBroker.post('executor', ['run', spawn_str])
 
     def find_next_not_the_same_win(self, tag: str) -> None:
         """ It was used as the guard to infinite loop in the past.
@@ -95,21 +105,22 @@ class circle(extension, cfg, Matcher):
 
     def prefullscreen(self, tag: str) -> None:
         """ Prepare to go fullscreen. """
+        classes = self.exact_values(tag, "class")
         for win in self.fullscreened:
-            if self.current_win.window_class in set(self.conf(tag, "class")) \
+            if self.current_win.window_class in classes \
                     and self.current_win.id == win.id:
-                self.need_handle_fullscreen = False
-                win.command('fullscreen disable')
+                self.own_fullscreen.add((win.id, False))
+                with CmdBatch() as batch:
+                    batch.add('fullscreen disable', win)
 
     def postfullscreen(self, tag: str, idx: int) -> None:
         """ Exit from fullscreen. """
         now_focused = self.twin(tag, idx).id
         for win_id in self.restore_fullscreen:
             if win_id == now_focused:
-                self.need_handle_fullscreen = False
-                self.i3ipc.command(
-                    f'[con_id={now_focused}] fullscreen enable'
-                )
+                self.own_fullscreen.add((win_id, True))
+                with CmdBatch() as batch:
+                    batch.add(f'[con_id={now_focused}] fullscreen enable')
 
     def focus_next(self, tag: str, idx: int,
                    inc_counter: bool = True,
@@ -124,22 +135,21 @@ class circle(extension, cfg, Matcher):
         of i3 is not perfect in it. For example you need it for different
         workspaces.
         subtagged (bool): this flag denotes to subtag using. """
-        if fullscreen_handler:
-            self.prefullscreen(tag)
-        self.twin(tag, idx, subtagged).command('focus')
-        if inc_counter:
-            self.current_position[tag] += 1
-        if fullscreen_handler:
-            self.postfullscreen(tag, idx)
-        self.need_handle_fullscreen = True
+        with CmdBatch() as batch:
+            if fullscreen_handler:
+                self.prefullscreen(tag)
+            batch.add('focus', self.twin(tag, idx, subtagged))
+            if inc_counter:
+                self.current_position[tag] += 1
+            if fullscreen_handler:
+                self.postfullscreen(tag, idx)
         self.focus_driven_actions(tag)
 
     def focus_driven_actions(self, tag):
         """ Make some actions after focus """
         if self.conf(tag, "mpd_shut") == 1:
-            vol = extension.get_mods().get('vol')
-            if vol is not None:
-                vol.bindings['mute']()
+            if 'vol' in extension.get_mods():
+                MsgBroker.post('vol', ['mute'])
 
     def twin(self, tag: str, idx: int, with_subtag: bool = False):
         """ Detect target window.
@@ -159,13 +169,14 @@ class circle(extension, cfg, Matcher):
         window not in class set.
         tag(str): target tag name """
         return "priority" in self.conf(tag) and \
-            self.current_win.window_class not in set(self.conf(tag, "class"))
+            self.current_win.window_class not in \
+            self.exact_values(tag, "class")
 
     def not_priority_win_class(self, tag, win):
         """ Window class is not priority class for the given tag
             tag(str): target tag name
             win: window """
-        return win.window_class in self.conf(tag, "class") and \
+        return win.window_class in self.exact_values(tag, "class") and \
             win.window_class != self.conf(tag, "priority")
 
     def no_prioritized_wins(self, tag):
@@ -222,38 +233,75 @@ class circle(extension, cfg, Matcher):
             tag (str): denotes the target tag.
             prop_str (str): string in i3-match format used to add/delete target
             window in/from scratchpad. """
+        prev_conf = copy.deepcopy(self.cfg)
         if tag_to_add in self.cfg:
             self.add_props(tag_to_add, prop_str)
         for tag in self.cfg:
             if tag != tag_to_add:
                 self.del_props(tag, prop_str)
-        self.initialize(self.i3ipc)
+        self.props_changed(prev_conf)
 
     def del_prop(self, tag: str, prop_str: str) -> None:
         """ Delete property via [prop_str] to the target [tag].
             tag (str): denotes the target tag.
             prop_str (str): string in i3-match format used to add/delete target
             window in/from scratchpad. """
+        prev_conf = copy.deepcopy(self.cfg)
         self.del_props(tag, prop_str)
+        self.props_changed(prev_conf)
 
-    def find_acceptable_windows(self, tag: str) -> None:
-        """ Wrapper over Matcher.match to find acceptable windows and add it to
-            tagged[tag] list.
-            tag (str): denotes the target tag. """
-        for win in self.winlist:
-            if self.match(win, tag):
-                self.tagged.get(tag, []).append(win)
+    def props_changed(self, prev_conf: dict) -> None:
+        """ Apply props add / del as the rule delta: only windows with the
+        edited properties are matched again, only against tags with changed
+        rules, other windows keep their positions.
+            prev_conf (dict): config before the props change. """
+        changed = self.changed_rules(prev_conf)
+        self.matcher_reset()
+        if not changed:
+            return
+        windows = self.prop_windows()
+        ids = {win.id for win in windows}
+        for tag in changed & set(self.cfg):
+            tagged = [
+                win for win in self.tagged.get(tag, [])
+                if win.id not in ids or self.match(win, tag)
+            ]
+            present = {win.id for win in tagged}
+            tagged += [
+                win for win in windows
+                if win.id not in present and self.match(win, tag)
+            ]
+            self.tagged[tag] = tagged
+            self.current_position.setdefault(tag, 0)
+
+    def apply_config(self, prev_conf: dict) -> None:
+        """ Apply the reloaded config: only tags with changed rules are
+        matched again, other tags keep their windows and positions.
+            prev_conf (dict): config before the reload. """
+        changed = self.changed_rules(prev_conf)
+        self.matcher_reset()
+        self.subtag_info = {}
+        winlist = TreeMirror.leaves() if changed else []
+        for tag in changed:
+            if tag not in self.cfg:
+                self.tagged.pop(tag, None)
+                self.current_position.pop(tag, None)
+                continue
+            self.tagged[tag] = [
+                win for win in winlist if self.match(win, tag)
+            ]
+            self.current_position.setdefault(tag, 0)
 
     def tag_windows(self, invalidate_winlist=True) -> None:
         """ Find acceptable windows for the all tags and add it to the
             tagged[tag] list.
             tag (str): denotes the target tag. """
         if invalidate_winlist:
-            self.winlist = self.i3ipc.get_tree().leaves()
-        self.tagged = {}
-        for tag in self.cfg:
-            self.tagged[tag] = []
-            self.find_acceptable_windows(tag)
+            self.winlist = TreeMirror.leaves()
+        self.tagged = {tag: [] for tag in self.cfg}
+        for win in self.winlist:
+            for tag in self.match_tags(win):
+                self.tagged[tag].append(win)
 
     def sort_by_parent(self, tag: str) -> None:
         """ Sort windows by some infernal logic: At first sort by parent
@@ -278,9 +326,8 @@ class circle(extension, cfg, Matcher):
             event: i3ipc event. We can extract window from it using
             event.container. """
         win = event.container
-        for tag in self.cfg:
-            if self.match(win, tag):
-                self.tagged[tag].append(win)
+        for tag in self.match_tags(win):
+            self.tagged[tag].append(win)
         self.win = win
 
     def del_wins(self, _, event) -> None:
@@ -289,11 +336,10 @@ class circle(extension, cfg, Matcher):
             event: i3ipc event. We can extract window from it using
             event.container. """
         win_con = event.container
-        for tag in self.cfg:
-            if self.match(win_con, tag):
-                for win in self.tagged[tag]:
-                    if win.id in self.restore_fullscreen:
-                        self.restore_fullscreen.remove(win.id)
+        for tag in self.match_tags(win_con):
+            for win in self.tagged[tag]:
+                if win.id in self.restore_fullscreen:
+                    self.restore_fullscreen.remove(win.id)
         for tag in self.cfg:
             for win in self.tagged[tag]:
                 if win.id == win_con.id:
@@ -311,19 +357,22 @@ class circle(extension, cfg, Matcher):
         """ Performs actions over the restore_fullscreen list. This function
         memorize the current state of the fullscreen property of windows for
         the future reuse it in functions which need to set/unset fullscreen
-        state of the window correctly.
+        state of the window correctly. Events of the fullscreen toggles done
+        by circle itself are skipped, the expected state is dropped by its
+        event, the opposite one is stale then.
 
         _: i3ipc connection.
         event: i3ipc event. We can extract window from it using
         event.container. """
         win = event.container
-        self.fullscreened = self.i3ipc.get_tree().find_fullscreen()
-        if self.need_handle_fullscreen:
-            if win.fullscreen_mode:
-                if win.id not in self.restore_fullscreen:
-                    self.restore_fullscreen.append(win.id)
-                    return
-            if not win.fullscreen_mode:
-                if win.id in self.restore_fullscreen:
-                    self.restore_fullscreen.remove(win.id)
-                    return
+        self.fullscreened = TreeMirror.find_fullscreen()
+        state = (win.id, bool(win.fullscreen_mode))
+        if state in self.own_fullscreen:
+            self.own_fullscreen.discard(state)
+            return
+        self.own_fullscreen.discard((win.id, not state[1]))
+        if win.fullscreen_mode:
+            if win.id not in self.restore_fullscreen:
+                self.restore_fullscreen.append(win.id)
+        elif win.id in self.restore_fullscreen:
+            self.restore_fullscreen.remove(win.id)
@@ -0,0 +1,127 @@
+""" Batching of i3 commands.
+
+Bindings like scratchpad show/hide used to send one RUN_COMMAND per window,
+which is the synchronous round trip to i3 every time. CmdBatch collects
+`[con_id=X] cmd` fragments and sends them as one `;`-joined RUN_COMMAND when
+the outermost batch is closed:
+
+    with CmdBatch() as batch:
+        for win in wins:
+            batch.add('move scratchpad', win)
+
+Nested batches (method with batch called from another one) are merged into
+the outermost, so commands are still run in the original order. i3 returns
+one reply per parsed command, so replies are mapped back to fragments by the
+number of top-level `,` and `;` separators in every fragment. Code which
+reads i3 state after the command should not be inside of the batch. If the
+`with` block raised, nothing is sent and the moves expected by the mirror for
+the collected commands are forgotten.
+"""
+
+import threading
+from typing import List
+
+from i3ipc import CommandReply
+
+from lib.treemirror import TreeMirror
+
+
+class CmdBatch():
+    """ Collects i3 commands and runs them as one RUN_COMMAND. """
+    i3ipc = None
+    local = threading.local() # active batch per thread
+
+    @classmethod
+    def init(cls, i3) -> None:
+        """ i3: i3ipc connection. """
+        cls.i3ipc = i3
+
+    def __init__(self) -> None:
+        self.cmds = []
+        self.expected = [] # (con_id, count) of moves expected by the mirror
+
+    def __enter__(self) -> 'CmdBatch':
+        if getattr(CmdBatch.local, 'active', None) is None:
+            CmdBatch.local.active = self
+        return CmdBatch.local.active
+
+    def __exit__(self, exc_type, *_) -> None:
+        if CmdBatch.local.active is self:
+            CmdBatch.local.active = None
+            if exc_type is None:
+                self.flush()
+            else:
+                self.drop()
+
+    def add(self, cmd: str, con=None) -> None:
+        """ Add command.
+            cmd (str): i3 command, can contain several commands separated by
+            comma.
+            con: optional container to run command for, the mirror expects
+            its move by the command. """
+        if con is not None:
+            count = TreeMirror.expect(con.id, cmd)
+            if count:
+                self.expected.append((con.id, count))
+            cmd = f'[con_id={con.id}] {cmd}'
+        self.cmds.append(cmd)
+
+    @staticmethod
+    def split_cmds(cmd: str) -> List[str]:
+        """ Split the i3 command string by top-level `,` and `;` separators,
+        the ones inside of quotes and criteria are skipped. """
+        ret, start, quoted, criteria, escaped = [], 0, False, False, False
+        for pos, char in enumerate(cmd):
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                quoted = not quoted
+            elif quoted:
+                continue
+            elif char == '[':
+                criteria = True
+            elif char == ']':
+                criteria = False
+            elif char in ',;' and not criteria:
+                ret.append(cmd[start:pos])
+                start = pos + 1
+        ret.append(cmd[start:])
+        return ret
+
+    @staticmethod
+    def count_cmds(cmd: str) -> int:
+        """ Number of i3 commands in the fragment, so the number of replies
+        for it. """
+        return len(CmdBatch.split_cmds(cmd))
+
+    def drop(self) -> None:
+        """ Forget collected commands without running them. """
+        for con_id, count in reversed(self.expected):
+            TreeMirror.unexpect(con_id, count)
+        self.cmds, self.expected = [], []
+
+    def flush(self) -> List[List[CommandReply]]:
+        """ Run collected commands and print failed ones. Returns the list of
+        replies for every fragment. If i3 failed to parse some fragment then
+        it does not run the rest of them, they get the failed reply too. """
+        cmds, self.cmds, self.expected = self.cmds, [], []
+        if not cmds:
+            return []
+        replies = CmdBatch.i3ipc.command('; '.join(cmds))
+        ret, pos = [], 0
+        for cmd in cmds:
+            count = CmdBatch.count_cmds(cmd)
+            cmd_replies = replies[pos:pos + count]
+            pos += count
+            while len(cmd_replies) < count:
+                cmd_replies.append(CommandReply({
+                    'success': False,
+                    'error': 'not run, previous command failed to parse',
+                }))
+            for reply in cmd_replies:
+                if not reply.success:
+                    print(f'i3 command failed [{cmd}]: {reply.error}')
+            ret.append(cmd_replies)
+        return ret
@@ -6,6 +6,8 @@ from . extension import extension
 from . checker import checker
 
 class conf_gen(extension, cfg):
+    lazy = True
+
     def __init__(self, i3) -> None:
         super().__init__()
         cfg.__init__(self, i3)
@@ -133,9 +135,15 @@ class conf_gen(extension, cfg):
         return ret
 
     def mods_commands(self) -> str:
+        """ With dispatch = "nop" bindings are `nop negi3wm <mod> ...` i3
+        commands which negi3wm gets from the binding event, so there is no
+        fork/exec of send on keypress. """
         ret = ''
+        cmd = f'exec --no-startup-id {self.send_path}'
+        if self.cfg.get('dispatch', 'send') == 'nop':
+            cmd = 'nop negi3wm'
         for mod in sorted(extension.get_mods()):
-            ret += (f'set ${mod} exec --no-startup-id {self.send_path} {mod}\n')
+            ret += f'set ${mod} {cmd} {mod}\n'
         return ret
 
     def workspaces(self) -> str:
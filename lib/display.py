@@ -7,16 +7,24 @@ from misc import Misc
 
 
 class Display():
-    d = display.Display()
-    s = d.screen()
-    window = s.root.create_window(0, 0, 1, 1, 1, s.root_depth)
-    xrandr_cache = randr.get_screen_info(window)._data
+    xrandr_cache = None # screen info, read from X on the first use
     resolution_list = []
 
+    @classmethod
+    def screen_info(cls) -> dict:
+        """ xrandr screen info. X is connected on the first call, so modules
+        can be imported without it, but used only with X. """
+        if cls.xrandr_cache is None:
+            d = display.Display()
+            s = d.screen()
+            window = s.root.create_window(0, 0, 1, 1, 1, s.root_depth)
+            cls.xrandr_cache = randr.get_screen_info(window)._data
+        return cls.xrandr_cache
+
     @classmethod
     def get_screen_resolution(cls) -> dict:
-        size_id = cls.xrandr_cache['size_id']
-        resolution = cls.xrandr_cache['sizes'][size_id]
+        size_id = cls.screen_info()['size_id']
+        resolution = cls.screen_info()['sizes'][size_id]
         return {
             'width': int(resolution['width_in_pixels']),
             'height': int(resolution['height_in_pixels'])
@@ -24,7 +32,7 @@ class Display():
 
     @classmethod
     def get_screen_resolution_data(cls) -> dict:
-        return cls.xrandr_cache['sizes']
+        return cls.screen_info()['sizes']
 
     @classmethod
     def xrandr_resolution_list(cls) -> dict:
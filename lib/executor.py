@@ -18,6 +18,7 @@ from extension import extension
 from cfg import cfg
 from misc import Misc
 from matcher import Matcher
+from lib.treemirror import TreeMirror
 
 
 class env():
@@ -187,6 +188,8 @@ class executor(extension, cfg):
     modifing of various parameters.
     cfg: configuration manager to autosave/autoload TOML-configutation with
     inotify """
+    lazy = True
+
     def __init__(self, i3) -> None:
         cfg.__init__(self, i3)
         self.envs = {}
@@ -251,7 +254,7 @@ class executor(extension, cfg):
         if self.env.with_tmux:
             if self.env.name in self.detect_session_bind(
                     self.env.sockpath, self.env.name):
-                if not self.i3.get_tree().find_classed(self.env.wclass):
+                if not TreeMirror.find_classed(self.env.wclass):
                     self.attach_to_session()
             else:
                 self.create_new_session()
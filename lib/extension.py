@@ -1,18 +1,57 @@
-from typing import List
+from typing import Callable, Dict, List
+from lib.i3events import I3Events
 from lib.reflection import Reflection
 
 class extension():
+    # Create module on the first use instead of the daemon start.
+    lazy = False
+    # i3 event subscriptions: module name -> [(event, handler)]. Modules are
+    # reinitialized on config reload, subscribe replaces their handlers
+    # instead of adding one more copy on every reload.
+    handlers = {}
+
     def __init__(self):
         self.bindings = {}
 
+    def subscribe(self, i3, event: str, handler: Callable) -> None:
+        """ Subscribe the module handler to the i3 event. The handler with
+        the same event and name from the previous init of the module is
+        unsubscribed, so reinit does not duplicate handlers.
+            i3: i3ipc connection.
+            event (str): i3 event, like 'window::focus'.
+            handler (Callable): function of (i3, event). """
+        subs = extension.handlers.setdefault(self.__class__.__name__, [])
+        name = getattr(handler, '__name__', repr(handler))
+        for pos, (sub_event, sub) in enumerate(subs):
+            if sub_event == event and \
+                    getattr(sub, '__name__', repr(sub)) == name:
+                i3.off(sub)
+                del subs[pos]
+                break
+        i3.on(event, handler)
+        subs.append((event, handler))
+
+    @staticmethod
+    def subscriptions(i3) -> Dict[str, List[str]]:
+        """ Handlers subscribed to i3 events of the connection, including
+        ones not registered by subscribe: event -> handler names. The same
+        name twice means leaked handler. """
+        ret = {}
+        for event, detail, handler in I3Events.subscriptions(i3):
+            if detail:
+                event += '::' + detail
+            ret.setdefault(event, []).append(I3Events.name(handler))
+        return ret
+
     @staticmethod
     def get_mods():
         return Reflection.get_mods()
 
-    def send_msg(self, args: List) -> None:
+    def send_msg(self, args: List):
         """ Creates bindings from socket IPC to current module public function
         calls. This function defines bindings to the module methods that can be
         used by external users as i3-bindings, etc. Need the [send] binary
         which can send commands to the appropriate socket.
-        args (List): argument list for the selected function. """
-        self.bindings[args[0]](*args[1:])
+        args (List): argument list for the selected function.
+        Returns binding result, which is sent back to the waiting client. """
+        return self.bindings[args[0]](*args[1:])
@@ -0,0 +1,864 @@
+""" Stand-in i3 for replays, tests and benchmarks without i3 and X.
+
+FakeI3 is the i3 state model answering i3 IPC messages: the layout tree is
+taken from the recorded snapshot or built by FakeI3.synthetic_tree.
+
+For replays (execute=False) the model is patched by recorded window and
+workspace events, so get_tree, get_workspaces, get_marks and so on answer
+what i3 would answer at this moment of the session. Commands are only
+counted and replied as successful: their effect is in the events recorded
+after them.
+
+With execute=True commands are run against the model: criteria, mark,
+unmark, move (scratchpad, to workspace, absolute position), resize set,
+focus, workspace, scratchpad show, fullscreen, floating and kill, with the
+same window and workspace events as i3 sends. Other commands are counted in
+`unsupported` and replied as successful.
+
+FakeConnection is the in-process i3ipc connection to FakeI3, FakeI3Server
+speaks the i3 binary protocol on the unix socket, so the real
+i3ipc.Connection(socket_path) works with it, events included.
+
+FakeX.install() stubs X for modules: the screen has the fake i3 output size
+and windows have no EWMH properties, so every window is visible and is not
+a dialog. The daemon itself fails without X.
+"""
+
+import os
+import re
+import json
+import shlex
+import struct
+import enum
+import asyncio
+import threading
+import collections
+from typing import Dict, List, Optional, Tuple
+
+from i3ipc import events
+
+from display import Display
+from lib.cmdbatch import CmdBatch
+from lib.i3events import OfflineConnection
+from lib.negewmh import NegEWMH
+import negewmh # remember_focused imports it by this name
+
+
+class MessageType(enum.IntEnum):
+    """ i3 IPC message types. """
+    COMMAND = 0
+    GET_WORKSPACES = 1
+    SUBSCRIBE = 2
+    GET_OUTPUTS = 3
+    GET_TREE = 4
+    GET_MARKS = 5
+    GET_BAR_CONFIG = 6
+    GET_VERSION = 7
+    GET_BINDING_MODES = 8
+    GET_CONFIG = 9
+    SEND_TICK = 10
+
+
+class FakeI3():
+    """ i3 state model answering i3 IPC messages. """
+    criteria_re = re.compile(r'(\w+)\s*=\s*("(?:[^"\\]|\\.)*"|[^\s\]]+)')
+    rect = {'x': 0, 'y': 0, 'width': 1920, 'height': 1200}
+    version = {
+        'major': 4, 'minor': 18, 'patch': 0,
+        'human_readable': '4.18 (negi3wm fake)',
+        'loaded_config_file_name': '',
+    }
+
+    def __init__(self, tree: dict, outputs: Optional[List] = None,
+                 version: Optional[dict] = None,
+                 execute: bool = False) -> None:
+        """ tree (dict): get_tree reply data.
+            outputs: get_outputs reply data, derived from the tree if None.
+            version (dict): get_version reply data.
+            execute (bool): run commands against the model. """
+        self.tree = tree
+        self.execute = execute
+        self.listeners = [] # callables(name, data) for emitted events
+        self.unsupported = collections.Counter() # command -> count
+        self.outputs = outputs
+        self.version = version or FakeI3.version
+        self.calls = collections.Counter() # message type name -> count
+        self.commands = 0 # number of commands in all COMMAND messages
+        self.tree_json = None # serialized tree, dropped on change
+        self.index = None # con_id -> (node, parent)
+
+    def nodes(self) -> Dict:
+        """ Returns con_id -> (node, parent), built on demand and kept up to
+        date by attach and remove, so it is not in the tree order. """
+        if self.index is None:
+            self.index = {}
+            for node, parent in self.walk():
+                self.index[node['id']] = (node, parent)
+        return self.index
+
+    def walk(self, root: Optional[dict] = None, parent: Optional[dict] = None):
+        """ Yields (node, parent) of the subtree in the tree order. """
+        stack = [(root or self.tree, parent)]
+        while stack:
+            node, parent = stack.pop()
+            yield node, parent
+            children = node.get('nodes', []) + node.get('floating_nodes', [])
+            # reversed, so nodes are popped in the tree order
+            for child in reversed(children):
+                stack.append((child, node))
+
+    def attach(self, parent: dict, node: dict, key: str = 'nodes') -> None:
+        """ Append the node to the children of the parent. """
+        parent.setdefault(key, []).append(node)
+        if self.index is not None:
+            for child, child_parent in self.walk(node, parent):
+                self.index[child['id']] = (child, child_parent)
+        self.changed()
+
+    def changed(self) -> None:
+        """ Drop the serialized tree. """
+        self.tree_json = None
+
+    def find_focused(self) -> dict:
+        """ Focused container: follow the focus stack from the root. """
+        return self.leaf_focus(self.tree)
+
+    def workspace_of(self, con_id: int) -> Optional[dict]:
+        """ Workspace node containing the container. """
+        nodes = self.nodes()
+        entry = nodes.get(con_id)
+        while entry is not None:
+            node, parent = entry
+            if node.get('type') == 'workspace':
+                return node
+            entry = nodes.get(parent['id']) if parent else None
+        return None
+
+    def set_focus(self, node: dict) -> None:
+        """ Focus the node: update the focused flag and focus stacks up to
+        the root. """
+        for other, _ in self.nodes().values():
+            other['focused'] = False
+        node['focused'] = True
+        con_id, entry = node['id'], self.nodes().get(node['id'])
+        while entry is not None and entry[1] is not None:
+            parent = entry[1]
+            focus = parent.setdefault('focus', [])
+            if con_id in focus:
+                focus.remove(con_id)
+            focus.insert(0, con_id)
+            con_id, entry = parent['id'], self.nodes().get(parent['id'])
+        self.changed()
+
+    def remove(self, con_id: int) -> None:
+        """ Remove the container from the tree. """
+        entry = self.nodes().get(con_id)
+        if entry is None or entry[1] is None:
+            return
+        node, parent = entry
+        for key in ('nodes', 'floating_nodes', 'focus'):
+            items = parent.get(key, [])
+            if key == 'focus':
+                parent[key] = [i for i in items if i != con_id]
+            else:
+                parent[key] = [n for n in items if n['id'] != con_id]
+        for child, _ in self.walk(node):
+            self.index.pop(child['id'], None)
+        self.changed()
+
+    def replace(self, data: dict) -> Optional[dict]:
+        """ Update container properties from the event payload, children are
+        kept from the model. """
+        entry = self.nodes().get(data['id'])
+        if entry is None:
+            return None
+        node = entry[0]
+        children = {
+            key: node[key] for key in ('nodes', 'floating_nodes', 'focus')
+            if key in node
+        }
+        node.clear()
+        node.update(data)
+        node.update(children)
+        self.changed()
+        return node
+
+    def apply(self, name: str, data: dict) -> None:
+        """ Patch the model by the recorded event.
+            name (str): event name like window or workspace.
+            data (dict): event payload. """
+        change = data.get('change')
+        if name == 'window':
+            con = data['container']
+            if change == 'new':
+                ws = self.workspace_of(self.find_focused()['id'])
+                if ws is not None:
+                    self.attach(ws, dict(con))
+            elif change == 'close':
+                self.remove(con['id'])
+            else:
+                node = self.replace(con)
+                if node is not None and change == 'focus':
+                    self.set_focus(node)
+        elif name == 'workspace':
+            current = data.get('current') or {}
+            if change == 'init' and current:
+                focused_ws = self.workspace_of(self.find_focused()['id'])
+                if focused_ws is not None:
+                    content = self.nodes()[focused_ws['id']][1]
+                    self.attach(content, dict(current))
+            elif change == 'empty' and current:
+                self.remove(current['id'])
+            elif current:
+                node = self.replace(current)
+                if node is not None and change == 'focus':
+                    self.set_focus(self.leaf_focus(node))
+
+    def leaf_focus(self, node: dict) -> dict:
+        """ Focused descendant of the node, the node itself if it has no
+        children in its focus stack. """
+        while node.get('focus'):
+            child = self.nodes().get(node['focus'][0])
+            if child is None:
+                break
+            node = child[0]
+        return node
+
+    def workspaces(self) -> List[dict]:
+        """ get_workspaces reply data. """
+        focused_ws = self.workspace_of(self.find_focused()['id'])
+        ret = []
+        for output in self.tree.get('nodes', []):
+            if output.get('name', '').startswith('__'):
+                continue
+            for content in output.get('nodes', []):
+                visible = (content.get('focus') or [None])[0]
+                for ws in content.get('nodes', []):
+                    if ws.get('type') != 'workspace':
+                        continue
+                    ret.append({
+                        'id': ws['id'], 'num': ws.get('num', -1),
+                        'name': ws.get('name', ''),
+                        'visible': ws['id'] == visible,
+                        'focused': focused_ws is not None and \
+                            ws['id'] == focused_ws['id'],
+                        'urgent': ws.get('urgent', False),
+                        'rect': ws.get('rect', {}),
+                        'output': output.get('name', ''),
+                    })
+        return ret
+
+    def derived_outputs(self) -> List[dict]:
+        """ get_outputs reply data built from the tree. """
+        ret = []
+        for output in self.tree.get('nodes', []):
+            if output.get('name', '').startswith('__'):
+                continue
+            current = None
+            for ws in self.workspaces():
+                if ws['output'] == output.get('name') and ws['visible']:
+                    current = ws['name']
+            ret.append({
+                'name': output.get('name', ''), 'active': True,
+                'primary': False, 'current_workspace': current,
+                'rect': output.get('rect', {}),
+            })
+        return ret
+
+    def marks(self) -> List[str]:
+        """ get_marks reply data. """
+        return [
+            mark for node, _ in self.nodes().values()
+            for mark in node.get('marks', [])
+        ]
+
+    @staticmethod
+    def con(con_id: int, con_type: str, name: str, **props) -> dict:
+        """ Container data with all fields i3ipc needs. """
+        data = {
+            'id': con_id, 'type': con_type, 'name': name,
+            'rect': dict(FakeI3.rect), 'window_rect': dict(FakeI3.rect),
+            'deco_rect': {'x': 0, 'y': 0, 'width': 0, 'height': 0},
+            'geometry': dict(FakeI3.rect), 'nodes': [],
+            'floating_nodes': [], 'focus': [], 'focused': False, 'marks': [],
+            'fullscreen_mode': 0, 'layout': 'splith', 'border': 'none',
+            'floating': 'auto_off', 'scratchpad_state': 'none',
+            'urgent': False, 'sticky': False, 'window': None,
+        }
+        data.update(props)
+        return data
+
+    @staticmethod
+    def synthetic_tree(windows: int, workspaces: int = 10,
+                       classes: Optional[List[Tuple[str, str]]] = None) \
+            -> dict:
+        """ Layout of one 1920x1200 output with [windows] windows spread
+        round-robin over [workspaces] workspaces, plus the empty scratchpad.
+        The first window is focused.
+            classes: (class, instance) pairs to use round-robin. """
+        classes = classes or [
+            ('URxvt', 'term'), ('firefox', 'Navigator'), ('mpv', 'gl'),
+            ('TelegramDesktop', 'telegram-desktop'), ('Zathura', 'zathura'),
+        ]
+        ids = iter(range(1, 10 ** 9))
+        con = FakeI3.con
+        wss = [
+            con(next(ids), 'workspace', str(num + 1), num=num + 1)
+            for num in range(max(workspaces, 1))
+        ]
+        for num in range(windows):
+            wm_class, instance = classes[num % len(classes)]
+            con_id = next(ids)
+            ws = wss[num % len(wss)]
+            ws['nodes'].append(con(
+                con_id, 'con', f'{wm_class} {num}', window=0x400000 + con_id,
+                window_properties={
+                    'class': wm_class, 'instance': instance,
+                    'title': f'{wm_class} {num}', 'window_role': None,
+                }
+            ))
+            ws['focus'].append(con_id)
+        content = con(
+            next(ids), 'con', 'content', nodes=wss,
+            focus=[ws['id'] for ws in wss]
+        )
+        output = con(
+            next(ids), 'output', 'eDP-1', nodes=[content],
+            focus=[content['id']]
+        )
+        scratch = con(next(ids), 'workspace', '__i3_scratch', num=-1)
+        scratch_content = con(
+            next(ids), 'con', 'content', nodes=[scratch], focus=[scratch['id']]
+        )
+        i3_output = con(
+            next(ids), 'output', '__i3', nodes=[scratch_content],
+            focus=[scratch_content['id']]
+        )
+        root = con(
+            next(ids), 'root', 'root', nodes=[i3_output, output],
+            focus=[output['id'], i3_output['id']]
+        )
+        fake = FakeI3(root)
+        fake.leaf_focus(root)['focused'] = True
+        return root
+
+    def emit(self, name: str, data: dict) -> None:
+        """ Send i3 event to the listeners. """
+        for listener in self.listeners:
+            listener(name, data)
+
+    def emit_window(self, change: str, node: dict) -> None:
+        """ Send window event about the container. """
+        self.emit('window', {'change': change, 'container': node})
+
+    @staticmethod
+    def split_command(payload: str) -> List[List[str]]:
+        """ Split the command string to `;` separated parts of comma
+        separated commands, criteria are kept with the command. """
+        parts, cmds, token = [], [], ''
+        quoted, criteria, escaped = False, False, False
+        for char in payload + ';':
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                quoted = not quoted
+            elif not quoted and char == '[':
+                criteria = True
+            elif not quoted and char == ']':
+                criteria = False
+            elif not quoted and not criteria and char in ',;':
+                cmds.append(token.strip())
+                token = ''
+                if char == ';':
+                    parts.append(cmds)
+                    cmds = []
+                continue
+            token += char
+        return parts
+
+    def criterion(self, node: dict, key: str, val: str, focused: dict) \
+            -> bool:
+        """ Check one criterion like class="^URxvt$" for the node. """
+        props = node.get('window_properties') or {}
+        floating = str(node.get('floating', '')).endswith('_on')
+        if key == 'con_id':
+            if val == '__focused__':
+                return node['id'] == focused['id']
+            return str(node['id']) == val
+        if key == 'id':
+            return str(node.get('window')) == val
+        if key in ('class', 'instance', 'title', 'window_role'):
+            return node.get('window') is not None and \
+                re.search(val, props.get(key) or '') is not None
+        if key == 'con_mark':
+            return any(re.search(val, mark) for mark in node.get('marks', []))
+        if key in ('floating', 'tiling'):
+            return floating == (key == 'floating')
+        if key == 'workspace':
+            ws = self.workspace_of(node['id'])
+            return ws is not None and re.search(val, ws['name']) is not None
+        return False
+
+    def match_criteria(self, criteria: str) -> List[dict]:
+        """ Containers matched by criteria in the tree order. """
+        focused = self.find_focused()
+        rules = [
+            (key, val[1:-1] if val.startswith('"') else val)
+            for key, val in FakeI3.criteria_re.findall(criteria)
+        ]
+        con_ids = [val for key, val in rules if key == 'con_id']
+        if con_ids:
+            # the most used criteria, look it up
+            if con_ids[0] == '__focused__':
+                nodes = [focused]
+            else:
+                entry = self.nodes().get(int(con_ids[0])) \
+                    if con_ids[0].isdigit() else None
+                nodes = [entry[0]] if entry else []
+        else:
+            nodes = [node for node, _ in self.walk()]
+        return [
+            node for node in nodes
+            if node.get('type') in ('con', 'floating_con', 'workspace')
+            and all(
+                self.criterion(node, key, val, focused) for key, val in rules
+            )
+        ]
+
+    def run_command(self, payload: str) -> List[dict]:
+        """ Run i3 command string, returns reply for every command. """
+        replies = []
+        for cmds in FakeI3.split_command(payload):
+            # criteria apply to the following comma separated commands, until
+            # the next criteria
+            criteria, targets = '', None
+            for cmd in cmds:
+                match = re.match(r'\[(.*?)\]\s*(.*)$', cmd, re.S)
+                if match:
+                    criteria, cmd = match.group(1), match.group(2)
+                    targets = None
+                if targets is None:
+                    targets = self.match_criteria(criteria) if criteria \
+                        else [self.find_focused()]
+                try:
+                    args = shlex.split(cmd)
+                except ValueError:
+                    args = cmd.split()
+                name = args[0] if args else ''
+                handler = getattr(self, f'cmd_{name}', None)
+                if handler is None:
+                    if name not in ('exec', 'nop'):
+                        self.unsupported[name] += 1
+                    replies.append({'success': True})
+                    continue
+                error = handler(targets, args[1:], bool(criteria))
+                if error:
+                    replies.append({'success': False, 'error': error})
+                else:
+                    replies.append({'success': True})
+        return replies
+
+    def focused_workspace(self) -> dict:
+        """ Workspace of the focused container. """
+        return self.workspace_of(self.find_focused()['id'])
+
+    def find_workspace(self, name: str) -> Optional[dict]:
+        """ Workspace by name or None. """
+        for node, _ in self.nodes().values():
+            if node.get('type') == 'workspace' and node['name'] == name:
+                return node
+        return None
+
+    def ensure_workspace(self, name: str) -> dict:
+        """ Find workspace by name, create it on the focused output if there
+        is no such workspace. """
+        ws = self.find_workspace(name)
+        if ws is None:
+            content = self.nodes()[self.focused_workspace()['id']][1]
+            num = int(name) if name.isdigit() else -1
+            ws = FakeI3.con(max(self.nodes()) + 1, 'workspace', name, num=num)
+            self.attach(content, ws)
+            self.emit('workspace', {
+                'change': 'init', 'current': ws, 'old': None
+            })
+        return ws
+
+    def scratch_workspace(self) -> dict:
+        """ Hidden workspace of the scratchpad windows. """
+        return self.find_workspace('__i3_scratch')
+
+    def move_to_workspace(self, node: dict, ws: dict,
+                          floating: Optional[bool] = None) -> None:
+        """ Move the container to the workspace, focus goes to the next
+        container of the old workspace, like in i3. The move inside the same
+        workspace, like the floating toggle, sends no move event. """
+        if node['type'] == 'workspace':
+            return
+        old_ws = self.workspace_of(node['id'])
+        was_focused = node.get('focused')
+        self.remove(node['id'])
+        if floating is not None:
+            node['floating'] = 'user_on' if floating else 'user_off'
+        if ws is self.scratch_workspace() \
+                and node['scratchpad_state'] == 'none':
+            node['scratchpad_state'] = 'changed'
+        ws.setdefault('focus', []).append(node['id'])
+        self.attach(
+            ws, node, 'floating_nodes'
+            if str(node['floating']).endswith('_on') else 'nodes'
+        )
+        if old_ws is not ws:
+            self.emit_window('move', node)
+        if was_focused and old_ws is not None and old_ws is not ws:
+            node['focused'] = False
+            new_focus = self.leaf_focus(old_ws)
+            self.set_focus(new_focus)
+            if new_focus.get('window') is not None:
+                self.emit_window('focus', new_focus)
+
+    def focus(self, node: dict) -> None:
+        """ Focus the container, switching workspace if needed. """
+        old_ws = self.focused_workspace()
+        ws = self.workspace_of(node['id'])
+        if ws is self.scratch_workspace():
+            self.move_to_workspace(node, old_ws, floating=True)
+            ws = old_ws
+        self.set_focus(self.leaf_focus(node))
+        if ws is not old_ws:
+            self.emit('workspace', {
+                'change': 'focus', 'current': ws, 'old': old_ws
+            })
+        if node.get('window') is not None:
+            self.emit_window('focus', node)
+
+    # i3 commands: cmd_<name>(targets, args, has_criteria) runs the command
+    # for the matched containers, returns error message or ''.
+
+    def cmd_mark(self, targets: List[dict], args: List[str], _) -> str:
+        names = [arg for arg in args if not arg.startswith('--')]
+        if not names or not targets:
+            return 'No mark or no matching window'
+        mark, node = names[-1], targets[-1]
+        for other, _ in self.nodes().values():
+            if other is not node and mark in other.get('marks', []):
+                other['marks'].remove(mark)
+        if '--add' in args or '--toggle' in args:
+            if mark in node['marks'] and '--toggle' in args:
+                node['marks'].remove(mark)
+            elif mark not in node['marks']:
+                node['marks'].append(mark)
+        else:
+            node['marks'] = [mark]
+        self.changed()
+        self.emit_window('mark', node)
+        return ''
+
+    def cmd_unmark(self, targets: List[dict], args: List[str],
+                   has_criteria: bool) -> str:
+        if not has_criteria:
+            targets = [node for node, _ in self.nodes().values()]
+        for node in targets:
+            if node.get('marks'):
+                if args:
+                    node['marks'] = [m for m in node['marks'] if m != args[0]]
+                else:
+                    node['marks'] = []
+                self.emit_window('mark', node)
+        self.changed()
+        return ''
+
+    def cmd_move(self, targets: List[dict], args: List[str], _) -> str:
+        args = [
+            arg for arg in args if arg not in (
+                'window', 'container', 'to', '--no-auto-back-and-forth'
+            )
+        ]
+        if args[:1] == ['scratchpad']:
+            for node in targets:
+                self.move_to_workspace(
+                    node, self.scratch_workspace(), floating=True
+                )
+        elif args[:1] == ['workspace']:
+            name = [arg for arg in args[1:] if arg != 'number']
+            if name == ['current']:
+                ws = self.focused_workspace()
+            else:
+                ws = self.ensure_workspace(' '.join(name))
+            for node in targets:
+                self.move_to_workspace(node, ws)
+        elif args[:2] == ['absolute', 'position']:
+            nums = [int(arg) for arg in args[2:] if arg.lstrip('-').isdigit()]
+            for node in targets:
+                node['rect']['x'], node['rect']['y'] = nums[:2]
+            self.changed()
+        else:
+            self.unsupported[' '.join(['move'] + args[:1])] += 1
+        return ''
+
+    def cmd_resize(self, targets: List[dict], args: List[str], _) -> str:
+        if args[:1] != ['set']:
+            self.unsupported['resize'] += 1
+            return ''
+        nums = [int(arg) for arg in args[1:] if arg.isdigit()]
+        for node in targets:
+            node['rect']['width'], node['rect']['height'] = nums[:2]
+        self.changed()
+        return ''
+
+    def cmd_focus(self, targets: List[dict], args: List[str], _) -> str:
+        if args:
+            self.unsupported[f'focus {args[0]}'] += 1
+        elif targets:
+            self.focus(targets[-1])
+        return ''
+
+    def cmd_workspace(self, _targets, args: List[str], _) -> str:
+        name = [
+            arg for arg in args
+            if arg not in ('number', '--no-auto-back-and-forth')
+        ]
+        ws = self.ensure_workspace(' '.join(name))
+        self.focus(ws)
+        return ''
+
+    def cmd_scratchpad(self, targets: List[dict], args: List[str],
+                       has_criteria: bool) -> str:
+        if args[:1] != ['show']:
+            self.unsupported['scratchpad'] += 1
+            return ''
+        scratch = self.scratch_workspace()
+        if not has_criteria:
+            targets = scratch.get('floating_nodes', [])[:1]
+        for node in targets:
+            ws = self.workspace_of(node['id'])
+            if ws is scratch:
+                self.focus(node)
+            elif node['scratchpad_state'] != 'none':
+                # shown scratchpad window is hidden back
+                self.move_to_workspace(node, scratch)
+        return ''
+
+    def cmd_fullscreen(self, targets: List[dict], args: List[str], _) \
+            -> str:
+        mode = args[-1] if args else 'toggle'
+        for node in targets:
+            if mode == 'toggle':
+                node['fullscreen_mode'] = 0 if node['fullscreen_mode'] else 1
+            else:
+                node['fullscreen_mode'] = int(mode == 'enable')
+            self.emit_window('fullscreen_mode', node)
+        self.changed()
+        return ''
+
+    def cmd_floating(self, targets: List[dict], args: List[str], _) -> str:
+        mode = args[0] if args else 'toggle'
+        for node in targets:
+            floating = str(node['floating']).endswith('_on')
+            floating = not floating if mode == 'toggle' else mode == 'enable'
+            ws = self.workspace_of(node['id'])
+            if ws is not None:
+                self.move_to_workspace(node, ws, floating=floating)
+            self.emit_window('floating', node)
+        return ''
+
+    def cmd_kill(self, targets: List[dict], _args, _) -> str:
+        for node in targets:
+            if node.get('window') is not None:
+                self.remove(node['id'])
+                self.emit_window('close', node)
+        return ''
+
+    def reply(self, message_type: int, payload: str) -> str:
+        """ Returns JSON reply for the i3 IPC message. """
+        message_type = MessageType(message_type)
+        self.calls[message_type.name.lower()] += 1
+        if message_type == MessageType.COMMAND:
+            if self.execute:
+                replies = self.run_command(payload)
+                self.commands += len(replies)
+                return json.dumps(replies)
+            count = CmdBatch.count_cmds(payload) if payload.strip() else 0
+            self.commands += count
+            return json.dumps([{'success': True}] * count)
+        if message_type == MessageType.SEND_TICK:
+            self.emit('tick', {'first': False, 'payload': payload})
+            return json.dumps({'success': True})
+        if message_type == MessageType.GET_TREE:
+            if self.tree_json is None:
+                self.tree_json = json.dumps(self.tree)
+            return self.tree_json
+        if message_type == MessageType.GET_WORKSPACES:
+            return json.dumps(self.workspaces())
+        if message_type == MessageType.GET_OUTPUTS:
+            return json.dumps(self.outputs or self.derived_outputs())
+        if message_type == MessageType.GET_MARKS:
+            return json.dumps(self.marks())
+        if message_type == MessageType.GET_VERSION:
+            return json.dumps(self.version)
+        if message_type == MessageType.GET_BINDING_MODES:
+            return json.dumps(['default'])
+        if message_type == MessageType.GET_CONFIG:
+            return json.dumps({'config': ''})
+        if message_type == MessageType.GET_BAR_CONFIG:
+            return json.dumps({} if payload else [])
+        return json.dumps({'success': True})
+
+
+class FakeX():
+    """ Headless stand-in for X used by modules. """
+    @staticmethod
+    def install() -> None:
+        """ Stub screen info and window properties, should be called before
+        modules are created. """
+        Display.xrandr_cache = {
+            'size_id': 0,
+            'sizes': [{
+                'width_in_pixels': FakeI3.rect['width'],
+                'height_in_pixels': FakeI3.rect['height'],
+            }],
+        }
+        for ewmh in (NegEWMH, negewmh.NegEWMH):
+            ewmh.watch = classmethod(lambda _cls, loop: None)
+            ewmh.get_props = classmethod(lambda _cls, xids, prop: {})
+
+
+class FakeConnection(OfflineConnection):
+    """ i3ipc connection to FakeI3. """
+    event_classes = {
+        'workspace': lambda data, conn: events.WorkspaceEvent(data, conn),
+        'output': lambda data, _: events.OutputEvent(data),
+        'mode': lambda data, _: events.ModeEvent(data),
+        'window': lambda data, conn: events.WindowEvent(data, conn),
+        'barconfig_update':
+            lambda data, _: events.BarconfigUpdateEvent(data),
+        'binding': lambda data, _: events.BindingEvent(data),
+        'shutdown': lambda data, _: events.ShutdownEvent(data),
+        'tick': lambda data, _: events.TickEvent(data),
+        'input': lambda data, _: events.InputEvent(data),
+    }
+
+    def __init__(self, fake: FakeI3) -> None:
+        """ fake (FakeI3): i3 model to send messages to. """
+        super().__init__(fake.reply)
+        self.fake = fake
+
+    def emit(self, name: str, data: dict) -> None:
+        """ Apply the event to the model and call the handlers.
+            name (str): event name like window or workspace.
+            data (dict): event payload. """
+        self.fake.apply(name, data)
+        self.emit_event(name, FakeConnection.event_classes[name](data, self))
+
+
+class FakeI3Server():
+    """ i3 IPC unix socket server over FakeI3: the binary protocol with
+    `i3-ipc` magic, length and type header, requests and events. Events are
+    written to subscribers before the reply to the command which caused
+    them, so the client has them when the reply is read. """
+    magic = b'i3-ipc'
+    header = struct.Struct('=6sII')
+    # event name -> event type bit, in the i3 order
+    event_bits = {
+        name: bit for bit, name in enumerate([
+            'workspace', 'output', 'mode', 'window', 'barconfig_update',
+            'binding', 'shutdown', 'tick', 'input'
+        ])
+    }
+
+    def __init__(self, fake: FakeI3, path: str) -> None:
+        """ fake (FakeI3): i3 model, should be created with execute=True.
+            path (str): unix socket path. """
+        self.fake = fake
+        self.path = path
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.subscribers = {} # writer -> subscribed event names
+        self.clients = set() # writers of connected clients
+        fake.listeners.append(self.on_event)
+
+    def pack(self, msg_type: int, data) -> bytes:
+        """ i3 IPC message with the header. """
+        payload = data if isinstance(data, bytes) else data.encode('utf8')
+        return FakeI3Server.header.pack(
+            FakeI3Server.magic, len(payload), msg_type
+        ) + payload
+
+    def on_event(self, name: str, data: dict) -> None:
+        """ Send event to the subscribed clients. """
+        msg = None
+        for writer, names in self.subscribers.items():
+            if name in names:
+                if msg is None:
+                    msg = self.pack(
+                        (1 << 31) | FakeI3Server.event_bits[name],
+                        json.dumps(data)
+                    )
+                writer.write(msg)
+
+    async def handle_client(self, reader, writer) -> None:
+        """ Serve i3 IPC messages of the client connection. """
+        self.clients.add(writer)
+        try:
+            while True:
+                header = await reader.readexactly(FakeI3Server.header.size)
+                _, length, msg_type = FakeI3Server.header.unpack(header)
+                payload = (await reader.readexactly(length)).decode('utf8')
+                if msg_type == MessageType.SUBSCRIBE.value:
+                    names = set(json.loads(payload))
+                    self.subscribers.setdefault(writer, set()).update(names)
+                    writer.write(self.pack(msg_type, '{"success": true}'))
+                    if 'tick' in names:
+                        self.on_event('tick', {'first': True, 'payload': ''})
+                else:
+                    writer.write(
+                        self.pack(msg_type, self.fake.reply(msg_type, payload))
+                    )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.subscribers.pop(writer, None)
+            self.clients.discard(writer)
+            writer.close()
+
+    def start(self) -> None:
+        """ Serve in the background thread, returns when the socket is
+        ready. """
+        ready = threading.Event()
+
+        def serve():
+            self.loop = asyncio.new_event_loop()
+            self.server = self.loop.run_until_complete(
+                asyncio.start_unix_server(self.handle_client, self.path)
+            )
+            ready.set()
+            self.loop.run_forever()
+            self.loop.close()
+
+        self.thread = threading.Thread(target=serve, daemon=True)
+        self.thread.start()
+        ready.wait()
+
+    async def shutdown(self) -> None:
+        """ Close the server and client connections of the loop. """
+        self.server.close()
+        for writer in self.clients:
+            writer.close()
+        await asyncio.gather(*[
+            task for task in asyncio.all_tasks()
+            if task is not asyncio.current_task()
+        ])
+
+    def stop(self) -> None:
+        """ Stop serving and remove the socket. """
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop) \
+                .result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
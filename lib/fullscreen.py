@@ -5,6 +5,7 @@ import subprocess
 import shutil
 from extension import extension
 from cfg import cfg
+from lib.treemirror import TreeMirror
 
 class fullscreen(extension, cfg):
     def __init__(self, i3conn):
@@ -25,8 +26,8 @@ class fullscreen(extension, cfg):
             "reload": self.reload_config,
             "fullscreen": self.hide,
         }
-        self.i3ipc.on('window::close', self.on_window_close)
-        self.i3ipc.on('workspace::focus', self.on_workspace_focus)
+        self.subscribe(self.i3ipc, 'window::close', self.on_window_close)
+        self.subscribe(self.i3ipc, 'workspace::focus', self.on_workspace_focus)
 
     def on_workspace_focus(self, _, event):
         """ Hide panel if it is fullscreen workspace, show panel otherwise """
@@ -66,9 +67,8 @@ class fullscreen(extension, cfg):
 
     def hide(self):
         """ Hide panel for this workspace """
-        i3_tree = self.i3ipc.get_tree()
-        fullscreens = i3_tree.find_fullscreen()
-        focused_ws = i3_tree.find_focused().workspace().name
+        fullscreens = TreeMirror.find_fullscreen()
+        focused_ws = TreeMirror.focused_workspace()
         if not fullscreens:
             return
         for win in fullscreens:
@@ -79,7 +79,7 @@ class fullscreen(extension, cfg):
                             self.panel_action('hide', restore=False)
                             break
 
-    def on_window_close(self, i3conn, event):
+    def on_window_close(self, _, event):
         """ If there are no fullscreen windows then show panel closing window.
         i3: i3ipc connection.
         event: i3ipc event. We can extract window from it using
@@ -87,5 +87,5 @@ class fullscreen(extension, cfg):
         if event.container.window_class in self.panel_classes:
             return
         if self.show_panel_on_close:
-            if not i3conn.get_tree().find_fullscreen():
+            if not TreeMirror.find_fullscreen():
                 self.panel_action('show', restore=True)
@@ -4,23 +4,34 @@ in this module geometry is parsed from config X11 internal format to the i3
 commands. """
 
 import re
-from typing import List
+from typing import Dict, List, Optional
 from display import Display
 from misc import Misc
 
 class geom():
-    def __init__(self, cfg: dict) -> None:
+    def __init__(self, cfg: dict, geoms: Optional[Dict] = None) -> None:
         """ Init function
-        cfg: config bypassed from target module, nsd for example. """
+        cfg: config bypassed from target module, nsd for example.
+        geoms: tag -> geometry numbers from geom.parse_all, cached with the
+        parsed config, parsed from cfg if None. """
         self.cmd_list = [] # Generated command list for i3 config
         self.parsed_geom = {} # Geometry in the i3-commands format.
         # Set current screen resolution
         self.current_resolution = Display.get_screen_resolution()
         self.cfg = cfg # External config
+        self.geoms = geoms if geoms is not None else geom.parse_all(cfg)
         # Fill self.parsed_geom with self.parse_geom function.
         for tag in self.cfg:
             self.parsed_geom[tag] = self.parse_geom(tag)
 
+    @staticmethod
+    def parse_all(cfg: dict) -> Dict:
+        """ Returns tag -> [width, height, x, y] of the 1920x1200 screen. """
+        return {
+            tag: [int(num) for num in re.split(r'[x+]', tag_cfg["geom"])]
+            for tag, tag_cfg in cfg.items()
+        }
+
     # Scratchpad need this function
     def get_geom(self, tag: str) -> str:
         """ External function used by nsd """
@@ -31,10 +42,10 @@ class geom():
             tag (str): target self.cfg tag """
         rd = {'width': 1920, 'height': 1200} # resolution_default
         cr = self.current_resolution # current resolution
-        g = re.split(r'[x+]', self.cfg[tag]["geom"])
+        g = self.geoms[tag]
         cg = [] # converted_geom
-        cg.append(int(int(g[0])*cr['width'] / rd['width']))
-        cg.append(int(int(g[1])*cr['height'] / rd['height']))
-        cg.append(int(int(g[2])*cr['width'] / rd['width']))
-        cg.append(int(int(g[3])*cr['height'] / rd['height']))
+        cg.append(int(g[0]*cr['width'] / rd['width']))
+        cg.append(int(g[1]*cr['height'] / rd['height']))
+        cg.append(int(g[2]*cr['width'] / rd['width']))
+        cg.append(int(g[3]*cr['height'] / rd['height']))
         return "move absolute position {2} {3}, resize set {0} {1}".format(*cg)
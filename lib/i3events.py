@@ -0,0 +1,214 @@
+""" Adapter for the i3ipc internals used by negi3wm.
+
+i3ipc has no public API to read events from the loop of somebody else:
+Connection.main() blocks the thread, and i3ipc.aio would need every module
+to be async. So the daemon reads the event socket of the sync connection
+from its asyncio loop, which uses private parts of i3ipc.Connection. This
+module is the only place which touches them. OfflineConnection is the
+connection without i3 for the fake i3 (lib/fake_i3.py), its state is set up
+here too, because Connection.__init__ connects to i3.
+
+i3ipc is pinned in requirements.txt to the version these internals are
+checked with. supported() checks that the installed i3ipc still has them,
+checker runs it before the daemon starts, and bin/fake_bench.py drives the
+real i3ipc connection through this adapter against the fake i3 server.
+
+Hooks wrap every event handler call of the connection, so latency histograms
+and the replay profiler measure handlers without own copies of the i3ipc
+event dispatch:
+
+    def timed(handler, call):
+        start = timeit.default_timer()
+        try:
+            return call()
+        finally:
+            print(I3Events.name(handler), timeit.default_timer() - start)
+
+    I3Events.add_hook(i3, timed)
+
+The hook added later is the outer one. Listeners added by add_listener()
+see every event before its handlers, like the session recorder does.
+"""
+
+import functools
+import select
+import threading
+from typing import Callable, List, Tuple
+
+import i3ipc
+from i3ipc._private import PubSub
+
+
+class Handler():
+    """ Subscribed event handler, calls the original one through the hooks.
+    It is equal to the original handler, so conn.off(handler) unsubscribes
+    it. """
+    __slots__ = ('handler',)
+
+    def __init__(self, handler: Callable) -> None:
+        self.handler = handler
+
+    def __call__(self, conn, *data):
+        call = functools.partial(self.handler, conn, *data)
+        for hook in conn._pubsub.hooks:
+            call = functools.partial(hook, self.handler, call)
+        return call()
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Handler):
+            other = other.handler
+        return self.handler == other
+
+    def __hash__(self) -> int:
+        return hash(self.handler)
+
+
+class HookedPubSub(PubSub):
+    """ i3ipc pubsub which subscribes handlers wrapped by Handler, events
+    are dispatched by i3ipc itself. """
+    def __init__(self, conn) -> None:
+        super().__init__(conn)
+        self.hooks = [] # callable(handler, call), the inner one first
+        self.listeners = [] # callable(event name, event)
+
+    def emit(self, event, data):
+        for listener in self.listeners:
+            listener(event, data)
+        super().emit(event, data)
+
+    def subscribe(self, detailed_event, handler):
+        if not isinstance(handler, Handler):
+            handler = Handler(handler)
+        super().subscribe(detailed_event, handler)
+
+
+class OfflineConnection(i3ipc.Connection):
+    """ i3ipc connection without i3: messages are answered by the function,
+    events are emitted by emit_event(). """
+    def __init__(self, answer: Callable[[int, str], str]) -> None:
+        """ answer (Callable): returns the JSON reply for the i3 IPC
+            message type and payload. """
+        self.answer = answer
+        self.subscriptions = 0
+        self._pubsub = PubSub(self)
+        self._socket_path = ''
+        self._cmd_socket = None
+        self._cmd_lock = threading.Lock()
+        self._sub_socket = None
+        self._sub_lock = threading.Lock()
+        self._auto_reconnect = False
+        self._quitting = False
+        self._synchronizer = None
+
+    def _message(self, message_type, payload):
+        return self.answer(message_type.value, payload)
+
+    def emit_event(self, name: str, event) -> None:
+        """ Call handlers of the event.
+            name (str): event name like window or workspace.
+            event: i3ipc event object. """
+        self._pubsub.emit(name, event)
+
+
+class I3Events():
+    """ Event socket of the i3ipc connection. """
+    version = '2.2.1' # i3ipc version the internals are checked with
+    # Connection methods and attributes used here
+    conn_internals = (
+        '_event_socket_setup', '_event_socket_poll', '_event_socket_teardown',
+        '_message'
+    )
+    pubsub_internals = ('subscribe', 'unsubscribe', 'emit')
+
+    @classmethod
+    def supported(cls) -> Tuple[List[str], List[str]]:
+        """ Check the installed i3ipc.
+        Returns (errors, warnings): errors are missing internals, so the
+        daemon can not run, warning is the version other than the pinned
+        one. """
+        errors, warnings = [], []
+        for attr in cls.conn_internals:
+            if not callable(getattr(i3ipc.Connection, attr, None)):
+                errors.append(f'i3ipc.Connection.{attr} is missing')
+        for attr in cls.pubsub_internals:
+            if not callable(getattr(PubSub, attr, None)):
+                errors.append(f'i3ipc pubsub {attr} is missing')
+        version = getattr(i3ipc, '__version__', 'unknown')
+        if version != cls.version:
+            warnings.append(
+                f'i3ipc {version} is not checked, {cls.version} is'
+            )
+        return errors, warnings
+
+    @staticmethod
+    def attach(conn) -> int:
+        """ Connect the event socket and subscribe to events of handlers
+        added by conn.on() so far. Events are read by poll().
+        conn: i3ipc connection.
+        Returns the file descriptor to wait for events. """
+        conn._event_socket_setup()
+        return conn._sub_socket.fileno()
+
+    @staticmethod
+    def poll(conn) -> bool:
+        """ Read one event and call its handlers.
+        conn: i3ipc connection.
+        Returns True if i3 closed the connection. """
+        return bool(conn._event_socket_poll())
+
+    @staticmethod
+    def pending(conn, timeout: float = 0.0) -> bool:
+        """ Is there an event to poll().
+        conn: i3ipc connection.
+        timeout (float): seconds to wait for it. """
+        return bool(select.select([conn._sub_socket], [], [], timeout)[0])
+
+    @staticmethod
+    def detach(conn) -> None:
+        """ Close the event socket. """
+        conn._event_socket_teardown()
+
+    @staticmethod
+    def subscriptions(conn) -> List[Tuple[str, str, Callable]]:
+        """ Handlers of the connection: (event, detail, handler). """
+        ret = []
+        for sub in conn._pubsub._subscriptions:
+            handler = sub['handler']
+            if isinstance(handler, Handler):
+                handler = handler.handler
+            ret.append((sub['event'], sub['detail'], handler))
+        return ret
+
+    @staticmethod
+    def install(conn) -> None:
+        """ Call event handlers of the connection through hooks, handlers
+        subscribed before are kept.
+        conn: i3ipc connection. """
+        if isinstance(conn._pubsub, HookedPubSub):
+            return
+        pubsub = HookedPubSub(conn)
+        for event, detail, handler in I3Events.subscriptions(conn):
+            pubsub.subscribe(f'{event}::{detail}' if detail else event, handler)
+        conn._pubsub = pubsub
+
+    @staticmethod
+    def add_hook(conn, hook: Callable) -> None:
+        """ Wrap every event handler call of the connection.
+        conn: i3ipc connection.
+        hook (Callable): hook(handler, call), where call() runs the handler
+        and the inner hooks and returns its result. """
+        I3Events.install(conn)
+        conn._pubsub.hooks.append(hook)
+
+    @staticmethod
+    def add_listener(conn, listener: Callable) -> None:
+        """ Call listener(event name, event) for every event of the
+        connection before its handlers.
+        conn: i3ipc connection. """
+        I3Events.install(conn)
+        conn._pubsub.listeners.append(listener)
+
+    @staticmethod
+    def name(handler: Callable) -> str:
+        """ Handler name for reports, like circle.add_wins. """
+        return getattr(handler, '__qualname__', repr(handler))
@@ -0,0 +1,128 @@
+""" Latency histograms for negi3wm bindings and i3 event handlers.
+
+Every command dispatched by MsgBroker is timed from the moment it is queued
+until the binding is done, so for bindings this is keypress-to-done latency
+as negi3wm sees it. Every i3 event handler is timed by the Latency.timed hook
+of the i3 connection, see I3Events.
+
+Histograms have fixed 1-2-5 buckets from 10us to 10s, so recording is one
+bisect and memory does not grow with the number of samples. Percentiles are
+reported as the upper bound of the bucket, clamped by the observed maximum.
+"""
+
+import bisect
+import timeit
+import threading
+from typing import Callable, List
+
+from lib.i3events import I3Events
+
+
+class Histogram():
+    """ Fixed-bucket latency histogram. """
+    # bucket upper bounds in microseconds, the last bucket is unbounded
+    bounds = [
+        mult * 10 ** exp for exp in range(1, 7) for mult in (1, 2, 5)
+    ] + [10 ** 7]
+
+    def __init__(self) -> None:
+        self.buckets = [0] * (len(Histogram.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, usec: float) -> None:
+        """ Add one sample in microseconds. """
+        self.buckets[bisect.bisect_left(Histogram.bounds, usec)] += 1
+        self.count += 1
+        self.total += usec
+        self.max = max(self.max, usec)
+
+    def percentile(self, val: float) -> float:
+        """ Returns approximate percentile in microseconds.
+            val (float): percentile in [0, 1] range. """
+        rank = max(1, int(self.count * val + 0.5))
+        seen = 0
+        for pos, bucket in enumerate(self.buckets):
+            seen += bucket
+            if seen >= rank:
+                if pos < len(Histogram.bounds):
+                    return min(Histogram.bounds[pos], self.max)
+                return self.max
+        return 0.0
+
+    def summary(self) -> dict:
+        """ Returns count, average, p50, p99 and max in milliseconds. """
+        return {
+            'count': self.count,
+            'avg_ms': self.total / self.count / 1000 if self.count else 0.0,
+            'p50_ms': self.percentile(0.5) / 1000,
+            'p99_ms': self.percentile(0.99) / 1000,
+            'max_ms': self.max / 1000,
+        }
+
+
+class Latency():
+    """ Histograms per binding and per event handler. All state is
+    class-level. Samples come from module threads, so they are recorded
+    under the lock. """
+    lock = threading.Lock()
+    hists = {'binding': {}, 'event': {}} # kind -> key -> Histogram
+
+    @classmethod
+    def record(cls, kind: str, key: str, elapsed: float) -> None:
+        """ Add sample.
+            kind (str): binding or event.
+            key (str): like scratchpad.toggle or circle.add_wins.
+            elapsed (float): time in seconds. """
+        with cls.lock:
+            hists = cls.hists[kind]
+            if key not in hists:
+                hists[key] = Histogram()
+            hists[key].record(elapsed * 1e6)
+
+    @staticmethod
+    def timed(handler: Callable, call: Callable):
+        """ I3Events hook which times the i3 event handler. """
+        start = timeit.default_timer()
+        try:
+            return call()
+        finally:
+            Latency.record(
+                'event', I3Events.name(handler),
+                timeit.default_timer() - start
+            )
+
+    @classmethod
+    def stats(cls) -> dict:
+        """ Returns kind -> key -> summary. """
+        with cls.lock:
+            return {
+                kind: {key: hist.summary() for key, hist in hists.items()}
+                for kind, hists in cls.hists.items()
+            }
+
+    @classmethod
+    def reset(cls) -> None:
+        """ Drop all samples. """
+        with cls.lock:
+            cls.hists = {kind: {} for kind in cls.hists}
+
+    @staticmethod
+    def report(stats: dict) -> List[str]:
+        """ Table sorted by p99, the slowest first. """
+        ret = []
+        for kind, summaries in stats.items():
+            ret.append(
+                f'{kind:<36s}{"count":>8s}{"avg":>10s}{"p50":>10s}'
+                f'{"p99":>10s}{"max":>10s}'
+            )
+            for key, summary in sorted(
+                    summaries.items(), key=lambda item: -item[1]['p99_ms']):
+                ret.append(
+                    f'{key:<36s}{summary["count"]:>8d}'
+                    f'{summary["avg_ms"]:>10.3f}{summary["p50_ms"]:>10.3f}'
+                    f'{summary["p99_ms"]:>10.3f}{summary["max_ms"]:>10.3f}'
+                )
+        return ret
+
@@ -0,0 +1,45 @@
+""" Lazy negi3wm module.
+
+Modules which are used rarely (menus, terminal manager, config generator) can
+declare lazy = True. negi3wm puts LazyModule in place of them: the module
+itself is created on the first binding or the first attribute access, so
+daemon startup does not pay for the config parsing, pulse connection and so
+on. Lazy modules should not subscribe to i3 events, there is nobody to
+subscribe until the module is created.
+"""
+
+import threading
+from typing import Callable, List
+
+
+class LazyModule():
+    """ Stand-in for the lazy module with the same interface. """
+    def __init__(self, name: str, mod_class, factory: Callable) -> None:
+        """ name (str): module name.
+            mod_class: module class, used for class-level declarations.
+            factory (Callable): creates the module from the class. """
+        self.mod_name = name
+        self.mod_class = mod_class
+        self.factory = factory
+        self.instance = None
+        self.lock = threading.Lock()
+
+    @property
+    def built(self) -> bool:
+        """ Is the module created already. """
+        return self.instance is not None
+
+    def build(self):
+        """ Create the module if needed and return it. """
+        if self.instance is None:
+            with self.lock:
+                if self.instance is None:
+                    self.instance = self.factory(self.mod_class)
+        return self.instance
+
+    def send_msg(self, args: List):
+        return self.build().send_msg(args)
+
+    def __getattr__(self, attr):
+        # called only for attributes which are not defined here
+        return getattr(self.build(), attr)
@@ -4,7 +4,9 @@ run-or-raise, etc. """
 
 import sys
 import re
-from typing import List, Iterator
+import collections
+from typing import Callable, Dict, List, Set
+
 
 class Matcher():
     """ Generic matcher class
@@ -16,7 +18,12 @@ class Matcher():
         - by name regex
     Of course this list can by expanded. It uses sys.intern hack for better
     performance and simple caching. One of the most resource intensive part of
-    negi3wm. """
+    negi3wm, so rules of every tag are compiled once: exact factors become
+    frozensets, regex factors of the tag become one alternation regex, and
+    regex results are memoized per (tag, factor, value) in the bounded LRU.
+    To find all tags of the window there is the inverted index from exact
+    values to tags, so only tags with regexes are checked one by one. Rules,
+    index and cache are dropped on config reload and props changes. """
     factors = [
         sys.intern("class"),
         sys.intern("instance"),
@@ -27,95 +34,179 @@ class Matcher():
         sys.intern("role_r"),
         sys.intern('match_all')
     ]
+    # factor -> window attribute
+    exact_factors = {
+        sys.intern("class"): "window_class",
+        sys.intern("instance"): "window_instance",
+        sys.intern("role"): "window_role",
+    }
+    regex_factors = {
+        sys.intern("class_r"): "window_class",
+        sys.intern("instance_r"): "window_instance",
+        sys.intern("name_r"): "name",
+        sys.intern("role_r"): "window_role",
+    }
+    cache_size = 4096 # max number of memoized regex results
 
     def __init__(self):
-        self.matched_list = []
         self.win = None
+        self.matcher_reset()
+
+    def matcher_reset(self) -> None:
+        """ Drop compiled rules and memoized results, should be called after
+        any change of the config. Rules derived with the parsed config by
+        rule_sources are used only by the first reset after the config load,
+        later ones build them from self.cfg. """
+        self.match_rules = {} # tag -> [(factor, attr, test)]
+        self.match_cache = collections.OrderedDict()
+        self.tag_order = {} # tag -> position in config
+        self.exact_index = {} # window attribute -> value -> tags
+        self.scan_tags = [] # tags with regex or match_all factors
+        sources = (getattr(self, 'cfg_derived', None) or {}).pop('rules', {})
+        for tag, rules in sources.items():
+            self.match_rules[tag] = Matcher.compile_rules(rules)
+        for pos, tag in enumerate(getattr(self, 'cfg', None) or {}):
+            self.tag_order[tag] = pos
+            for factor, attr, test in self.tag_rules(tag):
+                if isinstance(test, frozenset):
+                    values = self.exact_index.setdefault(attr, {})
+                    for value in test:
+                        values.setdefault(value, []).append(tag)
+                elif tag not in self.scan_tags:
+                    self.scan_tags.append(tag)
 
-        self.match_dict = {
-            sys.intern("class"): lambda: self.win.window_class in self.matched_list,
-            sys.intern("instance"): lambda: self.win.window_instance in self.matched_list,
-            sys.intern("role"): lambda: self.win.window_role in self.matched_list,
-            sys.intern("class_r"): self.class_r,
-            sys.intern("instance_r"): self.instance_r,
-            sys.intern("role_r"): self.role_r,
-            sys.intern("name_r"): self.name_r,
-            sys.intern("match_all"): Matcher.match_all
+    def changed_rules(self, prev_conf: dict) -> Set[str]:
+        """ Tags which are added, removed or have other match rules in the
+        current config than in [prev_conf], so only their windows should be
+        matched again after reload. """
+        def rules(conf: dict, tag: str):
+            if tag not in conf:
+                return None
+            return {
+                factor: frozenset(Matcher.values(val))
+                if isinstance(val, (str, list, set, frozenset)) else val
+                for factor, val in conf[tag].items()
+                if factor in Matcher.factors
+            }
+        return {
+            tag for tag in set(prev_conf) | set(self.cfg)
+            if rules(prev_conf, tag) != rules(self.cfg, tag)
         }
 
     @staticmethod
-    def find_classed(win: List, pattern: str) -> Iterator:
-        """ Returns iterator to find by window class """
-        return (c for c in win
-                if c.window_class and re.search(pattern, c.window_class))
+    def values(val) -> List[str]:
+        """ Config value can be a string or collection of strings. """
+        if isinstance(val, str):
+            return [val]
+        return list(val)
 
     @staticmethod
-    def find_instanced(win: List, pattern: str) -> Iterator:
-        """ Returns iterator to find by window instance """
-        return (c for c in win
-                if c.window_instance and re.search(pattern, c.window_instance))
+    def compile(patterns: List[str]) -> Callable:
+        """ Returns search function for any of [patterns]. """
+        try:
+            return re.compile(
+                '|'.join(f'(?:{pattern})' for pattern in patterns)
+            ).search
+        except re.error:
+            # inline flags can not be combined, search one by one
+            regexes = [re.compile(pattern) for pattern in patterns]
+            return lambda value: any(r.search(value) for r in regexes)
 
     @staticmethod
-    def find_by_role(win: List, pattern: str) -> Iterator:
-        """ Returns iterator to find by window role """
-        return (c for c in win
-                if c.window_role and re.search(pattern, c.window_role))
+    def rule_sources(conf: dict) -> Dict:
+        """ Rules of all tags in factors order without compiled regexes, so
+        they can be cached with the parsed config: tag -> [(factor, attr,
+        frozenset of exact values | tuple of patterns | None)]. """
+        ret = {}
+        for tag, tag_conf in conf.items():
+            if not isinstance(tag_conf, dict):
+                continue
+            rules = []
+            for factor in Matcher.factors:
+                val = tag_conf.get(factor, {})
+                if not val:
+                    continue
+                if factor in Matcher.exact_factors:
+                    rules.append((
+                        factor, Matcher.exact_factors[factor],
+                        frozenset(Matcher.values(val))
+                    ))
+                elif factor in Matcher.regex_factors:
+                    rules.append((
+                        factor, Matcher.regex_factors[factor],
+                        tuple(Matcher.values(val))
+                    ))
+                else:
+                    rules.append((factor, None, None))
+            ret[tag] = rules
+        return ret
 
     @staticmethod
-    def find_named(win: List, pattern: str) -> Iterator:
-        """ Returns iterator to find by window name """
-        return (c for c in win if c.name and re.search(pattern, c.name))
+    def compile_rules(rules: List) -> List:
+        """ Compile regex patterns of the rule sources. """
+        return [
+            (factor, attr, Matcher.compile(list(test)))
+            if isinstance(test, tuple) else (factor, attr, test)
+            for factor, attr, test in rules
+        ]
 
-    def class_r(self) -> bool:
-        """ Check window by class with regex """
-        for pattern in self.matched_list:
-            cls_by_regex = Matcher.find_classed([self.win], pattern)
-            if cls_by_regex:
-                for class_regex in cls_by_regex:
-                    if self.win.window_class == class_regex.window_class:
-                        return True
-        return False
-
-    def instance_r(self) -> bool:
-        """ Check window by instance with regex """
-        for pattern in self.matched_list:
-            inst_by_regex = Matcher.find_instanced([self.win], pattern)
-            if inst_by_regex:
-                for inst_regex in inst_by_regex:
-                    if self.win.window_instance == inst_regex.window_instance:
-                        return True
-        return False
+    def tag_rules(self, tag: str) -> List:
+        """ Returns compiled rules of the [tag] in factors order. """
+        rules = self.match_rules.get(tag)
+        if rules is None:
+            rules = Matcher.compile_rules(Matcher.rule_sources(
+                {tag: self.cfg.get(tag, {})}
+            )[tag])
+            self.match_rules[tag] = rules
+        return rules
 
-    def role_r(self) -> bool:
-        """ Check window by role with regex """
-        for pattern in self.matched_list:
-            role_by_regex = Matcher.find_by_role([self.win], pattern)
-            if role_by_regex:
-                for role_regex in role_by_regex:
-                    if self.win.window_role == role_regex.window_role:
-                        return True
-        return False
+    def exact_values(self, tag: str, factor: str) -> frozenset:
+        """ Exact values of the tag factor, like classes of the tag. """
+        for rule_factor, _, test in self.tag_rules(tag):
+            if rule_factor == factor:
+                return test
+        return frozenset()
 
-    def name_r(self) -> bool:
-        """ Check window by name with regex """
-        for pattern in self.matched_list:
-            name_by_regex = Matcher.find_named([self.win], pattern)
-            if name_by_regex:
-                for name_regex in name_by_regex:
-                    if self.win.name == name_regex.name:
-                        return True
-        return False
+    def regex_match(self, tag: str, factor: str, value: str,
+                    search: Callable) -> bool:
+        """ Memoized regex check. """
+        key = (tag, factor, value)
+        ret = self.match_cache.get(key)
+        if ret is None:
+            ret = bool(search(value))
+            self.match_cache[key] = ret
+            if len(self.match_cache) > Matcher.cache_size:
+                self.match_cache.popitem(last=False)
+        else:
+            self.match_cache.move_to_end(key)
+        return ret
 
-    @staticmethod
-    def match_all() -> bool:
-        """ Match every possible window """
-        return True
+    def match_tags(self, win) -> List[str]:
+        """ Returns all tags matched by the window in config order, the
+        same as match() for every tag, but exact values are dict lookups. """
+        tags = set()
+        for attr, values in self.exact_index.items():
+            value = getattr(win, attr)
+            if value:
+                tags.update(values.get(value, ()))
+        for tag in self.scan_tags:
+            if tag not in tags and self.match(win, tag):
+                tags.add(tag)
+        self.win = win
+        return sorted(tags, key=self.tag_order.__getitem__)
 
     def match(self, win, tag: str) -> bool:
         """ Check that window matches to the config rules """
         self.win = win
-        for f in Matcher.factors:
-            self.matched_list = self.cfg.get(tag, {}).get(f, {})
-            if self.matched_list and self.match_dict[f]():
+        for factor, attr, test in self.tag_rules(tag):
+            if attr is None: # match_all
+                return True
+            value = getattr(win, attr)
+            if not value:
+                continue
+            if isinstance(test, frozenset):
+                if value in test:
+                    return True
+            elif self.regex_match(tag, factor, value, test):
                 return True
         return False
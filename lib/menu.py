@@ -16,6 +16,8 @@ from .extension import extension
 
 class menu(extension, cfg):
     """ Base class for menu module """
+    lazy = True
+
     def __init__(self, i3ipc) -> None:
         cfg.__init__(self, i3ipc)
         self.i3ipc = i3ipc
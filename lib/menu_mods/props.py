@@ -3,6 +3,8 @@ import re
 import socket
 from typing import List
 from extension import extension
+from lib.msgbroker import MsgBroker
+from lib.treemirror import TreeMirror
 
 
 class props():
@@ -50,7 +52,7 @@ class props():
         lst = props.mod_data_list(mod)
         tag_name = self.tag_name(mod, lst)
         if tag_name is not None and tag_name:
-            extension.get_mods()[mod].add_prop(tag_name, aprop_str)
+            MsgBroker.post(mod, ['add_prop', tag_name, aprop_str])
         else:
             print(f'No tag name specified for props [{aprop_str}]')
 
@@ -87,7 +89,7 @@ class props():
             with_role (bool): add WM_WINDOW_ROLE attribute to the list,
             optional. """
         xprops = []
-        win = self.menu.i3ipc.get_tree().find_focused()
+        win = TreeMirror.find_focused()
         xprop = subprocess.run(
             ['xprop', '-id', str(win.window)] + self.menu.xprops_list,
             stdout=subprocess.PIPE,
@@ -2,6 +2,7 @@ import subprocess
 from functools import partial
 from typing import Callable
 from extension import extension
+from lib.treemirror import TreeMirror
 
 
 class winact():
@@ -14,7 +15,7 @@ class winact():
                 cmd (str): action for window to run.
                 prompt (str): custom prompt for menu.
         """
-        leaves = self.menu.i3ipc.get_tree().leaves()
+        leaves = TreeMirror.leaves()
         winlist = [win.name for win in leaves]
         winlist_len = len(winlist)
         menu_params = {
@@ -1,5 +1,6 @@
 import subprocess
 from misc import Misc
+from lib.treemirror import TreeMirror
 
 
 class xprop():
@@ -10,7 +11,7 @@ class xprop():
     def xprop(self) -> None:
         """ Menu to show X11 atom attributes for current window. """
         xprops = []
-        target_win = self.menu.i3ipc.get_tree().find_focused()
+        target_win = TreeMirror.find_focused()
         try:
             xprop_ret = subprocess.run(
                 ['xprop', '-id', str(target_win.window)] +
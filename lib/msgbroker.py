@@ -3,32 +3,376 @@ Daemon manager and mod daemon: Mod daemon creates appropriate files in the
 /dev/shm directory. Daemon manager handles all requests to this named pipe
 based API with help of asyncio. """
 
+import os
+import sys
 import asyncio
+import contextlib
+import socket
+import stat
+import concurrent.futures
+import json
+import timeit
+import traceback
+from typing import List
+
+from lib.cmdbatch import CmdBatch
+from lib.latency import Latency
+
 
 class MsgBroker():
-    """ This is asyncio message broker for negi3wm. Every module has indivisual
-    main loop with indivisual neg-ipc-file. """
-    lock = asyncio.Lock()
+    """ This is asyncio message broker for negi3wm. Every module has its own
+    command queue with dedicated worker, so commands to one module are ordered
+    while commands to different modules do not wait for each other.
+
+    Protocol is line-based: `<mod> <binding> [args...]`. If the line starts
+    with `@<id>` then client waits for the one-line JSON reply with this id,
+    ok/error status, error message and execution time in microseconds.
+
+    Several commands separated by `;` in one line are the batch: they run one
+    after another in the given order and share the single reply with the
+    status of every command in `results`.
+
+    Commands can also come from i3 itself, without any process spawn: parts of
+    the binding command or tick payload in the `nop negi3wm <mod> <args>` form
+    are posted to the module queues by dispatch_i3_cmd. The command is split
+    by top-level separators only, like i3 does, so the quoted
+    `nop "negi3wm <mod> <args>"` form can have `,` and `;` in arguments.
+
+    The loop only reads and dispatches. Every module has its own thread:
+    all its bindings, long ones like rofi menus too, run there, and
+    run_handler hook sends i3 event handlers of the module to the same
+    thread. So the module state is changed by one thread in the order of its
+    events and commands, while the slow binding of one module delays neither
+    other modules nor i3 events. Handlers which are not module methods, like
+    TreeMirror ones, run in the loop at once. """
+    loop = None
+    nop_prefix = 'nop negi3wm '
+    queues = {} # module name -> command queue
+    workers = {} # module name -> worker task
+    executors = {} # module name -> thread of the module
+    qstats = {} # module name -> queue statistics
+    recorder = None # called with every client command when recording
+    path = None # unix socket path, removed on exit
 
     @classmethod
     def get_mods(cls) -> None:
         return cls.mods
 
     @classmethod
-    def mainloop(cls, loop, mods, port) -> None:
-        """ Mainloop by loop create task """
+    def start(cls, loop, mods, port, use_tcp=False, path=None) -> None:
+        """ Setup broker on the loop, the loop itself is run by caller.
+        loop: asyncio loop shared with i3 events.
+        mods (dict): module name -> module object.
+        port (int): localhost TCP port.
+        use_tcp (bool): serve TCP as well as unix socket.
+        path (str): unix socket path, socket_path() by default. """
+        cls.loop = loop
         cls.mods = mods
-        loop.create_task(asyncio.start_server(
-            cls.handle_client, 'localhost', port))
+        loop.create_task(cls.serve(port, use_tcp, path))
+
+    @classmethod
+    def mainloop(cls, loop, mods, port, use_tcp=False, path=None) -> None:
+        """ Mainloop by loop create task """
+        cls.start(loop, mods, port, use_tcp, path)
         loop.run_forever()
 
+    @staticmethod
+    def socket_path() -> str:
+        """ Unix socket path used by daemon and send client. Private
+        /tmp/negi3wm-$UID directory is used when there is no
+        $XDG_RUNTIME_DIR. """
+        runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+        if not runtime_dir:
+            runtime_dir = f'/tmp/negi3wm-{os.getuid()}'
+        return f'{runtime_dir}/negi3wm.sock'
+
+    @classmethod
+    async def serve(cls, port, use_tcp=False, path=None) -> None:
+        """ Start unix socket server and optional TCP fallback.
+        port (int): localhost TCP port.
+        use_tcp (bool): serve TCP as well as unix socket.
+        path (str): unix socket path, socket_path() by default. """
+        if path is None:
+            path = cls.socket_path()
+        cls.private_dir(os.path.dirname(path))
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(path)
+        await asyncio.start_unix_server(
+            cls.handle_client, sock=cls.bind_unix(path)
+        )
+        cls.path = path
+        if use_tcp:
+            await asyncio.start_server(cls.handle_client, 'localhost', port)
+
+    @staticmethod
+    def private_dir(dirname: str) -> None:
+        """ Create the socket directory with 0700 mode if there is no one.
+        The existing directory should be owned by the user and closed for
+        others, otherwise somebody else could own or replace the socket.
+        dirname (str): directory of the unix socket. """
+        with contextlib.suppress(FileExistsError):
+            os.mkdir(dirname, 0o700)
+        st = os.lstat(dirname)
+        if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() \
+                or st.st_mode & 0o077:
+            raise PermissionError(
+                f'{dirname} should be the directory of the user with 0700 mode'
+            )
+
+    @classmethod
+    def close(cls) -> None:
+        """ Remove the unix socket on daemon exit. """
+        if cls.path is not None:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(cls.path)
+            cls.path = None
+
+    @staticmethod
+    def bind_unix(path: str) -> socket.socket:
+        """ Bind the unix socket, which is created with 0600 mode: umask is
+        restricted around the bind, so the socket is never accessible by other
+        users, even for a moment.
+        path (str): unix socket path. """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o177)
+        try:
+            sock.bind(path)
+        except OSError:
+            sock.close()
+            raise
+        finally:
+            os.umask(umask)
+        return sock
+
+    @classmethod
+    def queue(cls, name: str) -> asyncio.Queue:
+        """ Returns command queue for the module, worker for it is started on
+        the first use.
+        name (str): module name. """
+        if name not in cls.queues:
+            cls.queues[name] = asyncio.Queue()
+            cls.qstats[name] = {
+                'done': 0, 'wait': 0.0, 'max_wait': 0.0
+            }
+            cls.workers[name] = asyncio.ensure_future(cls.worker(name))
+        return cls.queues[name]
+
+    @classmethod
+    def executor(cls, name: str) -> concurrent.futures.ThreadPoolExecutor:
+        """ Returns the thread of the module, it is started on the first use.
+        name (str): module name. """
+        if name not in cls.executors:
+            cls.executors[name] = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix=f'negi3wm-{name}'
+            )
+        return cls.executors[name]
+
     @classmethod
-    async def handle_client(cls, reader, _) -> None:
+    async def worker(cls, name: str) -> None:
+        """ Run commands for the module one by one.
+        name (str): module name. """
+        queue, stats = cls.queues[name], cls.qstats[name]
+        while True:
+            args, enqueued, reply = await queue.get()
+            wait = timeit.default_timer() - enqueued
+            stats['done'] += 1
+            stats['wait'] += wait
+            stats['max_wait'] = max(stats['max_wait'], wait)
+            status = await asyncio.get_event_loop().run_in_executor(
+                cls.executor(name), cls.run, name, args
+            )
+            if status['status'] == 'ok':
+                # time from the queueing to the done
+                Latency.record(
+                    'binding', f'{name}.{args[0]}',
+                    timeit.default_timer() - enqueued
+                )
+            if reply is not None and not reply.done():
+                reply.set_result(status)
+            queue.task_done()
+
+    @classmethod
+    def run(cls, name: str, args) -> dict:
+        """ Run module binding and return its status.
+        name (str): module name.
+        args: binding name and arguments. """
+        start = timeit.default_timer()
+        status = {'status': 'ok', 'error': ''}
+        try:
+            result = cls.mods[name].send_msg(args)
+            if result is not None:
+                status['result'] = result
+        except Exception as err:
+            print(f'[{name}] failed to run {args}')
+            traceback.print_exc(file=sys.stdout)
+            status['status'] = 'error'
+            status['error'] = f'{type(err).__name__}: {err}'
+        status['usec'] = int((timeit.default_timer() - start) * 1e6)
+        return status
+
+    @classmethod
+    def run_handler(cls, handler, call) -> None:
+        """ I3Events hook: run the i3 event handler of the module in the
+        module thread, after the commands and events which came before.
+        Other handlers are called at once. """
+        name = type(getattr(handler, '__self__', None)).__name__
+        if name not in cls.mods:
+            call()
+            return
+        cls.executor(name).submit(cls.run_event, name, handler, call)
+
+    @staticmethod
+    def run_event(name: str, handler, call) -> None:
+        """ Call the i3 event handler of the module, errors are printed. """
+        try:
+            call()
+        except Exception:
+            print(f'[{name}] failed to handle event by {handler}')
+            traceback.print_exc(file=sys.stdout)
+
+    @staticmethod
+    def error(msg: str) -> dict:
+        """ Returns error status for the command which was not run. """
+        return {'status': 'error', 'error': msg, 'usec': 0}
+
+    @classmethod
+    def queue_stats(cls) -> dict:
+        """ Returns queue depth and wait time in milliseconds per module. """
+        ret = {}
+        for name, stats in cls.qstats.items():
+            done = stats['done']
+            ret[name] = {
+                'depth': cls.queues[name].qsize(),
+                'done': done,
+                'avg_wait_ms': stats['wait'] * 1000 / done if done else 0.0,
+                'max_wait_ms': stats['max_wait'] * 1000,
+            }
+        return ret
+
+    @classmethod
+    async def handle_client(cls, reader, writer) -> None:
         """ Proceed client message here """
-        async with cls.lock:
+        try:
             while True:
-                response = (await reader.readline()).decode('utf8').split()
-                if not response:
+                line = (await reader.readline()).decode('utf8').strip()
+                if not line:
                     return
-                name = response[0]
-                cls.mods[name].send_msg(response[1:])
+                req_id = None
+                if line.startswith('@'):
+                    req_id, _, line = line.partition(' ')
+                    req_id = req_id[1:]
+                if ';' in line:
+                    status = await cls.dispatch_batch(line.split(';'))
+                else:
+                    status = await cls.dispatch(
+                        line.split(), req_id is not None
+                    )
+                if req_id is not None:
+                    reply = json.dumps({'id': req_id, **status}, default=str)
+                    writer.write((reply + '\n').encode('utf8'))
+                    await writer.drain()
+        finally:
+            writer.close()
+
+    @classmethod
+    async def dispatch(cls, response, wait: bool) -> dict:
+        """ Put command to the module queue.
+        response: module name, binding name and arguments.
+        wait (bool): wait for the binding to finish and return its status. """
+        if not response:
+            return cls.error('Empty command')
+        if cls.recorder is not None:
+            cls.recorder(response)
+        reply = None
+        if wait:
+            reply = asyncio.get_event_loop().create_future()
+        if not cls.enqueue(response, reply):
+            return cls.error(f'No such module [{response[0]}]')
+        if reply is None:
+            return {'status': 'queued', 'error': '', 'usec': 0}
+        return await reply
+
+    @classmethod
+    def enqueue(cls, response, reply=None) -> bool:
+        """ Put command to the module queue, should be called from the loop.
+        response: module name, binding name and arguments.
+        reply: optional future for the command status.
+        Returns False if there is no such module. """
+        name = response[0]
+        if name not in cls.mods:
+            print(f'No such module [{name}]')
+            return False
+        cls.queue(name).put_nowait(
+            (response[1:], timeit.default_timer(), reply)
+        )
+        return True
+
+    @classmethod
+    def post(cls, name: str, args) -> None:
+        """ Fire-and-forget command to the module queue. Thread-safe, so
+        modules should use it to call another module bindings: the call is
+        ordered with the rest of the module commands and runs in the module
+        thread instead of blocking the caller.
+        name (str): module name.
+        args: binding name and arguments. """
+        cls.loop.call_soon_threadsafe(cls.enqueue, [name, *args])
+
+    @classmethod
+    def i3_cmds(cls, i3_cmd: str, prefix: str = '') -> List[List[str]]:
+        """ negi3wm commands of the i3 command string.
+        i3_cmd (str): i3 command, like the `binding.command` of the event.
+        prefix (str): command prefix, `nop negi3wm ` by default.
+        Returns [module name, binding name, arguments...] lists. """
+        prefix = prefix or cls.nop_prefix
+        ret = []
+        for cmd in CmdBatch.split_cmds(i3_cmd):
+            cmd = cmd.strip()
+            if cmd.startswith('nop "') and cmd.endswith('"'):
+                # quoted nop comment, it can contain separators
+                cmd = 'nop ' + cmd[5:-1].replace('\\"', '"')
+            response = cmd[len(prefix):].split()
+            if cmd.startswith(prefix) and response:
+                ret.append(response)
+        return ret
+
+    @classmethod
+    def dispatch_i3_cmd(cls, i3_cmd: str, prefix: str = '') -> None:
+        """ Post negi3wm commands from the i3 command string to the module
+        queues. Thread-safe, so can be called from i3ipc event handlers.
+        i3_cmd (str): i3 command, like the `binding.command` of the event.
+        prefix (str): command prefix, `nop negi3wm ` by default. """
+        for response in cls.i3_cmds(i3_cmd, prefix):
+            cls.post(response[0], response[1:])
+
+    @classmethod
+    def on_binding(cls, _, event) -> None:
+        """ Dispatch negi3wm commands of the triggered i3 binding.
+            _: i3ipc connection.
+            event: i3ipc binding event. """
+        cls.dispatch_i3_cmd(event.binding.command)
+
+    @classmethod
+    def on_tick(cls, _, event) -> None:
+        """ Dispatch `negi3wm <mod> <args>` tick payloads, so scripts can
+            use `i3-msg -t send_tick` as well as send.
+            _: i3ipc connection.
+            event: i3ipc tick event. """
+        if not event.first:
+            cls.dispatch_i3_cmd(event.payload, prefix='negi3wm ')
+
+    @classmethod
+    async def dispatch_batch(cls, commands) -> dict:
+        """ Run commands one by one: the next command is queued only when
+        the previous one is done, so the order is kept across modules too.
+        commands: list of command strings. """
+        results = []
+        for command in commands:
+            if command.split():
+                results.append(await cls.dispatch(command.split(), True))
+        errors = [ret['error'] for ret in results if ret['status'] != 'ok']
+        return {
+            'status': 'error' if errors else 'ok',
+            'error': errors[0] if errors else '',
+            'usec': sum(ret['usec'] for ret in results),
+            'results': results,
+        }
@@ -1,62 +1,223 @@
 """ In this module we have EWMH routines to detect dialog windows, visible windows,
-etc using python-xlib and python-ewmh. """
-from typing import List
-from contextlib import contextmanager
+etc using python-xlib.
+
+_NET_WM_STATE and _NET_WM_WINDOW_TYPE of client windows are cached. When the
+daemon calls NegEWMH.watch(loop), PropertyChange and StructureNotify events
+are selected on every cached window through the dedicated X connection, and
+its socket is read by the asyncio loop, so PropertyNotify drops the changed
+property and DestroyNotify drops the window. Without the watcher nothing is
+cached. There is no fallback without X: X is connected on the first use and
+fails loudly, the fake i3 harness stubs properties by FakeX.
+
+Properties of many windows are fetched in the pipelined way: python-xlib
+requests are created deferred, so all of them are sent before the first
+reply is read, and the batch costs about one round trip instead of one per
+window. find_dialog_windows and find_visible_windows check the whole window
+list this way, with the watcher or without it. Atoms are interned once per
+display. """
+import threading
+from typing import Dict, List
 
 import Xlib
+import Xlib.X
+import Xlib.Xatom
 import Xlib.display
-from ewmh import EWMH
+import Xlib.error
+import Xlib.protocol.request
 
 
 class NegEWMH():
     """ Custom EWMH support functions """
-    disp = Xlib.display.Display()
-    ewmh = EWMH()
+    disp = None # X connection, see display()
+    watch_disp = None # X connection for the property events
+    cache = {} # X window id -> property name -> atom names
+    atom_names = {} # atom -> atom name
+    props = {} # atom -> property name
+    prop_length = 32 # property length in 32-bit units to read at once
+    # X events are read by the loop and properties are read by module
+    # threads, both through the same connection and cache
+    lock = threading.RLock()
 
-    @staticmethod
-    @contextmanager
-    def window_obj(disp, win_id):
-        """ Simplify dealing with BadWindow (make it either valid or None) """
-        window_obj = None
-        if win_id:
+    @classmethod
+    def display(cls):
+        """ X connection, it is opened on the first use. """
+        if cls.disp is None:
+            cls.disp = Xlib.display.Display()
+        return cls.disp
+
+    @classmethod
+    def watch(cls, loop) -> None:
+        """ Start to cache window properties and keep them in sync by X
+        events read from the loop.
+        loop: asyncio loop of the daemon. """
+        if cls.watch_disp is not None:
+            return
+        cls.display()
+        cls.watch_disp = Xlib.display.Display()
+        for prop in ('_NET_WM_STATE', '_NET_WM_WINDOW_TYPE'):
+            cls.props[cls.watch_disp.get_atom(prop)] = prop
+        cls.cache = {}
+        loop.add_reader(cls.watch_disp.fileno(), cls.process_events)
+
+    @classmethod
+    def process_events(cls) -> None:
+        """ Invalidate cache by queued X events. Events can be read from
+        the socket while waiting for the property reply, so it is called
+        before every cache lookup too. """
+        disp = cls.watch_disp
+        with cls.lock:
+            while disp.pending_events():
+                event = disp.next_event()
+                if event.type == Xlib.X.PropertyNotify:
+                    props = cls.cache.get(event.window.id)
+                    if props is not None and event.atom in cls.props:
+                        props.pop(cls.props[event.atom], None)
+                elif event.type == Xlib.X.DestroyNotify:
+                    cls.cache.pop(event.window.id, None)
+
+    @classmethod
+    def atom_names_of(cls, disp, atoms) -> None:
+        """ Resolve atoms which are not in the atom names cache yet, all
+        requests are sent before reading the replies. Atom names never change,
+        so they are cached forever. """
+        requests = {
+            atom: Xlib.protocol.request.GetAtomName(
+                display=disp.display, defer=True, atom=atom
+            ) for atom in set(atoms) if atom not in cls.atom_names
+        }
+        for atom, req in requests.items():
+            req.reply()
+            cls.atom_names[atom] = req.name
+
+    @classmethod
+    def fetch_props(cls, disp, xids: List[int], prop: str) -> Dict:
+        """ Read the atom list property of many windows for about one round
+        trip: GetProperty requests for all windows are sent before reading any
+        reply. Windows which are gone already are skipped.
+        disp: X display to use.
+        xids: X window ids.
+        prop (str): property name.
+        Returns X window id -> atom names. """
+        atom = disp.get_atom(prop)
+        requests = {
+            xid: Xlib.protocol.request.GetProperty(
+                display=disp.display, defer=True, delete=False, window=xid,
+                property=atom, type=Xlib.Xatom.ATOM,
+                long_offset=0, long_length=cls.prop_length
+            ) for xid in xids if xid
+        }
+        values = {}
+        for xid, req in requests.items():
             try:
-                window_obj = disp.create_resource_object('window', win_id)
+                req.reply()
+                if not req.property_type:
+                    values[xid] = []
+                elif req.bytes_after:
+                    # too long for one request, should be very rare
+                    reply = disp.create_resource_object(
+                        'window', xid
+                    ).get_full_property(atom, Xlib.Xatom.ATOM)
+                    values[xid] = list(reply.value) if reply else []
+                else:
+                    values[xid] = list(req.value[1])
             except Xlib.error.XError:
+                # window is gone already
                 pass
-        yield window_obj
+        cls.atom_names_of(
+            disp, [val for value in values.values() for val in value]
+        )
+        return {
+            xid: [cls.atom_names[val] for val in value]
+            for xid, value in values.items()
+        }
+
+    @classmethod
+    def get_props(cls, xids: List[int], prop: str) -> Dict:
+        """ Returns X window id -> atom names of the _NET_WM_STATE or
+        _NET_WM_WINDOW_TYPE window property, cached ones are not fetched.
+        xids: X window ids.
+        prop (str): property name. """
+        with cls.lock:
+            return cls.cached_props(xids, prop)
+
+    @classmethod
+    def cached_props(cls, xids: List[int], prop: str) -> Dict:
+        """ get_props under the lock. """
+        if cls.watch_disp is None:
+            return cls.fetch_props(cls.display(), xids, prop)
+        cls.process_events()
+        missing = [
+            xid for xid in xids if xid and prop not in cls.cache.get(xid, {})
+        ]
+        if missing:
+            disp = cls.watch_disp
+            for xid in missing:
+                if xid not in cls.cache:
+                    # select events before the read, so no change can be
+                    # lost, it has no reply, so it is pipelined too
+                    disp.create_resource_object('window', xid) \
+                        .change_attributes(
+                            onerror=Xlib.error.CatchError(),
+                            event_mask=Xlib.X.PropertyChangeMask |
+                            Xlib.X.StructureNotifyMask
+                        )
+            for xid, value in cls.fetch_props(disp, missing, prop).items():
+                cls.cache.setdefault(xid, {})[prop] = value
+        return {
+            xid: cls.cache[xid][prop] for xid in xids
+            if prop in cls.cache.get(xid, {})
+        }
+
+    @classmethod
+    def get_prop(cls, xid: int, prop: str) -> List[str]:
+        """ Atom names of the window property, see get_props. """
+        return cls.get_props([xid], prop).get(xid, [])
 
     @staticmethod
     def is_dialog_win(win) -> bool:
-        """ Check that window [win] is not dialog window
-        At first check typical window roles and classes, because of it more
-        fast, then using python EWMH module to detect dialog window type or
-        modal state of window.
+        """ Check that window [win] is not dialog window, see
+        find_dialog_windows.
         win : target window to check """
-        if win.window_instance == "Places" \
-                or win.window_role in {
-                        "GtkFileChooserDialog",
-                        "confirmEx",
-                        "gimp-file-open"} \
-                or win.window_class == "Dialog":
-            return True
-        with NegEWMH.window_obj(NegEWMH.disp, win.window) as win_obj:
-            win_type = NegEWMH.ewmh.getWmWindowType(win_obj, str=True)
-            if '_NET_WM_WINDOW_TYPE_DIALOG' in win_type:
-                return True
-            win_state = NegEWMH.ewmh.getWmState(win_obj, str=True)
-            if '_NET_WM_STATE_MODAL' in win_state:
-                return True
-            return False
+        return bool(NegEWMH.find_dialog_windows([win]))
+
+    @staticmethod
+    def find_dialog_windows(windows: List) -> List:
+        """ Find dialog windows. At first check typical window roles and
+        classes, because of it more fast, then check EWMH window type and
+        modal state of the rest, they are fetched for all windows at once and
+        cached with the watcher.
+        windows: windows list which going to be filtered with this
+        function. """
+        dialogs = {
+            win.id for win in windows
+            if win.window_instance == "Places"
+            or win.window_role in {
+                "GtkFileChooserDialog",
+                "confirmEx",
+                "gimp-file-open"}
+            or win.window_class == "Dialog"
+        }
+        for prop, atom in (
+                ('_NET_WM_WINDOW_TYPE', '_NET_WM_WINDOW_TYPE_DIALOG'),
+                ('_NET_WM_STATE', '_NET_WM_STATE_MODAL')):
+            values = NegEWMH.get_props([
+                win.window for win in windows if win.id not in dialogs
+            ], prop)
+            dialogs.update(
+                win.id for win in windows
+                if atom in values.get(win.window, [])
+            )
+        return [win for win in windows if win.id in dialogs]
 
     @staticmethod
     def find_visible_windows(windows_on_ws: List) -> List:
         """ Find windows visible on the screen now.
         windows_on_ws: windows list which going to be filtered with this
         function. """
-        visible_windows = []
-        for win in windows_on_ws:
-            with NegEWMH.window_obj(NegEWMH.disp, win.window) as win_obj:
-                win_state = NegEWMH.ewmh.getWmState(win_obj, str=True)
-                if '_NET_WM_STATE_HIDDEN' not in win_state:
-                    visible_windows.append(win)
-        return visible_windows
+        states = NegEWMH.get_props(
+            [win.window for win in windows_on_ws], '_NET_WM_STATE'
+        )
+        return [
+            win for win in windows_on_ws
+            if '_NET_WM_STATE_HIDDEN' not in states.get(win.window, [])
+        ]
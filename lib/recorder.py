@@ -0,0 +1,82 @@
+""" Session recorder for negi3wm.
+
+With `negi3wm.py --record <file>` the daemon writes the i3 tree snapshot at
+start, every i3 event payload and every IPC command to the JSON lines file,
+gzipped if the file name ends with .gz. Every record has the time in seconds
+since the start of recording:
+
+    {"t": 0.0, "kind": "start", "tree": {...}, "outputs": [...], ...}
+    {"t": 1.25, "kind": "event", "name": "window", "data": {...}}
+    {"t": 1.31, "kind": "cmd", "args": ["scratchpad", "toggle", "im"]}
+
+bin/replay.py feeds it back into modules against FakeI3. Commands posted by
+modules themselves and `nop negi3wm` bindings are not recorded: replayed
+modules and binding events produce them again.
+"""
+
+import gzip
+import json
+import timeit
+from typing import List
+
+from lib.i3events import I3Events
+from lib.msgbroker import MsgBroker
+
+
+class Recorder():
+    """ Writes the session records. All state is class-level. """
+    fp = None
+    start = 0.0
+
+    @classmethod
+    def install(cls, i3, path: str) -> None:
+        """ Start recording.
+            i3: i3ipc connection, its events are recorded.
+            path (str): file to write. """
+        opener = gzip.open if path.endswith('.gz') else open
+        cls.fp = opener(path, 'wt')
+        cls.start = timeit.default_timer()
+        cls.write(
+            'start',
+            tree=i3.get_tree().ipc_data,
+            outputs=[output.ipc_data for output in i3.get_outputs()],
+            version=i3.get_version().ipc_data,
+        )
+        I3Events.add_listener(i3, cls.record_event)
+        MsgBroker.recorder = cls.record_cmd
+
+    @classmethod
+    def record_event(cls, name: str, event) -> None:
+        """ Record the i3 event payload. """
+        if event is not None:
+            cls.write('event', name=name, data=event.ipc_data)
+
+    @classmethod
+    def record_cmd(cls, args: List[str]) -> None:
+        """ Record the IPC command: module name, binding and arguments. """
+        cls.write('cmd', args=args)
+
+    @classmethod
+    def write(cls, kind: str, **record) -> None:
+        """ Write one record if recording. """
+        if cls.fp is not None:
+            record = {
+                't': round(timeit.default_timer() - cls.start, 6),
+                'kind': kind, **record
+            }
+            cls.fp.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+    @classmethod
+    def close(cls) -> None:
+        """ Stop recording and flush the file. """
+        if cls.fp is not None:
+            cls.fp.close()
+            cls.fp = None
+            MsgBroker.recorder = None
+
+    @staticmethod
+    def load(path: str) -> List[dict]:
+        """ Read all records of the file. """
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt') as fp:
+            return [json.loads(line) for line in fp if line.strip()]
@@ -11,6 +11,7 @@ from itertools import cycle
 from cfg import cfg
 from negewmh import NegEWMH
 from extension import extension
+from lib.treemirror import TreeMirror
 
 class remember_focused(extension, cfg):
     """ Advanced alt-tab class. """
@@ -31,8 +32,10 @@ class remember_focused(extension, cfg):
             "focus_next_visible": self.focus_next_visible,
             "focus_prev_visible": self.focus_prev_visible,
         }
-        self.i3ipc.on('window::focus', self.on_window_focus)
-        self.i3ipc.on('window::close', self.goto_nonempty_ws_on_close)
+        self.subscribe(self.i3ipc, 'window::focus', self.on_window_focus)
+        self.subscribe(
+            self.i3ipc, 'window::close', self.goto_nonempty_ws_on_close
+        )
 
     def reload_config(self) -> None:
         """ Reloads config. Dummy. """
@@ -40,9 +43,8 @@ class remember_focused(extension, cfg):
 
     def alt_tab(self) -> None:
         """ Focus previous window. """
-        wids = set(w.id for w in self.i3ipc.get_tree().leaves())
         for wid in self.focus_history[1:]:
-            if wid not in wids:
+            if TreeMirror.find_by_id(wid) is None:
                 self.focus_history.remove(wid)
             else:
                 self.i3ipc.command(f'[con_id={wid}] focus')
@@ -62,10 +64,7 @@ class remember_focused(extension, cfg):
 
     def get_windows_on_ws(self) -> Iterator:
         """ Return iterator for windows on the current workspace. """
-        return filter(
-            lambda x: x.window,
-            self.i3ipc.get_tree().find_focused().workspace().leaves()
-        )
+        return filter(lambda x: x.window, TreeMirror.workspace_leaves())
 
     def goto_visible(self, reversed_order=False):
         """ Focus next visible window.
@@ -80,7 +79,7 @@ class remember_focused(extension, cfg):
         else:
             cycle_windows = cycle(wins)
         for window in cycle_windows:
-            if window.focused:
+            if window.id == TreeMirror.focused_id:
                 focus_to = next(cycle_windows)
                 self.i3ipc.command('[id="%d"] focus' % focus_to.window)
                 break
@@ -88,7 +87,7 @@ class remember_focused(extension, cfg):
     def goto_any(self, reversed_order: bool = False) -> None:
         """ Focus any next window.
             reversed_order(bool) : [optional] predicate to change order. """
-        wins = self.i3ipc.get_tree().leaves()
+        wins = TreeMirror.leaves()
         self.goto_win(wins, reversed_order)
 
     def focus_next(self) -> None:
@@ -107,18 +106,15 @@ class remember_focused(extension, cfg):
         """ Focus previous visible window """
         self.goto_visible(reversed_order=True)
 
-    def goto_nonempty_ws_on_close(self, i3ipc, _) -> None:
+    def goto_nonempty_ws_on_close(self, *_) -> None:
         """ Go back for temporary tags like pictures or media. This function
         make auto alt-tab for workspaces which should by temporary. This is
         good if you do not want to see empty workspace after switching to the
         media content workspace.
 
-        i3ipc: i3ipc connection.
-        event: i3ipc event. We can extract window from it using
-        event.container. """
-        workspace = i3ipc.get_tree().find_focused().workspace()
-        focused_ws_name = workspace.name
-        if not workspace.leaves():
+        _: i3ipc connection and event. """
+        focused_ws_name = TreeMirror.focused_workspace()
+        if not TreeMirror.workspace_leaves(focused_ws_name):
             for ws_substr in self.autoback:
                 if focused_ws_name.endswith(ws_substr):
                     self.alt_tab()
@@ -13,14 +13,19 @@ your scratchpad from fullscreen and also restore fullsreen state of the
 window when needed.
 """
 
+import re
+import copy
 import uuid
-from typing import List, Callable, Set
+from typing import List, Callable, Optional, Set
 from . import geom
 from . cfg import cfg
 from . matcher import Matcher
 from . misc import Misc
 from . negewmh import NegEWMH
 from . extension import extension
+from lib.cmdbatch import CmdBatch
+from lib.msgbroker import MsgBroker
+from lib.treemirror import TreeMirror
 
 class scratchpad(extension, cfg, Matcher):
     """ Named scratchpad class
@@ -36,14 +41,16 @@ class scratchpad(extension, cfg, Matcher):
         super().__init__()
         cfg.__init__(self, i3)
         Matcher.__init__(self)
-        self.win = None # reducing  calling i3.get_tree() too many times.
+        self.win = None # last window from the event handlers.
         self.fullscreen_list = [] # performing fullscreen hacks
         # nsgeom used to respect current screen resolution in the geometry
         # settings and scale it
-        self.nsgeom = geom.geom(self.cfg)
-        # marked used to get the list of current tagged windows
-        # with the given tag
-        self.marked = {l: [] for l in self.cfg}
+        self.nsgeom = geom.geom(self.cfg, self.cfg_derived.pop('geom', None))
+        # marked used to get the current tagged windows with the given tag:
+        # tag -> con_id -> window, in the rotation order
+        self.marked = {l: {} for l in self.cfg}
+        # reverse index of marked: con_id -> tags of the window
+        self.marked_tags = {}
         self.mark_all_tags(hide=True) # Mark all tags from the start
         self.auto_save_geom(False) # Do not autosave geometry by default
         # focus_win_flag is a helper to perform attach/detach window to the
@@ -66,8 +73,16 @@ class scratchpad(extension, cfg, Matcher):
             "reload": self.reload_config,
             "dialog": self.dialog_toggle,
         }
-        i3.on('window::new', self.mark_tag)
-        i3.on('window::close', self.unmark_tag)
+        self.subscribe(i3, 'window::new', self.mark_tag)
+        self.subscribe(i3, 'window::close', self.unmark_tag)
+
+    @staticmethod
+    def derive_config(conf: dict) -> dict:
+        """ Match rules and geometries, cached with the parsed config. """
+        return {
+            'rules': Matcher.rule_sources(conf),
+            'geom': geom.geom.parse_all(conf),
+        }
 
     def taglist(self) -> List:
         """ Returns list of tags without transients windows. """
@@ -75,6 +90,35 @@ class scratchpad(extension, cfg, Matcher):
         tag_list.remove('transients')
         return tag_list
 
+    def add_marked(self, tag: str, win) -> None:
+        """ Add window to the tag, it becomes the last one in the rotation.
+            tag (str): denotes the target tag.
+            win: i3ipc window. """
+        self.marked[tag][win.id] = win
+        tags = self.marked_tags.setdefault(win.id, [])
+        if tag not in tags:
+            tags.append(tag)
+
+    def del_marked(self, con_id: int) -> List[str]:
+        """ Remove window from all tags.
+            con_id (int): i3 container id.
+            Returns tags the window was removed from. """
+        tags = self.marked_tags.pop(con_id, [])
+        for tag in tags:
+            self.marked[tag].pop(con_id, None)
+        return tags
+
+    def del_marked_tag(self, tag: str, con_id: int) -> None:
+        """ Remove window from the given tag only.
+            tag (str): denotes the target tag.
+            con_id (int): i3 container id. """
+        self.marked.get(tag, {}).pop(con_id, None)
+        tags = self.marked_tags.get(con_id, [])
+        if tag in tags:
+            tags.remove(tag)
+        if not tags:
+            self.marked_tags.pop(con_id, None)
+
     @staticmethod
     def mark_uuid_tag(tag: str) -> str:
         """ Generate unique mark for the given [tag]
@@ -88,42 +132,41 @@ class scratchpad(extension, cfg, Matcher):
             be used in the most cases because of better performance and visual
             neatness """
         win_to_focus = None
-        for win in self.marked[tag]:
-            win.command('move window to workspace current')
-            win_to_focus = win
-        if hide and tag != 'transients':
-            self.hide_scratchpad_all_but_current(tag, win_to_focus)
-        if win_to_focus is not None:
-            win_to_focus.command('focus')
+        with CmdBatch() as batch:
+            for win in self.marked[tag].values():
+                batch.add('move window to workspace current', win)
+                win_to_focus = win
+            if hide and tag != 'transients':
+                self.hide_scratchpad_all_but_current(tag, win_to_focus)
+            if win_to_focus is not None:
+                batch.add('focus', win_to_focus)
 
     def hide_scratchpad(self, tag: str) -> None:
         """ Hide given [tag]
             tag (str): scratchpad name to hide """
         if self.geom_auto_save:
             self.geom_save(tag)
-        for win in self.marked[tag]:
-            win.command('move scratchpad')
-        self.restore_fullscreens()
+        with CmdBatch() as batch:
+            for win in self.marked[tag].values():
+                batch.add('move scratchpad', win)
+            self.restore_fullscreens()
 
     def hide_scratchpad_all_but_current(self, tag: str, current_win) -> None:
         """ Hide all tagged windows except current.
             tag: tag string """
         if len(self.marked[tag]) > 1 and current_win is not None:
-            for win in self.marked[tag]:
-                if win.id != current_win.id:
-                    win.command('move scratchpad')
-                else:
-                    win.command('move window to workspace current')
+            with CmdBatch() as batch:
+                for win in self.marked[tag].values():
+                    if win.id != current_win.id:
+                        batch.add('move scratchpad', win)
+                    else:
+                        batch.add('move window to workspace current', win)
 
     def find_visible_windows(self) -> List:
         """ Find windows on the current workspace, which is enough for
         scratchpads.
-        focused: denotes that [focused] window should be extracted from
-        i3.get_tree() or not """
-        focused = self.i3ipc.get_tree().find_focused()
-        return NegEWMH.find_visible_windows(
-            focused.workspace().leaves()
-        )
+        Windows of the focused workspace are taken from the tree mirror. """
+        return NegEWMH.find_visible_windows(TreeMirror.workspace_leaves())
 
     def dialog_toggle(self) -> None:
         """ Show dialog windows """
@@ -133,13 +176,14 @@ class scratchpad(extension, cfg, Matcher):
         """ Toggles fullscreen on/off and show/hide requested scratchpad after.
             w: window that fullscreen state should be on/off. """
         if win.fullscreen_mode:
-            win.command('fullscreen toggle')
+            with CmdBatch() as batch:
+                batch.add('fullscreen toggle', win)
             self.fullscreen_list.append(win)
 
     def toggle(self, tag: str) -> None:
         """ Toggle scratchpad with given [tag].
             tag (str): denotes the target tag. """
-        if not self.marked.get(tag, []):
+        if not self.marked.get(tag, {}):
             prog_str = self.extract_prog_str(self.conf(tag))
             if prog_str:
                 self.i3ipc.command(f'exec {prog_str}')
@@ -147,26 +191,25 @@ class scratchpad(extension, cfg, Matcher):
                 spawn_str = self.extract_prog_str(
                     self.conf(tag), "spawn", exe_file=False
                 )
-                if spawn_str:
-                    executor = extension.get_mods().get('executor')
-                    if executor is not None:
-                        executor.bindings['run'](spawn_str)
+                if spawn_str and 'executor' in extension.get_mods():
+                    MsgBroker.post('executor', ['run', spawn_str])
         if self.visible_window_with_tag(tag):
             self.hide_scratchpad(tag)
             return
         # We need to hide scratchpad it is visible,
         # regardless it focused or not
-        focused = self.i3ipc.get_tree().find_focused()
-        if self.marked.get(tag, []):
-            self.toggle_fs(focused)
-            self.show_scratchpad(tag)
+        focused = TreeMirror.find_focused()
+        if self.marked.get(tag, {}):
+            with CmdBatch():
+                self.toggle_fs(focused)
+                self.show_scratchpad(tag)
 
     def focus_sub_tag(self, tag: str, subtag_classes_set: Set) -> None:
         """ Cycle over the subtag windows.
             tag (str): denotes the target tag.
             subtag_classes_set (set): subset of classes of target [tag] which
             distinguish one subtag from another. """
-        focused = self.i3ipc.get_tree().find_focused()
+        focused = TreeMirror.find_focused()
         self.toggle_fs(focused)
         if focused.window_class in subtag_classes_set:
             return
@@ -174,14 +217,17 @@ class scratchpad(extension, cfg, Matcher):
         for _ in self.marked[tag]:
             if focused.window_class not in subtag_classes_set:
                 self.next_win_on_curr_tag()
-                focused = self.i3ipc.get_tree().find_focused()
+                # focus event may be not handled yet, so resync
+                focused = TreeMirror.find_focused(fresh=True)
 
     def run_subtag(self, tag: str, subtag: str) -> None:
         """ Run-or-focus the application for subtag
             tag (str): denotes the target tag.
             subtag (str): denotes the target subtag. """
         if subtag in self.conf(tag):
-            class_list = [win.window_class for win in self.marked[tag]]
+            class_list = [
+                win.window_class for win in self.marked[tag].values()
+            ]
             subtag_classes_set = self.conf(tag, subtag, "class")
             subtag_classes_matched = [
                 w for w in class_list if w in subtag_classes_set
@@ -197,29 +243,23 @@ class scratchpad(extension, cfg, Matcher):
 
     def restore_fullscreens(self) -> None:
         """ Restore all fullscreen windows """
-        for win in self.fullscreen_list:
-            win.command('fullscreen toggle')
+        with CmdBatch() as batch:
+            for win in self.fullscreen_list:
+                batch.add('fullscreen toggle', win)
         self.fullscreen_list = []
 
     def visible_window_with_tag(self, tag: str) -> bool:
         """ Counts visible windows for given tag
             tag (str): denotes the target tag. """
-        for win in self.find_visible_windows():
-            for i in self.marked[tag]:
-                if win.id == i.id:
-                    return True
-        return False
+        marked = self.marked[tag]
+        return any(win.id in marked for win in self.find_visible_windows())
 
     def get_current_tag(self, focused) -> str:
         """ Get the current tag This function use focused window to determine
         the current tag.
         focused : focused window. """
-        for tag in self.cfg:
-            for i in self.marked[tag]:
-                if focused.id == i.id:
-                    return tag
-
-        return ''
+        tags = self.marked_tags.get(focused.id)
+        return tags[0] if tags else ''
 
     def apply_to_current_tag(self, func: Callable) -> bool:
         """ Apply function [func] to the current tag
@@ -227,7 +267,7 @@ class scratchpad(extension, cfg, Matcher):
             hide_current and another to perform actions on the currently
             selected tag.
             func(Callable) : function to apply. """
-        curr_tag = self.get_current_tag(self.i3ipc.get_tree().find_focused())
+        curr_tag = self.get_current_tag(TreeMirror.find_focused())
         if curr_tag:
             func(curr_tag)
         return bool(curr_tag)
@@ -238,21 +278,20 @@ class scratchpad(extension, cfg, Matcher):
             that can appear after i3 (re)start, etc. Because of I've think that
             is't better to make screen clear after (re)start. """
         def next_win(tag: str) -> None:
-            self.show_scratchpad(tag, hide_)
-            for idx, win in enumerate(self.marked[tag]):
-                if focused_win.id != win.id:
-                    self.marked[tag][idx].command(
-                        'move window to workspace current'
-                    )
-                    self.marked[tag].insert(
-                        len(self.marked[tag]),
-                        self.marked[tag].pop(idx)
-                    )
-                    win.command('move scratchpad')
-            self.show_scratchpad(tag, hide_)
+            marked = self.marked[tag]
+            with CmdBatch() as batch:
+                self.show_scratchpad(tag, hide_)
+                # rotate: the first window except the focused one goes last
+                for con_id, win in marked.items():
+                    if focused_win.id != con_id:
+                        marked[con_id] = marked.pop(con_id)
+                        batch.add('move window to workspace current', win)
+                        batch.add('move scratchpad', win)
+                        break
+                self.show_scratchpad(tag, hide_)
 
         hide_ = hide
-        focused_win = self.i3ipc.get_tree().find_focused()
+        focused_win = TreeMirror.find_focused()
         self.apply_to_current_tag(next_win)
 
     def hide_current(self) -> None:
@@ -262,14 +301,11 @@ class scratchpad(extension, cfg, Matcher):
     def geom_restore(self, tag: str) -> None:
         """ Restore default window geometry
         tag(str) : hide another windows for the current tag or not. """
-        for idx, win in enumerate(self.marked[tag]):
-            # delete previous mark
-            del self.marked[tag][idx]
-            # then make a new mark and move scratchpad
+        for win in self.marked[tag].values():
+            # make a new mark and move scratchpad
             win_cmd = f"{scratchpad.mark_uuid_tag(tag)}, \
                 move scratchpad, {self.nsgeom.get_geom(tag)}"
             win.command(win_cmd)
-            self.marked[tag].append(win)
 
     def geom_restore_current(self) -> None:
         """ Restore geometry for the current selected tag. """
@@ -278,20 +314,22 @@ class scratchpad(extension, cfg, Matcher):
     def geom_dump(self, tag: str) -> None:
         """ Dump geometry for the given tag
             tag(str): denotes target tag. """
-        focused = self.i3ipc.get_tree().find_focused()
-        for win in self.marked[tag]:
+        focused = TreeMirror.find_focused(fresh=True)
+        for win in self.marked[tag].values():
             if win.id == focused.id:
                 focused_geom = f"{focused.rect.width}x{focused.rect.height}" \
                     f"+{focused.rect.x}+{focused.rect.y}"
                 self.cfg[tag]["geom"] = focused_geom
                 self.dump_config()
+                # own write does not reload the module
+                self.nsgeom = geom.geom(self.cfg)
                 break
 
     def geom_save(self, tag: str) -> None:
         """ Save geometry for the given tag
             tag(str): denotes target tag. """
-        focused = self.i3ipc.get_tree().find_focused()
-        for win in self.marked[tag]:
+        focused = TreeMirror.find_focused(fresh=True)
+        for win in self.marked[tag].values():
             if win.id == focused.id:
                 focused_geom = f"{focused.rect.width}x{focused.rect.height}" \
                     f"+{focused.rect.x}+{focused.rect.y}"
@@ -338,15 +376,13 @@ class scratchpad(extension, cfg, Matcher):
             tag_to_add (str): denotes the target tag.
             prop_str (str): string in i3-match format used to add/delete target
             window in/from scratchpad. """
+        prev_conf = copy.deepcopy(self.cfg)
         if tag_to_add in self.cfg:
             self.add_props(tag_to_add, prop_str)
         for tag in self.cfg:
             if tag != tag_to_add:
                 self.del_props(tag, prop_str)
-                if self.marked[tag] != []:
-                    for win in self.marked[tag]:
-                        win.command('unmark')
-        self.__init__(self.i3ipc)
+        self.props_changed(prev_conf)
 
     def del_prop(self, tag: str, prop_str: str) -> None:
         """ Delete property via [prop_str] to the target [tag].
@@ -354,7 +390,39 @@ class scratchpad(extension, cfg, Matcher):
             prop_str (str): string in i3-match format used to add/delete target
             window in/from scratchpad.
         """
+        prev_conf = copy.deepcopy(self.cfg)
         self.del_props(tag, prop_str)
+        self.props_changed(prev_conf)
+
+    def props_changed(self, prev_conf: dict) -> None:
+        """ Apply props add / del as the rule delta: only windows with the
+        edited properties are matched again, only against tags with changed
+        rules, other windows keep their marks.
+            prev_conf (dict): config before the props change. """
+        changed = self.changed_rules(prev_conf)
+        self.matcher_reset()
+        if changed:
+            self.retag(changed, self.prop_windows())
+
+    def apply_config(self, prev_conf: dict) -> None:
+        """ Apply the reloaded config: only windows are matched again against
+        tags with changed rules, windows of other tags keep their marks and
+        positions in the rotation.
+            prev_conf (dict): config before the reload. """
+        changed = self.changed_rules(prev_conf)
+        self.matcher_reset()
+        self.nsgeom = geom.geom(self.cfg, self.cfg_derived.pop('geom', None))
+        with CmdBatch() as batch:
+            for tag in self.cfg:
+                if tag in prev_conf and tag not in changed and \
+                        self.cfg[tag].get('geom') != prev_conf[tag].get('geom'):
+                    for win in self.marked[tag].values():
+                        batch.add(self.nsgeom.get_geom(tag), win)
+        for tag in self.cfg:
+            self.marked.setdefault(tag, {})
+        self.retag(changed)
+        for tag in set(self.marked) - set(self.cfg):
+            del self.marked[tag]
 
     def mark_tag(self, _, event) -> None:
         """ Add unique mark to the new window.
@@ -365,20 +433,20 @@ class scratchpad(extension, cfg, Matcher):
         is_dialog_win = NegEWMH.is_dialog_win(win)
 
         self.win = win
-        for tag in self.cfg:
-            if not is_dialog_win and tag != "transients":
-                if self.match(win, tag):
+        if not is_dialog_win:
+            for tag in self.match_tags(win):
+                if tag != "transients":
                     # scratch_move
                     win.command(
                         f"{scratchpad.mark_uuid_tag(tag)}, move scratchpad, \
                         {self.nsgeom.get_geom(tag)}")
-                    self.marked[tag].append(win)
+                    self.add_marked(tag, win)
                     self.show_scratchpad(tag, hide=True)
-            elif is_dialog_win and tag == "transients":
-                win.command(
-                    f"{scratchpad.mark_uuid_tag('transients')}, \
-                    move scratchpad")
-                self.marked["transients"].append(win)
+        elif "transients" in self.cfg:
+            win.command(
+                f"{scratchpad.mark_uuid_tag('transients')}, \
+                move scratchpad")
+            self.add_marked("transients", win)
 
         # Special hack to invalidate windows after subtag start
         if self.focus_win_flag[0]:
@@ -397,40 +465,72 @@ class scratchpad(extension, cfg, Matcher):
             event.container """
         win_ev = event.container
         self.win = win_ev
-        for tag in self.taglist():
-            for win in self.marked[tag]:
-                if win.id == win_ev.id:
-                    self.marked[tag].remove(win)
-                    self.show_scratchpad(tag)
-                    break
+        for tag in self.del_marked(win_ev.id):
+            if tag != "transients":
+                self.show_scratchpad(tag)
         if win_ev.fullscreen_mode:
             self.apply_to_current_tag(self.hide_scratchpad)
-        for transient in self.marked["transients"]:
-            if transient.id == win_ev.id:
-                self.marked["transients"].remove(transient)
 
     def mark_all_tags(self, hide: bool = True) -> None:
         """ Add marks to the all tags.
             hide (bool): hide window or not. Primarly used to cleanup "garbage"
             that can appear after i3 (re)start, etc. Because of I've think that
             is't better to make screen clear after (re)start. """
-        winlist = self.i3ipc.get_tree().leaves()
+        winlist = TreeMirror.leaves()
+        dialogs = {win.id for win in NegEWMH.find_dialog_windows(winlist)}
         hide_cmd = ''
         for win in winlist:
-            is_dialog_win = NegEWMH.is_dialog_win(win)
-            for tag in self.cfg:
-                if not is_dialog_win and tag != "transients":
-                    if self.match(win, tag):
+            is_dialog_win = win.id in dialogs
+            if not is_dialog_win:
+                for tag in self.match_tags(win):
+                    if tag != "transients":
                         if hide:
                             hide_cmd = '[con_id=__focused__] scratchpad show'
                         win_cmd = f"{scratchpad.mark_uuid_tag(tag)}, \
                             move scratchpad, \
                             {self.nsgeom.get_geom(tag)}, {hide_cmd}"
                         win.command(win_cmd)
-                        self.marked[tag].append(win)
-                if is_dialog_win:
-                    win_cmd = f"{scratchpad.mark_uuid_tag('transients')}, \
-                        move scratchpad"
-                    win.command(win_cmd)
-                    self.marked["transients"].append(win)
+                        self.add_marked(tag, win)
+            elif "transients" in self.cfg:
+                win_cmd = f"{scratchpad.mark_uuid_tag('transients')}, \
+                    move scratchpad"
+                win.command(win_cmd)
+                self.add_marked("transients", win)
             self.win = win
+
+    def retag(self, tags: Set[str], windows: Optional[List] = None) -> None:
+        """ Match windows against the given tags again. New matches are
+        marked and hidden to the scratchpad, windows which do not match any
+        more lose the tag mark and stay where they are. Other tags are not
+        touched.
+            tags (set): tags to match again, removed ones included.
+            windows: windows to check, all windows by default. """
+        if not tags:
+            return
+        if windows is None:
+            windows = TreeMirror.leaves()
+        dialogs = {win.id for win in NegEWMH.find_dialog_windows(windows)}
+        tag_marks = {tag: re.compile(re.escape(tag) + r'-\d+') for tag in tags}
+        with CmdBatch() as batch:
+            for win in windows:
+                is_dialog_win = win.id in dialogs
+                for tag in tags:
+                    if tag not in self.cfg:
+                        match = False
+                    elif tag == 'transients':
+                        match = is_dialog_win
+                    else:
+                        match = not is_dialog_win and self.match(win, tag)
+                    marked = win.id in self.marked.get(tag, {})
+                    if match and not marked:
+                        win_cmd = f"{scratchpad.mark_uuid_tag(tag)}, " \
+                            "move scratchpad"
+                        if tag != 'transients':
+                            win_cmd += f", {self.nsgeom.get_geom(tag)}"
+                        batch.add(win_cmd, win)
+                        self.add_marked(tag, win)
+                    elif marked and not match:
+                        for mark in win.marks or []:
+                            if tag_marks[tag].fullmatch(mark):
+                                batch.add(f'unmark {mark}', win)
+                        self.del_marked_tag(tag, win.id)
@@ -6,8 +6,8 @@ are no external dependecies like i3 or asyncio.
 import sys
 import qtoml
 import traceback
-import asyncio
-import inotipy
+from lib.cfg_cache import CfgCache
+from lib.cfg_watcher import CfgWatcher
 from lib.misc import Misc
 
 class modconfig():
@@ -46,30 +46,17 @@ class modconfig():
     def load_config(self):
         """ Reload config itself and convert lists in it to sets for the better
             performance. """
-        with open(self.mod_cfg_path, "r") as fp:
-            self.cfg = qtoml.load(fp)
+        self.cfg = CfgCache.load(self.mod_cfg_path)[0]
 
     def dump_config(self):
-        """ Dump current config, can be used for debugging. """
-        with open(self.mod_cfg_path, "r+") as fp:
-            qtoml.dump(self.cfg, fp)
-            self.cfg = qtoml.load(fp)
+        """ Save current config with the write-behind, see CfgWatcher. """
+        CfgWatcher.write_behind(self.mod_cfg_path, qtoml.dumps(self.cfg))
 
-    def cfg_watcher(self):
-        """ cfg watcher to update modules config in realtime. """
-        watcher = inotipy.Watcher.create()
-        watcher.watch(self.i3_cfg_path, inotipy.IN.MODIFY)
-        return watcher
-
-    async def cfg_worker(self, watcher):
-        """ Reload target config
-            watcher: watcher for cfg. """
-        while True:
-            event = await watcher.get()
-            if event.name == self.mod + '.toml':
-                self.reload_config()
-                Misc.notify_msg(f'[Reloaded {self.mod}]')
+    def cfg_changed(self, _name: str) -> None:
+        """ Reload target config, called once per save of the file. """
+        self.reload_config()
+        Misc.notify_msg(f'[Reloaded {self.mod}]')
 
     def run_inotify_watchers(self):
-        """ Start all watchers here via ensure_future in background. """
-        asyncio.ensure_future(self.cfg_worker(self.cfg_watcher()))
+        """ Watch the config file with the shared debounced watcher. """
+        CfgWatcher.watch(self.i3_cfg_path, self.mod + '.toml', self.cfg_changed)
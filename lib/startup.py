@@ -0,0 +1,229 @@
+""" Startup profile for negi3wm.
+
+Every module startup is split into phases: import and init, where the init
+is split further into config parsing, i3 IPC calls, X11 round trips and
+subprocess spawns. To get them the corresponding library calls are wrapped
+while modules are loading and restored back after that, even if some module
+fails to start, so there is no overhead at runtime.
+
+Every run is saved into cache/startup_profile.json with the git revision of
+the config, so startup regressions can be tracked between versions.
+"""
+
+import os
+import json
+import time
+import timeit
+import functools
+import contextlib
+import subprocess
+import multiprocessing
+from typing import Callable, List, Optional
+
+import Xlib.protocol.display
+
+from lib.cfg_cache import CfgCache
+from lib.misc import Misc
+
+
+class StartupProfile():
+    """ Collects per-module startup phases. All state is class-level. """
+    current = None # name of the module which is loading now
+    mods = {} # module name -> phases
+    wrapped = [] # (owner, attribute, original, own attribute) to restore
+    history_size = 100 # number of runs saved
+    i3_calls = (
+        'command', 'get_tree', 'get_workspaces', 'get_outputs', 'get_marks',
+        'get_version', 'get_bar_config', 'get_bar_config_list',
+        'get_binding_modes', 'get_config', 'send_tick',
+    )
+
+    @staticmethod
+    def path() -> str:
+        """ Profile history file. """
+        return Misc.i3path() + '/cache/startup_profile.json'
+
+    @classmethod
+    def install(cls, i3) -> None:
+        """ Wrap library calls to count them per module.
+        i3: i3ipc connection used by modules. """
+        for name in cls.i3_calls:
+            if hasattr(i3, name):
+                cls.wrap(i3, name, 'i3', name)
+        cls.wrap(CfgCache, 'load', 'config')
+        cls.wrap(
+            Xlib.protocol.display.Display, 'send_and_recv', 'x11',
+            when=lambda *_, **kw: kw.get('request') is not None
+        )
+        cls.wrap(subprocess.Popen, '_execute_child', 'spawn')
+        cls.wrap(multiprocessing.Process, 'start', 'spawn')
+
+    @classmethod
+    @contextlib.contextmanager
+    def profiling(cls, i3):
+        """ Wrap library calls inside of the block, they are restored on exit
+        from it, also when module startup raises.
+        i3: i3ipc connection used by modules. """
+        cls.install(i3)
+        try:
+            yield
+        finally:
+            cls.uninstall()
+
+    @classmethod
+    def uninstall(cls) -> None:
+        """ Restore all wrapped calls. """
+        for owner, attr, orig, own in reversed(cls.wrapped):
+            if own:
+                setattr(owner, attr, orig)
+            else:
+                # class method was shadowed by the instance attribute
+                delattr(owner, attr)
+        cls.wrapped = []
+
+    @classmethod
+    def wrap(cls, owner, attr: str, kind: str, key: str = '',
+             when: Optional[Callable] = None) -> None:
+        """ Replace owner.attr by the timed wrapper.
+        kind (str): counter group: i3, config, x11, spawn.
+        key (str): counter name inside of the group, optional.
+        when (Callable): count only calls for which it returns True. """
+        orig = getattr(owner, attr)
+
+        @functools.wraps(orig)
+        def wrapper(*args, **kwargs):
+            if cls.current is None or (when and not when(*args, **kwargs)):
+                return orig(*args, **kwargs)
+            start = timeit.default_timer()
+            try:
+                return orig(*args, **kwargs)
+            finally:
+                cls.add(kind, key, timeit.default_timer() - start)
+
+        cls.wrapped.append((owner, attr, orig, attr in vars(owner)))
+        setattr(owner, attr, wrapper)
+
+    @classmethod
+    def add(cls, kind: str, key: str, elapsed: float) -> None:
+        """ Add call to the counters of the current module. """
+        counters = cls.mods[cls.current].setdefault(kind, {})
+        if key:
+            counters = counters.setdefault(key, {})
+        counters['count'] = counters.get('count', 0) + 1
+        counters['time'] = counters.get('time', 0.0) + elapsed
+
+    @classmethod
+    @contextlib.contextmanager
+    def phase(cls, mod: str, name: str):
+        """ Measure the phase of the module startup.
+        mod (str): module name.
+        name (str): phase name: import or init. """
+        prev = cls.current
+        cls.current = mod
+        cls.mods.setdefault(mod, {})
+        start = timeit.default_timer()
+        try:
+            yield
+        finally:
+            elapsed = timeit.default_timer() - start
+            cls.mods[mod][name] = cls.mods[mod].get(name, 0.0) + elapsed
+            cls.current = prev
+
+    @staticmethod
+    def revision() -> str:
+        """ Git revision of the config dir, without spawning git. The branch
+        ref is taken from its file or from packed-refs after git gc. """
+        git_dir = Misc.i3path() + '/.git/'
+        try:
+            with open(git_dir + 'HEAD', 'r') as fp:
+                head = fp.read().strip()
+            if not head.startswith('ref: '):
+                return head[:12]
+            ref = head[5:]
+            with contextlib.suppress(FileNotFoundError):
+                with open(git_dir + ref, 'r') as fp:
+                    return fp.read().strip()[:12]
+            with open(git_dir + 'packed-refs', 'r') as fp:
+                for line in fp:
+                    fields = line.split()
+                    if len(fields) == 2 and fields[1] == ref:
+                        return fields[0][:12]
+        except OSError:
+            pass
+        return ''
+
+    @classmethod
+    def finish(cls, lazy: List[str]) -> dict:
+        """ Stop profiling, save this run to the history and return it.
+        lazy: names of lazy modules, they are imported only. """
+        cls.uninstall()
+        run = {
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'revision': StartupProfile.revision(),
+            'total': 0.0,
+            'mods': {},
+        }
+        for mod, phases in cls.mods.items():
+            phases['lazy'] = mod in lazy
+            phases['total'] = phases.get('import', 0.0) + \
+                phases.get('init', 0.0)
+            run['total'] += phases['total']
+            run['mods'][mod] = phases
+        history = StartupProfile.history()[-(cls.history_size - 1):]
+        history.append(run)
+        Misc.create_dir(os.path.dirname(StartupProfile.path()))
+        tmp_path = StartupProfile.path() + '.tmp'
+        with open(tmp_path, 'w') as fp:
+            json.dump(history, fp, indent=1)
+        os.replace(tmp_path, StartupProfile.path())
+        return run
+
+    @staticmethod
+    def history() -> List[dict]:
+        """ Saved runs, the last one is the latest. """
+        try:
+            with open(StartupProfile.path(), 'r') as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return []
+
+    @staticmethod
+    def report(run: dict, prev: Optional[dict] = None) -> List[str]:
+        """ Table of module phases in milliseconds, call columns are shown
+        as time/count. Last column is the total time of the previous run for
+        comparison. """
+        def ms(val: float) -> str:
+            return f'{val * 1000:.2f}'
+
+        def calls(counters: dict) -> str:
+            return f'{ms(counters.get("time", 0.0))}/' \
+                f'{counters.get("count", 0)}'
+
+        ret = [
+            f'{run["date"]} {run["revision"]} total={ms(run["total"])}ms',
+            f'{"module":<18s}{"import":>9s}{"init":>9s}{"config":>12s}'
+            f'{"i3":>12s}{"x11":>12s}{"spawn":>12s}{"total":>9s}'
+            f'{"prev":>9s}'
+        ]
+        for mod, phases in run['mods'].items():
+            i3_total = {'count': 0, 'time': 0.0}
+            for counters in phases.get('i3', {}).values():
+                i3_total['count'] += counters['count']
+                i3_total['time'] += counters['time']
+            prev_total = '-'
+            if prev is not None and mod in prev['mods']:
+                prev_total = ms(prev['mods'][mod]['total'])
+            name = mod + (' (lazy)' if phases.get('lazy') else '')
+            ret.append(
+                f'{name:<18s}{ms(phases.get("import", 0.0)):>9s}'
+                f'{ms(phases.get("init", 0.0)):>9s}'
+                f'{calls(phases.get("config", {})):>12s}'
+                f'{calls(i3_total):>12s}'
+                f'{calls(phases.get("x11", {})):>12s}'
+                f'{calls(phases.get("spawn", {})):>12s}'
+                f'{ms(phases["total"]):>9s}{prev_total:>9s}'
+            )
+        for mod, phases in run['mods'].items():
+            for call, counters in phases.get('i3', {}).items():
+                ret.append(f'  {mod}.{call}: {calls(counters)}')
+        return ret
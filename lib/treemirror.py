@@ -0,0 +1,452 @@
+""" In-memory mirror of the i3 tree shared by all modules.
+
+Most of bindings need only the focused window, leaves of the current workspace
+or the list of fullscreen windows, but every i3.get_tree() call serializes and
+parses the whole tree. TreeMirror takes one snapshot at start and then patches
+itself from window, workspace and output events, so lookups are dict reads.
+
+Window events carry the container only, so new and moved windows are patched
+in place but their workspace is not known from the payload. Workspace events
+carry the whole workspace subtree, so windows of the current and old workspace
+are placed from it, and the focused window is always on the focused
+workspace. Moves done by own commands, like scratchpad show, hide and retag
+sent through CmdBatch, are expected: the move event places the window on the
+workspace the command moves it to. Other new and moved windows stay unplaced
+until some event places them. Scratchpad windows are floating, so the move
+from the focused workspace leaves it: the window is hidden or moved to another
+workspace. So it is known to be away from the focused workspace, and reads of
+the focused workspace do not need it. Reads which need the workspace of
+unplaced windows take one fresh snapshot. Outputs and workspace reload mark
+the mirror as dirty, so the next read takes the snapshot, a storm of such
+events costs a single get_tree() call.
+"""
+
+import re
+import threading
+from typing import List, Optional
+
+
+class TreeMirror():
+    """ Event-maintained i3 tree mirror. All state is class-level, so there is
+    exactly one mirror per negi3wm process. """
+    i3ipc = None
+    lock = threading.RLock()
+    dirty = True
+    snapshots = 0 # number of get_tree() calls done by the mirror
+    wins = {} # con_id -> window container, new windows are appended
+    ws_wins = {} # workspace name -> {con_id: None} in tree order
+    ws_of = {} # con_id -> workspace name
+    unplaced = set() # ids of windows moved to the unknown workspace
+    away = set() # ids of unplaced windows not on the focused workspace
+    expected = {} # con_id -> [workspace names] of pending own moves
+    workspaces = {} # workspace name -> workspace container
+    fullscreened = {} # con_id -> fullscreen window container
+    focused_id = None # id of the focused window
+    focused_ws = '' # name of the focused workspace
+    ws_move_re = re.compile(
+        r'move (?:window |container )?(?:to )?workspace '
+        r'(?:--no-auto-back-and-forth )?(.+)'
+    )
+    scratch_move_re = re.compile(
+        r'move (?:window |container )?(?:to )?scratchpad'
+    )
+    in_place_move_re = re.compile(
+        r'move (?:absolute )?position .+|move workspace to output .+'
+    )
+    relative_ws = {
+        'next', 'prev', 'next_on_output', 'prev_on_output', 'back_and_forth'
+    }
+
+    @classmethod
+    def init(cls, i3) -> None:
+        """ Take the first snapshot and subscribe to events. Should be called
+        before modules are loaded, so the mirror is patched before module
+        event handlers are called.
+        i3: i3ipc connection """
+        cls.i3ipc = i3
+        cls.sync()
+        i3.on('window', cls.on_window)
+        i3.on('workspace', cls.on_workspace)
+        i3.on('output', cls.on_output)
+
+    @classmethod
+    def sync(cls) -> None:
+        """ Rebuild the mirror from the fresh get_tree() snapshot. Modules
+        call it from their threads, so the snapshot is taken under the lock:
+        events can not be patched in meanwhile and lost by the rebuild. """
+        with cls.lock:
+            cls.rebuild(cls.i3ipc.get_tree())
+
+    @classmethod
+    def rebuild(cls, tree) -> None:
+        """ Replace the mirror by the tree snapshot. """
+        wins, ws_wins, ws_of, workspaces, fullscreened = {}, {}, {}, {}, {}
+        focused_id, focused_ws = None, ''
+        for con in tree:
+            if con.type == 'workspace':
+                workspaces[con.name] = con
+                ws_wins[con.name] = {}
+        for win in tree.leaves():
+            ws_name = win.workspace().name
+            wins[win.id] = win
+            ws_wins[ws_name][win.id] = None
+            ws_of[win.id] = ws_name
+            if win.fullscreen_mode:
+                fullscreened[win.id] = win
+            if win.focused:
+                focused_id = win.id
+        focused = tree.find_focused()
+        if focused is not None and focused.workspace() is not None:
+            focused_ws = focused.workspace().name
+        with cls.lock:
+            cls.wins, cls.ws_wins, cls.ws_of = wins, ws_wins, ws_of
+            cls.workspaces, cls.fullscreened = workspaces, fullscreened
+            cls.focused_id, cls.focused_ws = focused_id, focused_ws
+            cls.unplaced, cls.away = set(), set()
+            cls.snapshots += 1
+            cls.dirty = False
+
+    @classmethod
+    def invalidate(cls) -> None:
+        """ Mark mirror as outdated, next read will take a fresh snapshot. """
+        cls.dirty = True
+
+    @classmethod
+    def ensure(cls, placed: bool = False) -> None:
+        """ Resync the mirror if it is outdated.
+        placed (bool): the caller needs workspaces of windows, so resync if
+        there are unplaced windows too, see placed(). """
+        if cls.dirty or (placed and (cls.unplaced or cls.away)):
+            cls.sync()
+
+    @classmethod
+    def find_focused(cls, fresh: bool = False):
+        """ Returns the focused window, or focused workspace container if
+        there are no focused windows on it.
+        fresh (bool): take a new snapshot before lookup, for callers which
+        need an actual window geometry. """
+        if fresh:
+            cls.sync()
+        cls.ensure(placed=not cls.placed(cls.focused_id))
+        with cls.lock:
+            win = cls.wins.get(cls.focused_id)
+            if win is not None and cls.ws_of.get(win.id) == cls.focused_ws:
+                return win
+            return cls.workspaces.get(cls.focused_ws, win)
+
+    @classmethod
+    def find_by_id(cls, con_id: int):
+        """ Returns window by container id or None. """
+        cls.ensure()
+        return cls.wins.get(con_id)
+
+    @classmethod
+    def leaves(cls) -> List:
+        """ Returns all windows, including the scratchpad ones. """
+        cls.ensure()
+        with cls.lock:
+            return list(cls.wins.values())
+
+    @classmethod
+    def workspace_leaves(cls, ws_name: Optional[str] = None) -> List:
+        """ Returns windows of the given workspace.
+            ws_name (str): workspace name, focused workspace by default. """
+        if ws_name is None or ws_name == cls.focused_ws:
+            cls.ensure(placed=bool(cls.unplaced))
+        else:
+            cls.ensure(placed=bool(cls.unplaced or cls.away))
+        with cls.lock:
+            if ws_name is None:
+                ws_name = cls.focused_ws
+            return [cls.wins[i] for i in cls.ws_wins.get(ws_name, {})]
+
+    @classmethod
+    def focused_workspace(cls) -> str:
+        """ Returns the name of the focused workspace. """
+        cls.ensure()
+        return cls.focused_ws
+
+    @classmethod
+    def workspace_of(cls, con_id: int) -> str:
+        """ Returns workspace name for the given window. """
+        cls.ensure(placed=not cls.placed(con_id))
+        return cls.ws_of.get(con_id, '')
+
+    @classmethod
+    def find_fullscreen(cls) -> List:
+        """ Returns all fullscreen windows. """
+        cls.ensure()
+        with cls.lock:
+            return list(cls.fullscreened.values())
+
+    @classmethod
+    def find_by(cls, attr: str, pattern: str) -> List:
+        """ Returns windows which attribute [attr] matches regex [pattern]. """
+        cls.ensure()
+        regex = re.compile(pattern)
+        with cls.lock:
+            return [
+                win for win in cls.wins.values()
+                if getattr(win, attr) and regex.search(getattr(win, attr))
+            ]
+
+    @classmethod
+    def find_classed(cls, pattern: str) -> List:
+        """ Returns windows with WM_CLASS matching the [pattern]. """
+        return cls.find_by('window_class', pattern)
+
+    @classmethod
+    def find_instanced(cls, pattern: str) -> List:
+        """ Returns windows with WM_INSTANCE matching the [pattern]. """
+        return cls.find_by('window_instance', pattern)
+
+    @classmethod
+    def find_by_role(cls, pattern: str) -> List:
+        """ Returns windows with WM_WINDOW_ROLE matching the [pattern]. """
+        return cls.find_by('window_role', pattern)
+
+    @classmethod
+    def replace(cls, win) -> None:
+        """ Replace stored window by the fresh container from event. Window
+        keeps its workspace and position in the mirror.
+        win: window container from i3ipc event. """
+        if win.id not in cls.wins:
+            cls.dirty = True
+            return
+        old = cls.wins[win.id]
+        if win.parent is None:
+            win.parent = old.parent
+        cls.wins[win.id] = win
+        if win.fullscreen_mode:
+            cls.fullscreened[win.id] = win
+        else:
+            cls.fullscreened.pop(win.id, None)
+
+    @classmethod
+    def add(cls, win) -> None:
+        """ Add the new window, its workspace is unknown yet.
+        win: window container from i3ipc event. """
+        cls.wins[win.id] = win
+        if win.fullscreen_mode:
+            cls.fullscreened[win.id] = win
+        cls.unplace(win.id)
+
+    @classmethod
+    def remove(cls, con_id: int) -> None:
+        """ Drop closed window from the mirror. """
+        cls.wins.pop(con_id, None)
+        cls.fullscreened.pop(con_id, None)
+        ws_name = cls.ws_of.pop(con_id, None)
+        cls.ws_wins.get(ws_name, {}).pop(con_id, None)
+        cls.unplaced.discard(con_id)
+        cls.away.discard(con_id)
+        cls.expected.pop(con_id, None)
+        if cls.focused_id == con_id:
+            cls.focused_id = None
+
+    @classmethod
+    def place(cls, con_id: int, ws_name: str) -> None:
+        """ Move the window to the workspace. """
+        prev_ws = cls.ws_of.get(con_id)
+        if prev_ws != ws_name:
+            cls.ws_wins.get(prev_ws, {}).pop(con_id, None)
+            cls.ws_of[con_id] = ws_name
+            cls.ws_wins.setdefault(ws_name, {})[con_id] = None
+        cls.unplaced.discard(con_id)
+        cls.away.discard(con_id)
+
+    @classmethod
+    def unplace(cls, con_id: int, away: bool = False) -> None:
+        """ The window is moved to the unknown workspace.
+        away (bool): it is known to be not on the focused workspace. """
+        ws_name = cls.ws_of.pop(con_id, None)
+        cls.ws_wins.get(ws_name, {}).pop(con_id, None)
+        if away:
+            cls.unplaced.discard(con_id)
+            cls.away.add(con_id)
+        else:
+            cls.away.discard(con_id)
+            cls.unplaced.add(con_id)
+
+    @classmethod
+    def placed(cls, con_id: int) -> bool:
+        """ Is the workspace of the window known. """
+        return con_id not in cls.unplaced and con_id not in cls.away
+
+    @classmethod
+    def expect(cls, con_id: int, cmd: str) -> int:
+        """ Remember where the own command moves the window, so its move
+        event places it. Tracked only if the window position is known and
+        differs from the target, because i3 sends no event for the move to
+        the same workspace. Compound commands like `mark ..., move
+        scratchpad, move absolute position ...` are parsed up to the first
+        part which is run for other windows: the one with criteria or after
+        `;`. Tracking stops at the move to the unknown workspace. Returns the
+        number of remembered moves.
+            con_id (int): window id.
+            cmd (str): i3 command for this window, without criteria. """
+        from lib.cmdbatch import CmdBatch
+        count, end = 0, -1
+        with cls.lock:
+            pending = cls.expected.get(con_id)
+            if pending:
+                pos = pending[-1]
+            elif cls.placed(con_id):
+                pos = cls.ws_of.get(con_id)
+            else:
+                return 0
+            for part in CmdBatch.split_cmds(cmd):
+                if end >= 0 and cmd[end] == ';':
+                    break
+                end += len(part) + 1
+                part = ' '.join(part.split())
+                if part.startswith('['):
+                    break
+                target = cls.move_target(part)
+                if target is None:
+                    break
+                if target and pos is not None and pos != target:
+                    cls.expected.setdefault(con_id, []).append(target)
+                    pos = target
+                    count += 1
+        return count
+
+    @classmethod
+    def move_target(cls, cmd: str) -> Optional[str]:
+        """ Workspace where the single i3 command moves the window: empty
+        string if it does not move the window to another workspace, None if
+        the target is not known.
+            cmd (str): i3 command with normalized spaces. """
+        if not cmd.startswith(('move ', 'scratchpad ')):
+            return ''
+        if cls.scratch_move_re.fullmatch(cmd):
+            return '__i3_scratch'
+        if cls.in_place_move_re.fullmatch(cmd):
+            return ''
+        match = cls.ws_move_re.fullmatch(cmd)
+        if match is None:
+            return None
+        name = match.group(1)
+        if name == 'current':
+            return cls.focused_ws
+        if name in cls.relative_ws or name.startswith('number '):
+            return None
+        return name.strip('"')
+
+    @classmethod
+    def unexpect(cls, con_id: int, count: int) -> None:
+        """ Forget the last moves remembered by expect, when the command is
+        not sent after all.
+            con_id (int): window id.
+            count (int): number of moves returned by expect. """
+        with cls.lock:
+            pending = cls.expected.get(con_id)
+            if pending:
+                del pending[max(len(pending) - count, 0):]
+                if not pending:
+                    del cls.expected[con_id]
+
+    @classmethod
+    def place_workspace(cls, ws) -> None:
+        """ Take windows of the workspace from the event payload, which has
+        the whole subtree of the workspace.
+        ws: workspace container from i3ipc event. """
+        name = ws.name
+        members = {}
+        for win in ws.leaves():
+            members[win.id] = None
+            cls.wins[win.id] = win
+            if win.fullscreen_mode:
+                cls.fullscreened[win.id] = win
+            else:
+                cls.fullscreened.pop(win.id, None)
+            cls.place(win.id, name)
+        for con_id in list(cls.ws_wins.get(name, {})):
+            if con_id not in members:
+                cls.unplace(con_id)
+        cls.ws_wins[name] = members
+        cls.workspaces[name] = ws
+
+    @classmethod
+    def on_window(cls, _, event) -> None:
+        """ Patch mirror by window event.
+            _: i3ipc connection.
+            event: i3ipc event. We can extract window from it using
+            event.container. """
+        win = event.container
+        with cls.lock:
+            if event.change == 'close':
+                cls.remove(win.id)
+            elif event.change == 'new':
+                cls.add(win)
+            elif event.change == 'focus':
+                # workspace focus event comes first, so the window is on the
+                # focused workspace
+                cls.replace(win)
+                cls.focused_id = win.id
+                cls.place(win.id, cls.focused_ws)
+            elif event.change == 'move':
+                left = cls.ws_of.get(win.id) == cls.focused_ws
+                cls.replace(win)
+                pending = cls.expected.get(win.id)
+                if pending:
+                    cls.place(win.id, pending.pop(0))
+                    if not pending:
+                        del cls.expected[win.id]
+                else:
+                    cls.unplace(
+                        win.id, away=left and win.scratchpad_state != 'none'
+                    )
+            else:
+                # title, mark, urgent, floating, fullscreen_mode
+                cls.replace(win)
+
+    @classmethod
+    def on_workspace(cls, _, event) -> None:
+        """ Patch mirror by workspace event.
+            _: i3ipc connection.
+            event: i3ipc event. """
+        with cls.lock:
+            if event.change in {'reload', 'restored'} or \
+                    event.current is None:
+                cls.dirty = True
+                return
+            if event.change == 'empty':
+                name = event.current.name
+                for con_id in list(cls.ws_wins.get(name, {})):
+                    cls.unplace(con_id)
+                cls.ws_wins.pop(name, None)
+                cls.workspaces.pop(name, None)
+                return
+            if event.change == 'rename':
+                cls.rename_workspace(event.current)
+            for ws in (event.old, event.current):
+                if ws is not None and ws.type == 'workspace':
+                    cls.place_workspace(ws)
+            if event.change == 'focus':
+                cls.focused_ws = event.current.name
+                focused = event.current.find_focused()
+                if focused is not None and focused.id in cls.wins:
+                    cls.focused_id = focused.id
+
+    @classmethod
+    def rename_workspace(cls, ws) -> None:
+        """ Move windows of the workspace to its new name.
+        ws: renamed workspace container from i3ipc event. """
+        old_name = next((
+            name for name, old_ws in cls.workspaces.items()
+            if old_ws.id == ws.id
+        ), None)
+        if old_name is None or old_name == ws.name:
+            return
+        cls.workspaces.pop(old_name)
+        for con_id in list(cls.ws_wins.get(old_name, {})):
+            cls.unplace(con_id)
+        cls.ws_wins.pop(old_name, None)
+        if cls.focused_ws == old_name:
+            cls.focused_ws = ws.name
+
+    @classmethod
+    def on_output(cls, *_) -> None:
+        """ Outputs are changed, resync on the next read. """
+        cls.dirty = True
@@ -39,8 +39,6 @@ class vol(extension, cfg):
         }
 
     def asyncio_init(self, loop) -> None:
-        # Setup asyncio, because of it is used in another thread.
-        asyncio.set_event_loop(loop)
         asyncio.ensure_future(self.update_mpd_status(loop))
 
     async def update_mpd_status(self, loop) -> None:
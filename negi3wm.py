@@ -3,18 +3,25 @@
 """ i3 negi3wm daemon script.
 
 This module loads all negi3wm an start it via main's manager mailoop.
+i3 events, IPC commands and config watchers are read by one asyncio loop in
+the main thread. Bindings and i3 event handlers of every module run in the
+own thread of the module, see MsgBroker, so module state is changed by one
+thread in the order of its events and commands, and the slow binding delays
+neither other modules nor i3 events.
 Inotify-based watchers for all negi3wm TOML-based configuration spawned here,
 to use it just start it from any place without parameters. Moreover it contains
 pid-lock which prevents running several times.
 
 Usage:
-    ./negi3wm.py [--debug|--tracemalloc|--start]
+    ./negi3wm.py [--debug|--tracemalloc|--start] [--record <file>]
 
 Options:
     --debug         disables signal handlers for debug.
     --tracemalloc   calculates and shows memory tracing with help of
                     tracemalloc.
     --start         make actions for the start, not reloading
+    --record <file> write i3 events and IPC commands to the file to replay
+                    them with bin/replay.py, gzipped if it ends with .gz.
 
 Created by :: Neg
 email :: <serg.zorg@gmail.com>
@@ -29,31 +36,41 @@ import atexit
 import sys
 import signal
 import functools
+import collections
 import importlib
+import traceback
 from importlib import util
 import tracemalloc
-from threading import Thread
 from colored import fg
 
 for m in ["inotipy", "i3ipc", "docopt", "pulsectl",
-          "qtoml", "Xlib", "yaml", "yamlloader", "ewmh", "colored"]:
+          "qtoml", "Xlib", "yaml", "yamlloader", "colored"]:
     if not util.find_spec(m):
         print(f"Cannot import [{m}], please install")
 
 import asyncio
-import inotipy
 
 import i3ipc
 from docopt import docopt
 
 from lib.locker import get_lock
 from lib.msgbroker import MsgBroker
+from lib.extension import extension
+from lib.treemirror import TreeMirror
+from lib.lazymodule import LazyModule
+from lib.startup import StartupProfile
+from lib.latency import Latency
+from lib.cmdbatch import CmdBatch
+from lib.cfg_watcher import CfgWatcher
+from lib.i3events import I3Events
+from lib.negewmh import NegEWMH
+from lib.recorder import Recorder
 from lib.misc import Misc
 from lib.standalone_cfg import modconfig
 from lib.checker import checker
 
 
-class negi3wm(modconfig):
+class negi3wm(extension, modconfig):
     def __init__(self, cmd_args):
         """ Init function
 
@@ -61,6 +78,7 @@ class negi3wm(modconfig):
             connection, connects to the asyncio eventloop.
         """
         loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
         self.tracemalloc_enabled = False
         if cmd_args["--tracemalloc"]:
             self.tracemalloc_enabled = True
@@ -76,6 +94,9 @@ class negi3wm(modconfig):
             def loop_exit(signame):
                 print(f"Got signal {signame}: exit")
                 loop.stop()
+                Recorder.close()
+                CfgWatcher.flush()
+                MsgBroker.close()
                 os._exit(0)
 
             for signame in {'SIGINT', 'SIGTERM'}:
@@ -84,7 +105,8 @@ class negi3wm(modconfig):
                     functools.partial(loop_exit, signame))
             loop.set_exception_handler(None)
 
-        super().__init__()
+        extension.__init__(self)
+        modconfig.__init__(self)
 
         self.loop = loop
         self.mods = {}
@@ -93,13 +115,50 @@ class negi3wm(modconfig):
 
         self.prepare_notification_text()
         self.port = int(str(self.conf('port')))
+        # TCP is an optional fallback for the unix socket.
+        self.use_tcp = bool(self.conf('tcp'))
+        self.set_cfg_watcher()
 
         self.echo = Misc.echo_on
         self.notify = Misc.notify_off
 
+        # Daemon bindings, available as `send negi3wm <binding>`.
+        self.bindings = {
+            "cfg_watcher": self.print_cfg_watcher,
+            "handlers": self.print_handlers,
+            "queues": self.print_queues,
+            "startup_profile": self.print_startup_profile,
+            "stats": self.print_stats,
+            "stats_reset": Latency.reset,
+        }
+
         # main i3ipc connection created here and can be bypassed to the most of
         # modules here.
         self.i3 = i3ipc.Connection()
+        # time every i3 event handler
+        I3Events.add_hook(self.i3, Latency.timed)
+        if cmd_args['--record']:
+            Recorder.install(self.i3, cmd_args['--record'])
+        CmdBatch.init(self.i3)
+        # X property cache should be watched before modules are created, so
+        # properties fetched by their init are cached.
+        NegEWMH.watch(self.loop)
+
+    def set_cfg_watcher(self) -> None:
+        """ Seconds to wait for the end of the config save burst and to
+            coalesce config writes of the daemon. """
+        debounce = self.conf('cfg_debounce')
+        if debounce is not None:
+            CfgWatcher.debounce = float(debounce)
+        write_delay = self.conf('cfg_write_delay')
+        if write_delay is not None:
+            CfgWatcher.write_delay = float(write_delay)
+
+    def reload_config(self):
+        """ Reload negi3wm.toml. Module list, port and workers are used on
+            start only, so only the watcher settings are applied. """
+        self.load_config()
+        self.set_cfg_watcher()
 
     def prepare_notification_text(self):
         """ stuff for startup notifications """
@@ -119,32 +178,120 @@ class negi3wm(modconfig):
         mod_startup_times = []
         main_color, delim_color = fg(249), fg(25)
         delim = f'{delim_color}❯{main_color}'
-        for mod in self.mods:
-            start_time = timeit.default_timer()
-            i3mod = importlib.import_module('lib.' + mod)
-            self.mods[mod] = getattr(i3mod, mod)(self.i3)
-            try:
-                self.mods[mod].asyncio_init(self.loop)
-            except Exception:
-                pass
-            mod_startup_times.append(timeit.default_timer() - start_time)
-            time_elapsed = f'{mod_startup_times[-1]:4f}'
-            mod_loaded_info = f'{main_color}{mod:<14s}{delim}' \
-                f'{time_elapsed:>10s}'
-            self.notification_text += self.msg_prefix + mod_loaded_info + '\n'
-            self.echo(mod_loaded_info, flush=True)
+        # count i3 calls, config parsing, X11 and spawns until modules loaded
+        with StartupProfile.profiling(self.i3):
+            # tree mirror should be subscribed before modules to be patched
+            # before module event handlers are called.
+            with StartupProfile.phase('treemirror', 'init'):
+                TreeMirror.init(self.i3)
+            for mod in self.mods:
+                start_time = timeit.default_timer()
+                with StartupProfile.phase(mod, 'import'):
+                    i3mod = importlib.import_module('lib.' + mod)
+                mod_class = getattr(i3mod, mod)
+                if mod_class.lazy:
+                    self.mods[mod] = LazyModule(
+                        mod, mod_class, self.init_module
+                    )
+                else:
+                    with StartupProfile.phase(mod, 'init'):
+                        self.mods[mod] = self.init_module(mod_class)
+                mod_startup_times.append(timeit.default_timer() - start_time)
+                time_elapsed = f'{mod_startup_times[-1]:4f}'
+                if mod_class.lazy:
+                    time_elapsed = f'lazy {time_elapsed}'
+                mod_loaded_info = f'{main_color}{mod:<14s}{delim}' \
+                    f'{time_elapsed:>10s}'
+                self.notification_text += \
+                    self.msg_prefix + mod_loaded_info + '\n'
+                self.echo(mod_loaded_info, flush=True)
         total_startup_time = str(round(sum(mod_startup_times), 6))
         loading_time_msg = f'{"total":<14s}{delim}' \
             f'{main_color}{total_startup_time:>11s}{fg(240)}'
         self.notification_text += loading_time_msg
         self.echo(loading_time_msg)
-
-    @staticmethod
-    def cfg_mods_watcher():
-        """ cfg watcher to update modules config in realtime. """
-        watcher = inotipy.Watcher.create()
-        watcher.watch(Misc.i3path() + '/cfg/', inotipy.IN.MODIFY)
-        return watcher
+        StartupProfile.finish(lazy=[
+            mod for mod in self.mods
+            if isinstance(self.mods[mod], LazyModule)
+        ])
+
+    def init_module(self, mod_class):
+        """ Create module and attach it to the asyncio loop. Lazy modules
+            are created in the module thread, so the attach is done by the
+            loop itself.
+            mod_class: module class. """
+        mod = mod_class(self.i3)
+        if hasattr(mod, 'asyncio_init'):
+            self.loop.call_soon_threadsafe(self.asyncio_init_module, mod)
+        return mod
+
+    def asyncio_init_module(self, mod) -> None:
+        """ Attach the module to the asyncio loop, called in the loop. """
+        try:
+            mod.asyncio_init(self.loop)
+        except Exception:
+            traceback.print_exc(file=sys.stdout)
+
+    def loaded_mods(self):
+        """ Modules which are created already, lazy modules which were not
+            used yet are skipped. """
+        return [
+            mod for mod in self.mods
+            if not isinstance(self.mods[mod], LazyModule)
+            or self.mods[mod].built
+        ]
+
+    def print_stats(self) -> dict:
+        """ Print latency of bindings and i3 event handlers. """
+        stats = Latency.stats()
+        for line in Latency.report(stats):
+            self.echo(line, flush=True)
+        return stats
+
+    def print_startup_profile(self) -> dict:
+        """ Print startup phases of the last run compared to the previous
+            one. """
+        history = StartupProfile.history()
+        if not history:
+            return {}
+        prev = history[-2] if len(history) > 1 else None
+        for line in StartupProfile.report(history[-1], prev):
+            self.echo(line, flush=True)
+        return {'last': history[-1], 'previous': prev}
+
+    def print_cfg_watcher(self) -> dict:
+        """ Print config watcher counters: inotify events, reloads, events
+            coalesced into the pending reload, skipped events, skipped own
+            writes, own writes done and coalesced. """
+        stats = dict(CfgWatcher.stats)
+        self.echo(
+            ' '.join(f'{key}={val}' for key, val in sorted(stats.items())) +
+            f' debounce={CfgWatcher.debounce}s', flush=True
+        )
+        return stats
+
+    def print_handlers(self) -> dict:
+        """ Print i3 event handlers per event, repeated handlers are shown
+            with the count, so leaked subscriptions are visible. """
+        handlers = extension.subscriptions(self.i3)
+        for event, names in sorted(handlers.items()):
+            counts = collections.Counter(names)
+            self.echo(f'{event}: ' + ', '.join(
+                name if count == 1 else f'{name} x{count}'
+                for name, count in counts.items()
+            ), flush=True)
+        return handlers
+
+    def print_queues(self) -> dict:
+        """ Print command queue depth and wait time for every module. """
+        queue_stats = MsgBroker.queue_stats()
+        for mod, stats in queue_stats.items():
+            self.echo(
+                f'{mod:<16s} depth={stats["depth"]} done={stats["done"]} '
+                f'avg_wait={stats["avg_wait_ms"]:.3f}ms '
+                f'max_wait={stats["max_wait_ms"]:.3f}ms', flush=True
+            )
+        return queue_stats
 
     def autostart(self):
         """ Autostart auto negi3wm initialization """
@@ -153,32 +300,19 @@ class negi3wm(modconfig):
             if circle is not None:
                 circle.bindings['next']('term')
 
-    async def cfg_mods_worker(self, watcher, reload_one=True):
-        """ Reloading configs on change. Reload only appropriate config by
-            default.
-
-            Args:
-                watcher: watcher for cfg.
-        """
-        while True:
-            event = await watcher.get()
-            changed_mod = event.pathname[:-4]
-            if changed_mod in self.mods:
-                if reload_one:
-                    self.mods[changed_mod].bindings['reload']()
-                    self.notify(f'[Reloaded {changed_mod}]')
-                else:
-                    for mod in self.mods:
-                        self.mods[mod].bindings['reload']()
-                    self.notify(
-                        '[Reloaded {' + ','.join(self.mods.keys()) + '}]'
-                    )
+    def cfg_mod_changed(self, name: str) -> None:
+        """ Reload the module of the changed config, once per save.
+            name (str): config file name. """
+        changed_mod = name[:-len('.toml')]
+        # lazy module reads the fresh config when it is created, reload
+        # runs in the module thread after its pending commands
+        if changed_mod in self.loaded_mods():
+            MsgBroker.post(changed_mod, ['reload'])
+            self.notify(f'[Reloaded {changed_mod}]')
 
     def run_config_watchers(self):
-        """ Start all watchers here via ensure_future to run it in
-            background.
-        """
-        asyncio.ensure_future(self.cfg_mods_worker(negi3wm.cfg_mods_watcher()))
+        """ Watch configs of all modules. """
+        CfgWatcher.watch(Misc.i3path() + '/cfg/', None, self.cfg_mod_changed)
 
     def run(self, verbose=False):
         """ Run negi3wm here. """
@@ -198,22 +332,48 @@ class negi3wm(modconfig):
         start(self.load_modules)
         start(self.run_config_watchers)
 
-        # Start modules mainloop.
-        mainloop = Thread(
-            target=MsgBroker.mainloop,
-            args=(self.loop, self.mods, self.port,),
-            daemon=True
-        )
-        start((mainloop).start)
+        # Setup IPC server, it is served by the same loop as i3 events.
+        start(MsgBroker.start, (
+            self.loop, {**self.mods, 'negi3wm': self},
+            self.port, self.use_tcp, None,
+        ))
+        # module event handlers run in module threads
+        I3Events.add_hook(self.i3, MsgBroker.run_handler)
+        # `nop negi3wm <mod> <args>` bindings and ticks are dispatched
+        # directly from i3 events, without the send process.
+        self.subscribe(self.i3, 'binding', MsgBroker.on_binding)
+        self.subscribe(self.i3, 'tick', MsgBroker.on_tick)
 
         if verbose:
             self.echo('... everything loaded ...')
             self.notify(self.notification_text)
         try:
             self.autostart()
-            self.i3.main()
+            self.i3_attach()
+            self.loop.run_forever()
         except KeyboardInterrupt:
+            pass
+        finally:
             self.i3.main_quit()
+            Recorder.close()
+            CfgWatcher.flush()
+            MsgBroker.close()
+
+    def i3_attach(self) -> None:
+        """ Read i3 events from the asyncio loop instead of blocking
+        i3.main(), so events and IPC commands are dispatched by the main
+        thread in the order they come. """
+        self.i3_fd = I3Events.attach(self.i3)
+        self.loop.add_reader(self.i3_fd, self.on_i3_event)
+
+    def on_i3_event(self) -> None:
+        """ Handle one i3 event, stop on i3 shutdown. """
+        try:
+            if I3Events.poll(self.i3):
+                self.loop.remove_reader(self.i3_fd)
+                self.loop.stop()
+        except Exception:
+            traceback.print_exc(file=sys.stdout)
 
 
 def main():
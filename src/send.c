@@ -1,12 +1,16 @@
 #include <stdio.h>
 #include <string.h>
 #include <stdlib.h>
+#include <stddef.h>
+#include <unistd.h>
 
 #include <sys/socket.h>
+#include <sys/un.h>
 #include <netinet/in.h>
 #include <arpa/inet.h>
 
 #define PORT 15555
+#define SOCKET_NAME "negi3wm"
 
 size_t strlcat(char *dst, const char *src, size_t size) {
     size_t srclen;
@@ -25,16 +29,40 @@ size_t strlcat(char *dst, const char *src, size_t size) {
     return (dstlen + srclen);
 }
 
-int main(int argc, char const *argv[]) {
-    struct sockaddr_in serv_addr;
+/* Connect to $XDG_RUNTIME_DIR/negi3wm.sock or to the socket in the private
+ * /tmp/negi3wm-$UID directory if there is no runtime dir. */
+int connect_unix(void) {
+    struct sockaddr_un addr;
+    socklen_t addr_len = sizeof(addr);
+    const char *runtime_dir = getenv("XDG_RUNTIME_DIR");
     int sock = 0;
-    char cmd[1024] = {0};
 
-    for (int i = 1; i < argc; i++) {
-        strlcat(cmd, argv[i], 128);
-        strlcat(cmd, " ", 128);
+    if ((sock = socket(AF_UNIX, SOCK_STREAM, 0)) < 0) {
+        return -1;
+    }
+
+    memset(&addr, '\0', sizeof(addr));
+    addr.sun_family = AF_UNIX;
+    if (runtime_dir != NULL && runtime_dir[0] != '\0') {
+        snprintf(addr.sun_path, sizeof(addr.sun_path),
+                 "%s/%s.sock", runtime_dir, SOCKET_NAME);
+    } else {
+        snprintf(addr.sun_path, sizeof(addr.sun_path),
+                 "/tmp/%s-%u/%s.sock", SOCKET_NAME, (unsigned)getuid(),
+                 SOCKET_NAME);
     }
-    strlcat(cmd, "\n", 128);
+
+    if (connect(sock, (struct sockaddr *)&addr, addr_len) < 0) {
+        close(sock);
+        return -1;
+    }
+    return sock;
+}
+
+/* TCP fallback, daemon should be started with tcp=1 in cfg/negi3wm.toml. */
+int connect_tcp(void) {
+    struct sockaddr_in serv_addr;
+    int sock = 0;
 
     if ((sock = socket(AF_INET, SOCK_STREAM, 0)) < 0) {
         puts("\n Socket creation error \n");
@@ -48,17 +76,126 @@ int main(int argc, char const *argv[]) {
 
     if(inet_pton(AF_INET, "127.0.0.1", &serv_addr.sin_addr)<=0) {
         printf("\nInvalid address/ Address not supported \n");
+        close(sock);
         return -1;
     }
 
-
     if (connect(sock, (struct sockaddr *)&serv_addr, sizeof(serv_addr)) < 0) {
+        close(sock);
+        return -1;
+    }
+    return sock;
+}
+
+/* Read reply line from daemon, print it and return exit status for it. The
+ * reply can be long, like stats or batch results, so the buffer grows until
+ * the newline. */
+int wait_reply(int sock) {
+    size_t size = 4096;
+    size_t len = 0;
+    ssize_t got = 0;
+    char *reply = malloc(size);
+    char *status = NULL;
+    int ret = 1;
+
+    if (reply == NULL) {
+        printf("Out of memory\n");
+        return 1;
+    }
+    for (;;) {
+        if (len == size - 1) {
+            char *grown = realloc(reply, size * 2);
+            if (grown == NULL) {
+                printf("Out of memory\n");
+                free(reply);
+                return 1;
+            }
+            reply = grown;
+            size *= 2;
+        }
+        got = recv(sock, reply + len, size - 1 - len, 0);
+        if (got <= 0) {
+            break;
+        }
+        if (memchr(reply + len, '\n', got) != NULL) {
+            len += got;
+            break;
+        }
+        len += got;
+    }
+    reply[len] = '\0';
+    if (len == 0) {
+        printf("No reply\n");
+        free(reply);
+        return 1;
+    }
+    fputs(reply, stdout);
+    if (reply[len - 1] != '\n') {
+        putchar('\n');
+    }
+    /* the first status in reply is the status of the whole request */
+    status = strstr(reply, "\"status\": ");
+    ret = status == NULL || strncmp(status, "\"status\": \"ok\"", 14) != 0;
+    free(reply);
+    return ret;
+}
+
+int main(int argc, char const *argv[]) {
+    int sock = -1;
+    int use_tcp = 0;
+    int wait = 0;
+    int ret = 0;
+    int argi = 1;
+    size_t len = 0;
+    char cmd[1024] = {0};
+
+    for (; argi < argc && argv[argi][0] == '-'; argi++) {
+        if (strcmp(argv[argi], "-t") == 0) {
+            use_tcp = 1;
+        } else if (strcmp(argv[argi], "-w") == 0) {
+            wait = 1;
+        } else {
+            break;
+        }
+    }
+
+    if (wait) {
+        snprintf(cmd, sizeof(cmd), "@%d ", (int)getpid());
+    }
+    len = strlen(cmd) + 1;
+    for (int i = argi; i < argc; i++) {
+        len += strlen(argv[i]) + 1;
+    }
+    if (len >= sizeof(cmd)) {
+        fprintf(stderr, "Command is too long: %zu bytes, %zu at most\n",
+                len, sizeof(cmd) - 1);
+        return 1;
+    }
+    /* `;` separated commands are sent as one batch with the single reply */
+    for (int i = argi; i < argc; i++) {
+        strlcat(cmd, argv[i], sizeof(cmd) - 1);
+        strlcat(cmd, " ", sizeof(cmd) - 1);
+    }
+    strlcat(cmd, "\n", sizeof(cmd));
+
+    if (!use_tcp) {
+        sock = connect_unix();
+    }
+    if (sock < 0) {
+        sock = connect_tcp();
+    }
+    if (sock < 0) {
         printf("\nConnection Failed \n");
         return -1;
     }
 
-    if (send(sock, cmd, strnlen(cmd, 1024), 0) <= 0) {
+    if (send(sock, cmd, strlen(cmd), 0) <= 0) {
         printf("Send failed");
+        ret = 1;
+    } else if (wait) {
+        shutdown(sock, SHUT_WR);
+        ret = wait_reply(sock);
     }
-    return 0;
+    close(sock);
+    return ret;
 }